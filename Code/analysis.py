@@ -0,0 +1,111 @@
+"""
+Ngữ cảnh phân tích một ảnh: ảnh xám và các mặt phẳng suy ra từ nó (biên
+Canny, Laplacian, Gaussian blur), mỗi mặt phẳng chỉ tính một lần.
+
+auto_suggest_params và process_image đều nhận ImageAnalysis thay cho mảng ảnh,
+nên "gợi ý tham số rồi render" chỉ chuyển ảnh sang xám một lần, và Canny /
+blur mà auto đã tính được dùng lại khi render cần đúng mặt phẳng đó.
+
+    analysis = ImageAnalysis(image_bgr)
+    cfg, sharpness = params_to_config(auto_suggest_params(analysis))
+    result, _ = process_image(analysis, config=cfg, sharpness=sharpness)
+"""
+import threading
+from collections import OrderedDict
+from typing import Dict, Hashable, Optional
+
+import cv2
+import numpy as np
+
+
+class ImageAnalysis:
+    """
+    Ảnh (BGR hoặc chỉ ảnh xám) cùng các mặt phẳng suy ra, tính lười khi cần.
+
+    Các mảng trả về được dùng chung: không sửa tại chỗ. Mặt phẳng phụ thuộc
+    tham số (edges theo ngưỡng, blur theo ksize) được giữ tối đa `max_planes`
+    cái gần nhất; ảnh xám luôn được giữ. Đường render gọi edges(..., keep=False)
+    nên kéo slider ngưỡng Canny không để lại một mặt phẳng đủ độ phân giải cho
+    mỗi cặp ngưỡng (SketchPipeline đã giữ biên hiện tại).
+    An toàn khi dùng từ nhiều thread (ví dụ phân tích trên thread I/O, render
+    trên thread khác).
+    """
+
+    def __init__(
+        self,
+        image: Optional[np.ndarray] = None,
+        gray: Optional[np.ndarray] = None,
+        max_planes: int = 8,
+    ) -> None:
+        if image is None and gray is None:
+            raise ValueError("Cần ảnh BGR hoặc ảnh xám")
+        if gray is None and image.ndim == 2:
+            image, gray = None, image
+        self.image = image
+        self._gray = gray
+        self.max_planes = max(1, int(max_planes))
+        self._planes: "OrderedDict[Hashable, np.ndarray]" = OrderedDict()
+        # số lần mỗi loại mặt phẳng thực sự được tính
+        self.computed: Dict[str, int] = {}
+        self._lock = threading.RLock()
+
+    @property
+    def shape(self):
+        return (self.image if self.image is not None else self._gray).shape
+
+    @property
+    def source(self) -> np.ndarray:
+        """Mảng gốc (BGR nếu có, không thì ảnh xám), dùng làm khoá cache kết quả."""
+        return self.image if self.image is not None else self._gray
+
+    @property
+    def gray(self) -> np.ndarray:
+        with self._lock:
+            if self._gray is None:
+                self._gray = cv2.cvtColor(self.image, cv2.COLOR_BGR2GRAY)
+                self._count("gray")
+            return self._gray
+
+    def _count(self, kind: str) -> None:
+        self.computed[kind] = self.computed.get(kind, 0) + 1
+
+    def _plane(self, key: tuple, compute, keep: bool = True) -> np.ndarray:
+        with self._lock:
+            plane = self._planes.get(key)
+            if plane is not None:
+                self._planes.move_to_end(key)
+                return plane
+            plane = compute()
+            self._count(key[0])
+            if not keep:
+                return plane
+            self._planes[key] = plane
+            while len(self._planes) > self.max_planes:
+                self._planes.popitem(last=False)
+            return plane
+
+    def edges(self, low: int, high: int, keep: bool = True) -> np.ndarray:
+        """
+        Biên Canny của ảnh xám (ngưỡng đã đổi chỗ nếu low > high).
+        keep=False: dùng mặt phẳng đã có nếu trùng ngưỡng, không thì tính mà
+        không giữ lại trong ngữ cảnh.
+        """
+        low, high = sorted((int(low), int(high)))
+        return self._plane(
+            ("edges", low, high), lambda: cv2.Canny(self.gray, low, high), keep
+        )
+
+    def laplacian(self) -> np.ndarray:
+        """Laplacian 3x3, int16 (đủ chứa [-1020, 1020] của ảnh 8-bit)."""
+        return self._plane(("laplacian",), lambda: cv2.Laplacian(self.gray, cv2.CV_16S))
+
+    def blur(self, ksize: int) -> np.ndarray:
+        """GaussianBlur ksize x ksize (sigma tự tính) của ảnh xám."""
+        k = int(ksize)
+        return self._plane(("blur", k), lambda: cv2.GaussianBlur(self.gray, (k, k), 0))
+
+    @property
+    def nbytes(self) -> int:
+        with self._lock:
+            total = sum(plane.nbytes for plane in self._planes.values())
+            return total + (self._gray.nbytes if self._gray is not None else 0)
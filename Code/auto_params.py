@@ -1,24 +1,270 @@
+from dataclasses import replace
+from typing import Any, Dict, List, Optional, Tuple, Union
+
 import cv2
 import numpy as np
 
+from analysis import ImageAnalysis
+from config import AppConfig
+
+
+# Ước lượng trên ảnh lấy mẫu: nhiều dải mỏng _STRIP pixel, cả theo hàng lẫn theo
+# cột, mỗi dải ở vị trí ngẫu nhiên (seed cố định) trong một khoảng chia đều của
+# ảnh (lấy mẫu phân tầng). Mỗi dải được đệm thêm _STRIP_HALO pixel (đủ cho
+# Gaussian 9x9, gradient của Canny và Laplacian). Riêng hysteresis của Canny có
+# thể nối biên đi xa tuỳ ý nên được kẹp giữa hai cận, xem _stacked_edges.
+_STRIP = 8
+_STRIP_HALO = 8
+_SAMPLE_SEED = 0
+# chi phí mỗi pixel mẫu (kể cả halo) so với một pixel khi tính trên cả ảnh
+# (hai lượt Canny + gán nhãn thành phần liên thông, đo trên ảnh 4000x3000)
+_SAMPLE_COST = 2.5
+# ít dải hơn thì sai số chuẩn jackknife không đáng tin -> tính trên cả ảnh
+_MIN_STRIPS = 8
+# cận sai số = ERROR_SIGMAS sai số chuẩn (~99.7% nếu phân phối chuẩn)
+ERROR_SIGMAS = 3.0
+# ngưỡng Canny và kernel Gaussian dùng cho thống kê
+_STATS_CANNY = (80, 160)
+_STATS_BLUR = 9
+
+# số dòng ở mép cửa sổ (không phải mép ảnh) có gradient / NMS của Canny bị sai
+_CANNY_REACH = 2
+
+# các tổng tích luỹ của mỗi dải
+_COUNT, _GRAY, _GRAY_SQ, _LAP, _LAP_SQ, _EDGES, _CANDIDATES, _ABSDIFF = range(8)
+
+
+def _sample_strips(length: int, n_strips: int, rng: np.random.Generator) -> List[Tuple[int, int]]:
+    """n_strips dải [a, a + _STRIP), dải thứ i nằm ngẫu nhiên trong khoảng thứ i của [0, length)."""
+    stride = length / float(n_strips)
+    strips = []
+    for i in range(n_strips):
+        lo = int(i * stride)
+        hi = max(lo, int((i + 1) * stride) - _STRIP)
+        a = int(rng.integers(lo, hi + 1))
+        strips.append((a, min(length, a + _STRIP)))
+    return strips
+
 
-def auto_suggest_params(gray: np.ndarray):
-    h, w = gray.shape
+def _stacked_edges(
+    stacked: np.ndarray, cuts: List[int], inners: List[slice], axis: int
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    (biên chắc chắn, ứng viên) của Canny(_STATS_CANNY) trên các cửa sổ đã ghép.
+
+    Ứng viên = pixel qua NMS có gradient > ngưỡng thấp: chứa mọi pixel biên của
+    Canny trên cả ảnh. Biên chắc chắn = ứng viên nối (8 hướng) với một pixel >
+    ngưỡng cao, sau khi xoá _CANNY_REACH dòng kể từ mỗi vị trí trong `cuts`
+    (chỗ ghép và mép cửa sổ không phải mép ảnh: gradient / NMS ở đó sai, và
+    việc xoá tách rời các cửa sổ): chỉ gồm pixel biên của Canny trên cả ảnh.
+    Vậy số biên thật của phần lõi nằm giữa hai số đếm này. Biên chắc chắn chỉ
+    được điền ở phần lõi (`inners`).
+    """
+    low, high = _STATS_CANNY
+    # gradient tính một lần cho cả hai lượt Canny (viền REPLICATE như trong cv2.Canny)
+    dx = cv2.Sobel(stacked, cv2.CV_16S, 1, 0, borderType=cv2.BORDER_REPLICATE)
+    dy = cv2.Sobel(stacked, cv2.CV_16S, 0, 1, borderType=cv2.BORDER_REPLICATE)
+    candidates = cv2.Canny(dx, dy, low, low)
+    strong = cv2.Canny(dx, dy, high, high)
+    for cut in cuts:
+        part = slice(cut, cut + _CANNY_REACH)
+        index = (part, slice(None)) if axis == 0 else (slice(None), part)
+        candidates[index] = 0
+        strong[index] = 0
+    n_labels, labels = cv2.connectedComponents(candidates, connectivity=8)
+    seeded = np.zeros(n_labels, np.uint8)
+    seeds = cv2.findNonZero(strong)
+    if seeds is not None:
+        seeds = seeds.reshape(-1, 2)   # (x, y)
+        seeded[labels[seeds[:, 1], seeds[:, 0]]] = 255
+    seeded[0] = 0
+    edges = np.zeros_like(candidates)
+    for inner in inners:
+        index = (inner, slice(None)) if axis == 0 else (slice(None), inner)
+        edges[index] = seeded[labels[index]]
+    # các dòng bị xoá nằm trong halo nên không làm thiếu ứng viên của phần lõi
+    return edges, candidates
+
+
+def _strip_sums(
+    window: np.ndarray,
+    inner: Tuple[slice, slice],
+    planes: Optional[Tuple[np.ndarray, np.ndarray, np.ndarray]] = None,
+    candidates: Optional[np.ndarray] = None,
+) -> np.ndarray:
+    """
+    Các tổng của phần `inner` trong cửa sổ (đã có halo).
+    planes: (edges, laplacian, blur) đã tính sẵn cho cả cửa sổ.
+    candidates: ứng viên biên (xem _stacked_edges); None -> edges là biên chính xác.
+    """
+    if planes is None:
+        planes = (
+            cv2.Canny(window, *_STATS_CANNY),
+            cv2.Laplacian(window, cv2.CV_16S),
+            cv2.GaussianBlur(window, (_STATS_BLUR, _STATS_BLUR), 0),
+        )
+    edges, lap, blur9 = (plane[inner] for plane in planes)
+    core = window[inner]
+    count = core.size
+    sums = np.zeros(8)
+    sums[_COUNT] = count
+    mean, std = cv2.meanStdDev(core)
+    sums[_GRAY] = mean[0, 0] * count
+    sums[_GRAY_SQ] = (std[0, 0] ** 2 + mean[0, 0] ** 2) * count
+    sums[_EDGES] = cv2.countNonZero(edges)
+    sums[_CANDIDATES] = sums[_EDGES] if candidates is None else cv2.countNonZero(candidates[inner])
+    mean, std = cv2.meanStdDev(lap)
+    sums[_LAP] = mean[0, 0] * count
+    sums[_LAP_SQ] = (std[0, 0] ** 2 + mean[0, 0] ** 2) * count
+    sums[_ABSDIFF] = cv2.sumElems(cv2.absdiff(core, blur9))[0]
+    return sums
+
+
+def _stacked_sums(gray: np.ndarray, strips: List[Tuple[int, int]], axis: int) -> List[np.ndarray]:
+    """
+    Tổng của từng dải (theo hàng: axis=0, theo cột: axis=1). Các cửa sổ (dải +
+    halo) được ghép liền nhau thành một ảnh để Laplacian / blur chỉ chạy một
+    lần (bán kính <= halo nên chỗ ghép không ảnh hưởng tới phần lõi). Canny
+    cũng chạy một lần, hysteresis không đi qua chỗ ghép (xem _stacked_edges).
+    """
+    length = gray.shape[axis]
+    windows, inners, cuts = [], [], []
+    offset = 0
+    for a, b in strips:
+        wa, wb = max(0, a - _STRIP_HALO), min(length, b + _STRIP_HALO)
+        windows.append(gray[wa:wb] if axis == 0 else gray[:, wa:wb])
+        inners.append(slice(offset + a - wa, offset + b - wa))
+        if wa > 0:
+            cuts.append(offset)
+        offset += wb - wa
+        if wb < length:
+            cuts.append(offset - _CANNY_REACH)
+    stacked = np.concatenate(windows, axis=axis)
+    edges, candidates = _stacked_edges(stacked, cuts, inners, axis)
+    planes = (
+        # Canny với ngưỡng trung bình để đánh giá mật độ biên (cận dưới)
+        edges,
+        # Laplacian 3x3 của ảnh 8-bit nằm trong [-1020, 1020] -> đủ chứa trong int16
+        cv2.Laplacian(stacked, cv2.CV_16S),
+        cv2.GaussianBlur(stacked, (_STATS_BLUR, _STATS_BLUR), 0),
+    )
+    full = slice(None)
+    return [
+        _strip_sums(stacked, (inner, full) if axis == 0 else (full, inner), planes, candidates)
+        for inner in inners
+    ]
+
+
+def _metrics(sums: np.ndarray, size: int) -> Dict[str, float]:
+    n = max(sums[_COUNT], 1.0)
+    gray_mean = sums[_GRAY] / n
+    lap_mean = sums[_LAP] / n
+    # Canny chỉ trả về 0 hoặc 255: mọi pixel biên đều là biên "mạnh" (> 200),
+    # không có biên "yếu" (50 < v <= 200). Số đếm được quy về cả ảnh để không
+    # co lại theo sample_fraction.
+    strong_edges = sums[_EDGES] * size / n
+    weak_edges = 0
+    return {
+        "contrast": float(np.sqrt(max(sums[_GRAY_SQ] / n - gray_mean ** 2, 0.0))),
+        "edge_density": float(255.0 * sums[_EDGES] / n),   # 0–255
+        "noise_level": float(max(sums[_LAP_SQ] / n - lap_mean ** 2, 0.0)),
+        "smoothness": float(sums[_ABSDIFF] / n),
+        "strong_ratio": float(strong_edges / max(weak_edges, 1)),
+    }
+
+
+def sampled_statistics(
+    gray: Union[np.ndarray, ImageAnalysis], sample_fraction: float = 1.0
+) -> Tuple[Dict[str, float], Dict[str, float]]:
+    """
+    (thống kê, cận sai số) — xem image_statistics.
+
+    Cận sai số của mỗi chỉ số = ERROR_SIGMAS x sai số chuẩn jackknife (bỏ lần
+    lượt từng dải) x sqrt(1 - tỉ lệ pixel đã lấy mẫu). Với edge_density và
+    strong_ratio, số biên mẫu là cận dưới (hysteresis bị cắt ở mép cửa sổ) nên
+    cận được cộng thêm khoảng cách tới số ứng viên biên (cận trên, xem
+    _stacked_edges). Ước lượng lệch khỏi giá trị tính trên cả ảnh quá cận này
+    với xác suất ~0.3% (xấp xỉ chuẩn). Ảnh
+    quá nhỏ để có ít nhất _MIN_STRIPS dải mỗi chiều, hoặc sample_fraction đủ
+    lớn để lấy mẫu không rẻ hơn, được tính trên cả ảnh và cận bằng 0.
+    """
+    analysis = gray if isinstance(gray, ImageAnalysis) else None
+    if analysis is not None:
+        gray = analysis.gray
+    h, w = gray.shape[:2]
+    fraction = min(max(float(sample_fraction), 0.0), 1.0)
+    # nửa số pixel mẫu theo hàng, nửa theo cột
+    n_rows = int(round(h * fraction / (2 * _STRIP)))
+    n_cols = int(round(w * fraction / (2 * _STRIP)))
+    # chi phí lấy mẫu quy ra số pixel của lượt tính trên cả ảnh
+    cost = (n_rows * w + n_cols * h) * (_STRIP + 2 * _STRIP_HALO) * _SAMPLE_COST
+
+    if fraction >= 1.0 or min(n_rows, n_cols) < _MIN_STRIPS or cost >= gray.size:
+        # tính trên cả ảnh (chính xác); với ImageAnalysis, Canny / Laplacian / blur được lấy
+        # từ (và để lại trong) ngữ cảnh đó cho bước render dùng lại
+        planes = None
+        if analysis is not None:
+            planes = (analysis.edges(*_STATS_CANNY), analysis.laplacian(), analysis.blur(_STATS_BLUR))
+        stats = _metrics(_strip_sums(gray, (slice(None), slice(None)), planes), gray.size)
+        return stats, {name: 0.0 for name in stats}
+
+    rng = np.random.default_rng(_SAMPLE_SEED)
+    units = _stacked_sums(gray, _sample_strips(h, n_rows, rng), axis=0)
+    units += _stacked_sums(gray, _sample_strips(w, n_cols, rng), axis=1)
+    totals = np.sum(units, axis=0)
+    stats = _metrics(totals, gray.size)
+
+    n = len(units)
+    leave_one_out = [_metrics(totals - unit, gray.size) for unit in units]
+    covered = min(1.0, totals[_COUNT] / float(gray.size))
+    # phần biên có thể bị bỏ sót do cắt hysteresis, theo thang của từng chỉ số
+    gap = (totals[_CANDIDATES] - totals[_EDGES]) / totals[_COUNT]
+    bias = {"edge_density": 255.0 * gap, "strong_ratio": gap * gray.size}
+    errors: Dict[str, float] = {}
+    for name in stats:
+        values = np.array([m[name] for m in leave_one_out])
+        se = np.sqrt((n - 1) / float(n) * np.sum((values - values.mean()) ** 2))
+        errors[name] = float(ERROR_SIGMAS * se * np.sqrt(1.0 - covered) + bias.get(name, 0.0))
+    return stats, errors
+
+
+def image_statistics(
+    gray: Union[np.ndarray, ImageAnalysis], sample_fraction: float = 1.0
+) -> Dict[str, float]:
+    """
+    Tính các chỉ số dùng cho auto_suggest_params:
+    contrast, edge_density, noise_level, smoothness, strong_ratio.
+
+    Chỉ dùng bộ tích luỹ số nguyên / float32 của OpenCV (không tạo mảng float64
+    cỡ cả ảnh). sample_fraction < 1 ước lượng trên khoảng chừng ấy phần pixel,
+    lấy theo nhiều dải mỏng cả hàng lẫn cột; cận sai số của ước lượng: xem
+    sampled_statistics. strong_ratio (đếm pixel biên) được quy đổi theo tỉ lệ
+    pixel cả ảnh / pixel mẫu nên có cùng thang với khi tính trên cả ảnh.
+    gray có thể là ImageAnalysis: khi tính trên cả ảnh, Canny / Laplacian / blur
+    được lấy từ (và để lại trong) ngữ cảnh đó cho bước render dùng lại.
+    """
+    return sampled_statistics(gray, sample_fraction)[0]
+
+
+def auto_suggest_params(gray: Union[np.ndarray, ImageAnalysis], sample_fraction: float = 1.0):
+    """
+    Gợi ý tham số sketch từ thống kê ảnh xám (hoặc ImageAnalysis, xem image_statistics).
+    sample_fraction < 1: ước lượng thống kê trên một phần ảnh (nhanh hơn, dùng cho
+    catalogue lớn); 1.0 cho kết quả giống hệt tính trên cả ảnh.
+    """
+    stats = image_statistics(gray, sample_fraction)
 
     # 1) CONTRAST (độ tương phản)
-    contrast = gray.std()
+    contrast = stats["contrast"]
 
     # 2) EDGE DENSITY (mật độ biên)
-    edges_tmp = cv2.Canny(gray, 80, 160) # Sử dụng ngưỡng trung bình để đánh giá mật độ biên
-    edge_density = edges_tmp.mean()   # 0–255
+    edge_density = stats["edge_density"]   # 0–255
 
+    # 3) NOISE LEVEL (độ nhiễu): phương sai của Laplacian
+    noise_level = stats["noise_level"]
 
-    # 3) NOISE LEVEL (độ nhiễu)
-    noise_level = cv2.Laplacian(gray, cv2.CV_64F).var()
-
-    # 4) SMOOTHNESS 
-    blur9 = cv2.GaussianBlur(gray, (9, 9), 0)
-    smoothness = np.mean(np.abs(gray.astype(float) - blur9.astype(float)))
+    # 4) SMOOTHNESS: trung bình |gray - GaussianBlur 9x9|
+    smoothness = stats["smoothness"]
 
     # smoothness:
     # - cao  (>= 25)  → ảnh tự nhiên (phong cảnh, da mặt…)
@@ -26,9 +272,7 @@ def auto_suggest_params(gray: np.ndarray):
 
     # 5) STRONG-EDGE RATIO
     #    -> Nhận biết biên "thật"
-    strong_edges = np.sum(edges_tmp > 200)
-    weak_edges   = np.sum((edges_tmp > 50) & (edges_tmp <= 200))
-    strong_ratio = strong_edges / max(weak_edges, 1) # tỉ lệ biên mạnh / biên yếu
+    strong_ratio = stats["strong_ratio"]  # tỉ lệ biên mạnh / biên yếu
     #strong_ratio > 0.35  => nhiều biên thật (logo, chữ, hình học)
     #strong_ratio < 0.35 và > 0.1   => ảnh tự nhiên (phong cảnh, chân dung)
     #strong_ratio < 0.1   => ảnh mờ, ít chi tiết (phong cảnh sương mù, chân dung thiếu sáng)
@@ -89,3 +333,21 @@ def auto_suggest_params(gray: np.ndarray):
         "smoothness": smoothness,
         "strong_ratio": strong_ratio,
     }
+
+
+def params_to_config(params: Dict[str, Any], base: Optional[AppConfig] = None) -> Tuple[AppConfig, int]:
+    """
+    (AppConfig, sharpness) ứng với kết quả của auto_suggest_params.
+    Các tham số không được gợi ý (diameter, backend, ...) giữ theo `base`.
+    """
+    base = base or AppConfig()
+    config = replace(
+        base,
+        edge=replace(base.edge, low_threshold=int(params["canny_low"]),
+                     high_threshold=int(params["canny_high"])),
+        smooth=replace(base.smooth, sigma_color=float(params["sigma_color"]),
+                       sigma_space=float(params["sigma_space"]),
+                       iterations=int(params["iterations"])),
+        sketch=replace(base.sketch, blur_ksize=int(params["blur_ksize"])),
+    )
+    return config, int(params["sharpness"])
@@ -0,0 +1,516 @@
+"""
+Chế độ batch (không cần GUI): chuyển cả thư mục ảnh thành tranh vẽ chì,
+chia việc cho nhiều process để tận dụng hết các nhân CPU.
+Với --auto, tham số của từng ảnh được chọn bằng auto_suggest_params; tham số
+đã dùng và thời gian từng bước được ghi vào manifest (.csv / .jsonl).
+
+Ví dụ:
+    python batch.py examples out --recursive --workers 8 --chunksize 16
+    python batch.py examples out --auto --manifest out/manifest.csv
+"""
+import argparse
+import csv
+import json
+import os
+import sys
+import time
+from collections import deque
+from concurrent.futures import Future
+from dataclasses import dataclass, field, replace
+from typing import Any, Deque, Dict, Iterator, List, Optional, Sequence, Tuple, Union
+
+import numpy as np
+
+from analysis import ImageAnalysis
+from auto_params import auto_suggest_params, params_to_config
+from config import AppConfig
+from image_processing import (
+    OUTPUT_FORMATS,
+    SketchWorkspace,
+    process_image,
+    to_output_format,
+)
+from io_utils import (
+    AsyncImageWriter,
+    FrameStore,
+    iter_images,
+    load_frame,
+    prefetch_images,
+    save_image,
+)
+from result_cache import ResultCache
+from runtime import add_runtime_arguments, apply_runtime, process_pool, runtime_from_args
+from smoothing import SMOOTHING_BACKENDS
+from tiling import process_image_tiled
+
+
+@dataclass
+class BatchSettings:
+    """Thiết lập dùng chung cho mọi ảnh trong một lần chạy (được gửi sang process con)."""
+    config: AppConfig
+    sharpness: int = 50
+    # nếu đặt: xử lý theo tile trong giới hạn bộ nhớ này (MB)
+    memory_budget_mb: Optional[float] = None
+    # nếu đặt: cache kết quả trên đĩa, dùng chung giữa các process và các lần chạy
+    cache_dir: Optional[str] = None
+    cache_mb: float = 2048.0
+    # "gray": ghi ảnh 1 kênh (nhỏ hơn, mã hoá nhanh hơn); "bgr": 3 kênh như trước
+    output_format: str = "gray"
+    # nếu đặt: đọc ảnh đã giải mã từ FrameStore (mmap) thay vì giải mã lại
+    frame_store: Optional[str] = None
+    # chọn tham số cho từng ảnh bằng auto_suggest_params (thống kê trên auto_sample phần ảnh)
+    auto: bool = False
+    auto_sample: float = 1.0
+
+
+# (đường dẫn nguồn, đường dẫn đích, thiết lập)
+Task = Tuple[str, str, BatchSettings]
+# (đường dẫn nguồn, lỗi hoặc None, thông tin cho manifest)
+Outcome = Tuple[str, Optional[str], Dict[str, Any]]
+
+# cache và buffer của process hiện tại (mỗi process con tạo một lần)
+_worker_cache: Optional[ResultCache] = None
+_worker_store: Optional[FrameStore] = None
+_worker_workspace = SketchWorkspace()
+
+
+def _get_worker_cache(settings: BatchSettings) -> Optional[ResultCache]:
+    global _worker_cache
+    if not settings.cache_dir:
+        return None
+    if _worker_cache is None:
+        _worker_cache = ResultCache(
+            memory_mb=64, disk_dir=settings.cache_dir, disk_mb=settings.cache_mb
+        )
+    return _worker_cache
+
+
+def _get_worker_store(settings: BatchSettings) -> Optional[FrameStore]:
+    global _worker_store
+    if not settings.frame_store:
+        return None
+    if _worker_store is None or _worker_store.directory != os.path.abspath(settings.frame_store):
+        _worker_store = FrameStore(settings.frame_store)
+    return _worker_store
+
+
+@dataclass
+class BatchReport:
+    """Tổng kết một lần chạy batch."""
+    total: int = 0
+    succeeded: int = 0
+    failures: List[Tuple[str, str]] = field(default_factory=list)
+    elapsed: float = 0.0
+
+
+def output_path_for(src: str, input_dir: str, output_dir: str, ext: str) -> str:
+    """Giữ nguyên cấu trúc thư mục con, chỉ đổi phần mở rộng."""
+    rel = os.path.relpath(src, input_dir)
+    stem, _ = os.path.splitext(rel)
+    return os.path.join(output_dir, stem + ext)
+
+
+def _render(image: Union[np.ndarray, ImageAnalysis], settings: BatchSettings) -> np.ndarray:
+    """
+    Sketch một ảnh (hoặc ImageAnalysis của nó) theo thiết lập batch.
+    Kết quả có thể nằm trong buffer của _worker_workspace: dùng xong trước ảnh kế tiếp.
+    """
+    cache = _get_worker_cache(settings)
+    if settings.memory_budget_mb:
+        if isinstance(image, ImageAnalysis):
+            image = image.source   # tile được cắt từ ảnh BGR
+        result = None
+        if cache is not None:
+            key = cache.key(image, "pencil", settings.config, settings.sharpness)
+            result, _ = cache.get(key)
+        if result is None:
+            # đã song song theo process nên mỗi ảnh chỉ dùng một thread
+            result = process_image_tiled(
+                image, mode="pencil", config=settings.config,
+                sharpness=settings.sharpness,
+                memory_budget_mb=settings.memory_budget_mb, workers=1,
+                output="gray",
+            )
+            if cache is not None:
+                cache.put(key, result)
+        return to_output_format(result, settings.output_format)
+
+    # ảnh cùng kích thước dùng lại buffer trung gian
+    result, _ = process_image(
+        image, mode="pencil", config=settings.config,
+        sharpness=settings.sharpness, cache=cache, workspace=_worker_workspace,
+        output=settings.output_format,
+    )
+    return result
+
+
+def _ms(start: float) -> float:
+    return (time.perf_counter() - start) * 1000.0
+
+
+def _tune(
+    image: np.ndarray, settings: BatchSettings
+) -> Tuple[Union[np.ndarray, ImageAnalysis], BatchSettings, Dict[str, Any]]:
+    """
+    Thiết lập cho riêng ảnh này: với settings.auto, cấu hình và sharpness lấy
+    từ auto_suggest_params (tham số không được gợi ý giữ theo settings.config).
+    Trả về thêm đầu vào cho _render: ImageAnalysis khi có phân tích, để render
+    dùng lại ảnh xám (và biên Canny nếu trùng ngưỡng) thay vì tính lại.
+    """
+    if not settings.auto:
+        return image, settings, {}
+    start = time.perf_counter()
+    analysis = ImageAnalysis(image)
+    params = auto_suggest_params(analysis, settings.auto_sample)
+    config, sharpness = params_to_config(params, settings.config)
+    info = {name: params[name] for name in AUTO_STATS}
+    info["analyze_ms"] = _ms(start)
+    return analysis, replace(settings, config=config, sharpness=sharpness), info
+
+
+def _params_info(settings: BatchSettings) -> Dict[str, Any]:
+    cfg = settings.config
+    return {
+        "sharpness": settings.sharpness,
+        "canny_low": cfg.edge.low_threshold,
+        "canny_high": cfg.edge.high_threshold,
+        "diameter": cfg.smooth.diameter,
+        "sigma_color": cfg.smooth.sigma_color,
+        "sigma_space": cfg.smooth.sigma_space,
+        "iterations": cfg.smooth.iterations,
+        "blur_ksize": cfg.sketch.blur_ksize,
+    }
+
+
+def _sketch_one(task: Task) -> Outcome:
+    """
+    Xử lý một ảnh trong process con.
+    Lỗi của từng file được bắt lại để không làm hỏng cả batch.
+    """
+    src, dst, settings = task
+    info: Dict[str, Any] = {"output": dst}
+    try:
+        start = time.perf_counter()
+        image = load_frame(src, _get_worker_store(settings))
+        info["load_ms"] = _ms(start)
+        subject, tuned, tuning = _tune(image, settings)
+        info.update(tuning)
+        info.update(_params_info(tuned))
+        start = time.perf_counter()
+        result = _render(subject, tuned)
+        info["render_ms"] = _ms(start)
+        start = time.perf_counter()
+        save_image(dst, result)
+        info["save_ms"] = _ms(start)
+    except Exception as exc:
+        return src, f"{type(exc).__name__}: {exc}", info
+    return src, None, info
+
+
+def _sketch_pipelined(
+    tasks: Sequence[Task], writer: AsyncImageWriter, io_threads: int
+) -> Iterator[Outcome]:
+    """
+    Chạy tuần tự trong process hiện tại nhưng đọc trước và ghi nền trên các
+    thread I/O, để tầng sketch không phải chờ hệ thống file (ví dụ ổ mạng).
+    Với auto, phân tích ảnh cũng chạy trên thread I/O, chồng lên render của ảnh trước.
+    Kết quả của một ảnh chỉ được trả về khi ghi nền đã xong (theo thứ tự ảnh),
+    nên lỗi ghi nằm ngay trong kết quả của ảnh đó.
+    """
+    targets = {src: (dst, settings) for src, dst, settings in tasks}
+    store = _get_worker_store(tasks[0][2])
+    # (src, lỗi, info, Future của lần ghi nền hoặc None, lúc đưa vào hàng đợi ghi)
+    pending: Deque[Tuple[str, Optional[str], Dict[str, Any], Optional[Future], float]] = deque()
+
+    def finished(wait: bool) -> Iterator[Outcome]:
+        while pending and (wait or pending[0][3] is None or pending[0][3].done()):
+            src, error, info, write, submitted = pending.popleft()
+            if write is not None:
+                error = write.result()
+                if error is None:
+                    info["save_ms"] = _ms(submitted)
+            yield src, error, info
+
+    def load(path: str) -> Tuple[Union[np.ndarray, ImageAnalysis], BatchSettings, Dict[str, Any]]:
+        start = time.perf_counter()
+        image = load_frame(path, store)
+        info: Dict[str, Any] = {"load_ms": _ms(start)}
+        subject, tuned, tuning = _tune(image, targets[path][1])
+        info.update(tuning)
+        info.update(_params_info(tuned))
+        return subject, tuned, info
+
+    loaded = prefetch_images(
+        (src for src, _, _ in tasks), workers=io_threads, ahead=2 * io_threads,
+        loader=load,
+    )
+    for src, item, error in loaded:
+        dst = targets[src][0]
+        if error is not None:
+            pending.append((src, f"{type(error).__name__}: {error}", {"output": dst}, None, 0.0))
+            yield from finished(False)
+            continue
+        image, tuned, info = item
+        info["output"] = dst
+        try:
+            start = time.perf_counter()
+            # ghi nền -> chép kết quả ra khỏi buffer dùng lại
+            result = np.array(_render(image, tuned))
+            info["render_ms"] = _ms(start)
+            # save_ms: từ lúc đưa vào hàng đợi ghi tới khi ghi xong
+            submitted = time.perf_counter()
+            pending.append((src, None, info, writer.submit(dst, result), submitted))
+        except Exception as exc:
+            pending.append((src, f"{type(exc).__name__}: {exc}", info, None, 0.0))
+        yield from finished(False)
+    yield from finished(True)
+
+
+# ---------- manifest ----------
+
+# thống kê của auto_suggest_params được ghi kèm
+AUTO_STATS = ("contrast", "edge_density", "noise_level", "smoothness")
+MANIFEST_FIELDS = (
+    "source", "output", "status", "error",
+    "load_ms", "analyze_ms", "render_ms", "save_ms",
+    "sharpness", "canny_low", "canny_high", "diameter",
+    "sigma_color", "sigma_space", "iterations", "blur_ksize",
+) + AUTO_STATS
+
+
+class Manifest:
+    """
+    Một dòng cho mỗi ảnh: tham số đã dùng và thời gian từng bước (ms).
+    Định dạng theo phần mở rộng: .csv, còn lại là JSON Lines.
+    """
+
+    def __init__(self, path: str) -> None:
+        folder = os.path.dirname(path)
+        if folder:
+            os.makedirs(folder, exist_ok=True)
+        self._file = open(path, "w", newline="", encoding="utf-8")
+        self._csv: Optional[csv.DictWriter] = None
+        if path.lower().endswith(".csv"):
+            self._csv = csv.DictWriter(self._file, fieldnames=MANIFEST_FIELDS, extrasaction="ignore")
+            self._csv.writeheader()
+
+    def write(self, source: str, error: Optional[str], info: Dict[str, Any]) -> None:
+        row: Dict[str, Any] = {"source": source, "status": "ok" if error is None else "error",
+                               "error": error}
+        for name, value in info.items():
+            row[name] = round(value, 2) if name.endswith("_ms") else value
+        row = {name: row[name] for name in MANIFEST_FIELDS if name in row}
+        if self._csv is not None:
+            self._csv.writerow(row)
+        else:
+            self._file.write(json.dumps(row, ensure_ascii=False) + "\n")
+
+    def close(self) -> None:
+        self._file.close()
+
+    def __enter__(self) -> "Manifest":
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+
+def run_batch(
+    input_dir: str,
+    output_dir: str,
+    config: Optional[AppConfig] = None,
+    sharpness: int = 50,
+    recursive: bool = False,
+    workers: Optional[int] = None,
+    chunksize: int = 8,
+    ext: str = ".png",
+    memory_budget_mb: Optional[float] = None,
+    cache_dir: Optional[str] = None,
+    cache_mb: float = 2048.0,
+    output_format: str = "gray",
+    io_threads: int = 4,
+    frame_store: Optional[str] = None,
+    auto: bool = False,
+    auto_sample: float = 1.0,
+    manifest: Optional[str] = None,
+    verbose: bool = True,
+) -> BatchReport:
+    """
+    Sketch toàn bộ ảnh trong `input_dir`, ghi kết quả vào `output_dir`.
+    workers=None -> dùng os.cpu_count(); workers=1 -> chạy tuần tự trong process hiện tại.
+    memory_budget_mb: nếu đặt, mỗi ảnh được xử lý theo tile trong giới hạn bộ nhớ này.
+    cache_dir: nếu đặt, bỏ qua ảnh đã render với cùng cấu hình (cache theo nội dung).
+    output_format: "gray" (ảnh 1 kênh) hoặc "bgr".
+    io_threads: số thread đọc trước / ghi nền khi chạy tuần tự (workers=1).
+    config.runtime: số thread OpenCV / BLAS, gán nhân CPU cho process con (xem runtime.py).
+    frame_store: thư mục FrameStore; ảnh chưa có được giải mã vào kho trước,
+    các lần chạy sau (và process con) đọc thẳng từ mmap.
+    auto: chọn tham số cho từng ảnh bằng auto_suggest_params (config chỉ cung cấp
+    các tham số không được gợi ý); auto_sample: tỉ lệ ảnh dùng để tính thống kê.
+    manifest: file .csv / .jsonl ghi tham số và thời gian của từng ảnh.
+    """
+    if config is None:
+        config = AppConfig()
+    if not ext.startswith("."):
+        ext = "." + ext
+
+    settings = BatchSettings(
+        config=config,
+        sharpness=sharpness,
+        memory_budget_mb=memory_budget_mb,
+        cache_dir=cache_dir,
+        cache_mb=cache_mb,
+        output_format=output_format,
+        frame_store=frame_store,
+        auto=auto,
+        auto_sample=auto_sample,
+    )
+    tasks: List[Task] = [
+        (src, output_path_for(src, input_dir, output_dir, ext), settings)
+        for src in iter_images(input_dir, recursive=recursive)
+    ]
+
+    report = BatchReport(total=len(tasks))
+    if not tasks:
+        return report
+
+    workers = max(1, workers or os.cpu_count() or 1)
+    chunksize = max(1, int(chunksize))
+    io_threads = max(1, int(io_threads))
+    start = time.perf_counter()
+
+    if frame_store:
+        # lỗi đọc được báo lại khi xử lý từng ảnh
+        FrameStore(frame_store).update((src for src, _, _ in tasks), workers=io_threads)
+
+    log = Manifest(manifest) if manifest else None
+    try:
+        if workers == 1:
+            apply_runtime(config.runtime)
+            with AsyncImageWriter(workers=io_threads, max_queue=2 * io_threads) as writer:
+                _collect(_sketch_pipelined(tasks, writer, io_threads), report, verbose, log)
+        else:
+            with process_pool(workers, config.runtime) as pool:
+                results = pool.map(_sketch_one, tasks, chunksize=chunksize)
+                _collect(results, report, verbose, log)
+    finally:
+        if log is not None:
+            log.close()
+
+    report.elapsed = time.perf_counter() - start
+    return report
+
+
+def _collect(results, report: BatchReport, verbose: bool, log: Optional[Manifest] = None) -> None:
+    for done, (src, error, info) in enumerate(results, start=1):
+        if log is not None:
+            log.write(src, error, info)
+        if error is None:
+            report.succeeded += 1
+        else:
+            report.failures.append((src, error))
+            if verbose:
+                print(f"[lỗi] {src}: {error}", file=sys.stderr)
+        if verbose and (done % 100 == 0 or done == report.total):
+            print(f"{done}/{report.total} ảnh")
+
+
+# ---------- CLI ----------
+
+def build_parser() -> argparse.ArgumentParser:
+    defaults = AppConfig()
+    parser = argparse.ArgumentParser(
+        description="Chuyển cả thư mục ảnh thành tranh vẽ chì (không cần GUI)."
+    )
+    parser.add_argument("input_dir", help="Thư mục ảnh nguồn")
+    parser.add_argument("output_dir", help="Thư mục ghi kết quả")
+    parser.add_argument("-r", "--recursive", action="store_true", help="Duyệt cả thư mục con")
+    parser.add_argument("-j", "--workers", type=int, default=None,
+                        help="Số process (mặc định: số nhân CPU)")
+    parser.add_argument("--chunksize", type=int, default=8,
+                        help="Số ảnh gửi cho mỗi process một lần")
+    parser.add_argument("--io-threads", type=int, default=4,
+                        help="Số thread đọc trước / ghi nền khi chạy với -j 1")
+    parser.add_argument("--ext", default=".png", help="Định dạng ảnh kết quả (.png, .jpg, ...)")
+    parser.add_argument("--output-format", choices=OUTPUT_FORMATS, default="gray",
+                        help="Ghi ảnh xám 1 kênh (mặc định) hoặc BGR 3 kênh")
+    parser.add_argument("--max-memory-mb", type=float, default=None,
+                        help="Xử lý theo tile, giới hạn bộ nhớ làm việc cho mỗi ảnh (MB)")
+    parser.add_argument("--cache-dir", default=None,
+                        help="Thư mục cache kết quả (bỏ qua ảnh đã render cùng cấu hình)")
+    parser.add_argument("--cache-mb", type=float, default=2048.0,
+                        help="Dung lượng tối đa của cache trên đĩa (MB)")
+    parser.add_argument("--frame-store", default=None,
+                        help="Thư mục kho ảnh đã giải mã (mmap), dùng lại giữa các lần chạy")
+
+    parser.add_argument("--auto", action="store_true",
+                        help="Chọn tham số cho từng ảnh bằng auto_suggest_params")
+    parser.add_argument("--auto-sample", type=float, default=1.0,
+                        help="Tỉ lệ ảnh dùng để tính thống kê khi --auto (nhỏ hơn -> nhanh hơn)")
+    parser.add_argument("--manifest", default=None,
+                        help="Ghi tham số và thời gian của từng ảnh (.csv hoặc .jsonl)")
+
+    parser.add_argument("--sharpness", type=int, default=50)
+    parser.add_argument("--canny-low", type=int, default=defaults.edge.low_threshold)
+    parser.add_argument("--canny-high", type=int, default=defaults.edge.high_threshold)
+    parser.add_argument("--diameter", type=int, default=defaults.smooth.diameter)
+    parser.add_argument("--sigma-color", type=float, default=defaults.smooth.sigma_color)
+    parser.add_argument("--sigma-space", type=float, default=defaults.smooth.sigma_space)
+    parser.add_argument("--iterations", type=int, default=defaults.smooth.iterations)
+    parser.add_argument("--smooth-backend", choices=sorted(SMOOTHING_BACKENDS),
+                        default=defaults.smooth.backend,
+                        help="Backend làm mịn giữ biên (xem smoothing.py)")
+    parser.add_argument("--blur-ksize", type=int, default=defaults.sketch.blur_ksize)
+    add_runtime_arguments(parser)
+    return parser
+
+
+def config_from_args(args: argparse.Namespace) -> AppConfig:
+    cfg = AppConfig()
+    cfg.edge.low_threshold = args.canny_low
+    cfg.edge.high_threshold = args.canny_high
+    cfg.smooth.diameter = args.diameter
+    cfg.smooth.sigma_color = args.sigma_color
+    cfg.smooth.sigma_space = args.sigma_space
+    cfg.smooth.iterations = args.iterations
+    cfg.smooth.backend = args.smooth_backend
+    cfg.sketch.blur_ksize = args.blur_ksize
+    cfg.runtime = runtime_from_args(args)
+    return cfg
+
+
+def main(argv: Optional[Sequence[str]] = None) -> int:
+    args = build_parser().parse_args(argv)
+    if not os.path.isdir(args.input_dir):
+        print(f"Không tìm thấy thư mục: {args.input_dir}", file=sys.stderr)
+        return 2
+
+    report = run_batch(
+        args.input_dir,
+        args.output_dir,
+        config=config_from_args(args),
+        sharpness=args.sharpness,
+        recursive=args.recursive,
+        workers=args.workers,
+        chunksize=args.chunksize,
+        ext=args.ext,
+        memory_budget_mb=args.max_memory_mb,
+        cache_dir=args.cache_dir,
+        cache_mb=args.cache_mb,
+        output_format=args.output_format,
+        io_threads=args.io_threads,
+        frame_store=args.frame_store,
+        auto=args.auto,
+        auto_sample=args.auto_sample,
+        manifest=args.manifest,
+    )
+
+    print(
+        f"Xong {report.succeeded}/{report.total} ảnh trong {report.elapsed:.1f}s"
+        f" ({len(report.failures)} lỗi)"
+    )
+    return 1 if report.failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
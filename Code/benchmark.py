@@ -0,0 +1,358 @@
+"""
+Benchmark cho pipeline sketch và auto_suggest_params.
+
+Đo từng tầng (bilateral, Canny, dodge blend, sharpen, bản gộp) và cả hai hàm sketch
+trên nhiều kích thước ảnh, ảnh tổng hợp và ảnh trong examples/, xuất JSON và
+so sánh với một lần chạy trước (baseline). --scaling đo thông lượng của process
+pool theo số worker (xem runtime.py).
+
+Ví dụ:
+    python benchmark.py --sizes 512 1024 --out bench.json
+    python benchmark.py --sizes 512 1024 --baseline bench.json --threshold 0.15
+    python benchmark.py --scaling 1 2 4 8 --scaling-images 64 --pin-workers
+"""
+import argparse
+import glob
+import json
+import os
+import platform
+import sys
+import time
+from dataclasses import asdict
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+import cv2
+import numpy as np
+
+import fused
+from auto_params import auto_suggest_params
+from config import AppConfig, BilateralConfig, EdgeConfig, RuntimeConfig, SketchConfig
+from image_processing import (
+    SketchWorkspace,
+    _ensure_odd,
+    apply_bilateral,
+    detect_edges,
+    dodge_blend,
+    pencil_sketch,
+    pencil_sketch_strong,
+    sharpen_with_edges,
+)
+from runtime import add_runtime_arguments, apply_runtime, for_workers, process_pool, runtime_from_args
+
+EXAMPLES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "examples")
+
+
+# ---------- dữ liệu đầu vào ----------
+
+def synthetic_image(height: int, width: int, seed: int = 0) -> np.ndarray:
+    """Ảnh BGR tổng hợp cố định theo seed: nền gradient, hình khối, chữ và nhiễu."""
+    rng = np.random.default_rng(seed)
+    yy, xx = np.mgrid[0:height, 0:width].astype(np.float32)
+    base = 255.0 * (0.5 * xx / max(1, width - 1) + 0.5 * yy / max(1, height - 1))
+    image = np.repeat(base[..., None], 3, axis=2).astype(np.uint8)
+
+    for _ in range(12):
+        color = tuple(int(c) for c in rng.integers(0, 256, size=3))
+        center = (int(rng.integers(0, width)), int(rng.integers(0, height)))
+        radius = int(rng.integers(max(2, min(height, width) // 20), max(3, min(height, width) // 4)))
+        cv2.circle(image, center, radius, color, thickness=-1)
+    scale = max(0.5, min(height, width) / 256.0)
+    cv2.putText(image, "XLA sketch", (width // 10, height // 2),
+                cv2.FONT_HERSHEY_SIMPLEX, scale, (20, 20, 20), max(1, int(scale * 2)))
+
+    noise = rng.normal(0.0, 8.0, size=image.shape)
+    return np.clip(image + noise, 0, 255).astype(np.uint8)
+
+
+def resize_long_side(image: np.ndarray, size: int) -> np.ndarray:
+    h, w = image.shape[:2]
+    scale = size / float(max(h, w))
+    if scale == 1.0:
+        return image
+    interp = cv2.INTER_AREA if scale < 1.0 else cv2.INTER_CUBIC
+    return cv2.resize(image, (max(1, round(w * scale)), max(1, round(h * scale))),
+                      interpolation=interp)
+
+
+def load_inputs(kinds: Sequence[str], sizes: Sequence[int]) -> List[Tuple[str, np.ndarray]]:
+    """Danh sách (tên, ảnh BGR) cho từng loại đầu vào và kích thước (cạnh dài)."""
+    sources: List[Tuple[str, np.ndarray]] = []
+    if "synthetic" in kinds:
+        sources.append(("synthetic", synthetic_image(1536, 2048)))
+    if "examples" in kinds:
+        for path in sorted(glob.glob(os.path.join(EXAMPLES_DIR, "*"))):
+            image = cv2.imread(path, cv2.IMREAD_COLOR)
+            if image is not None:
+                sources.append((os.path.basename(path), image))
+
+    inputs: List[Tuple[str, np.ndarray]] = []
+    for name, image in sources:
+        for size in sizes:
+            inputs.append((name, resize_long_side(image, size)))
+    return inputs
+
+
+# ---------- đo thời gian ----------
+
+def time_call(fn: Callable[[], object], repeats: int, warmup: int = 1) -> Dict[str, float]:
+    for _ in range(warmup):
+        fn()
+    samples = []
+    for _ in range(max(1, repeats)):
+        start = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - start) * 1000.0)
+    samples.sort()
+    return {
+        "median_ms": samples[len(samples) // 2],
+        "min_ms": samples[0],
+        "mean_ms": sum(samples) / len(samples),
+        "repeats": len(samples),
+    }
+
+
+def sweep_configs(enabled: bool) -> List[AppConfig]:
+    """Cấu hình mặc định, và nếu bật sweep thì thêm các biến thể diameter / iterations / blur."""
+    configs = [AppConfig()]
+    if not enabled:
+        return configs
+    for diameter in (5, 15):
+        configs.append(AppConfig(smooth=BilateralConfig(diameter=diameter)))
+    for iterations in (3,):
+        configs.append(AppConfig(smooth=BilateralConfig(iterations=iterations)))
+    for blur_ksize in (11, 41):
+        configs.append(AppConfig(sketch=SketchConfig(blur_ksize=blur_ksize)))
+    configs.append(AppConfig(edge=EdgeConfig(low_threshold=20, high_threshold=60)))
+    return configs
+
+
+def _config_params(config: AppConfig) -> dict:
+    return {"edge": asdict(config.edge), "smooth": asdict(config.smooth),
+            "sketch": asdict(config.sketch)}
+
+
+def stage_cases(image: np.ndarray, config: AppConfig) -> Dict[str, Callable[[], object]]:
+    """
+    Các hàm cần đo cho một ảnh + cấu hình; tầng sau dùng đầu ra cố định của tầng trước.
+    Mỗi tầng gọi đúng hàm của image_processing với workspace như SketchPipeline.
+    """
+    gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+    smooth = apply_bilateral(gray, config.smooth)
+    k = _ensure_odd(config.sketch.blur_ksize)
+    # đầu vào cố định nằm ngoài workspace (buffer của nó bị ghi đè mỗi lần đo)
+    sketch = dodge_blend(gray, smooth, k)
+    edges = detect_edges(gray, config.edge)
+    workspace = SketchWorkspace()
+    edges_dst = workspace.get("edges", gray.shape)
+
+    return {
+        "cvt_gray": lambda: cv2.cvtColor(image, cv2.COLOR_BGR2GRAY),
+        "apply_bilateral": lambda: apply_bilateral(gray, config.smooth, workspace),
+        "detect_edges": lambda: detect_edges(gray, config.edge, edges_dst),
+        "dodge_blend": lambda: dodge_blend(gray, smooth, k, workspace),
+        # che biên Canny + sharpen 3x3
+        "sharpen": lambda: sharpen_with_edges(sketch, edges, workspace),
+        # dodge + che biên + sharpen gộp một lượt (numba nếu có, xem fused.py)
+        "fused_tail": lambda: fused.dodge_sharpen(gray, fused.blur_inverted(smooth, k), edges),
+        "pencil_sketch": lambda: pencil_sketch(image, config),
+        "pencil_sketch_strong": lambda: pencil_sketch_strong(image, config),
+    }
+
+
+def run_benchmarks(
+    inputs: Sequence[Tuple[str, np.ndarray]],
+    configs: Sequence[AppConfig],
+    repeats: int = 5,
+    only: Optional[Sequence[str]] = None,
+    verbose: bool = True,
+) -> dict:
+    results = []
+
+    def record(name: str, input_name: str, image: np.ndarray, params: dict, fn) -> None:
+        if only and name not in only:
+            return
+        timing = time_call(fn, repeats)
+        row = {"name": name, "input": input_name, "shape": list(image.shape[:2]),
+               "params": params, **timing}
+        results.append(row)
+        if verbose:
+            print(f"{name:<22} {input_name:<16} {image.shape[1]:>5}x{image.shape[0]:<5}"
+                  f" {timing['median_ms']:>9.2f} ms")
+
+    for input_name, image in inputs:
+        gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+        record("auto_suggest_params", input_name, image, {}, lambda: auto_suggest_params(gray))
+        for config in configs:
+            params = _config_params(config)
+            for name, fn in stage_cases(image, config).items():
+                record(name, input_name, image, params, fn)
+
+    return {"meta": environment_info(), "results": results}
+
+
+# ---------- mở rộng theo số worker ----------
+
+# ảnh tổng hợp của từng process con, tạo một lần cho mỗi kích thước
+_scaling_images: Dict[Tuple[int, int], np.ndarray] = {}
+
+
+def _scaling_task(shape: Tuple[int, int]) -> None:
+    image = _scaling_images.get(shape)
+    if image is None:
+        image = _scaling_images[shape] = synthetic_image(*shape)
+    pencil_sketch_strong(image, AppConfig())
+
+
+def scaling_benchmark(
+    worker_counts: Sequence[int],
+    images: int = 32,
+    size: int = 1024,
+    runtime: Optional[RuntimeConfig] = None,
+    verbose: bool = True,
+) -> List[dict]:
+    """
+    Thông lượng (ảnh/giây) khi render `images` ảnh qua process_pool với từng số
+    worker. Ảnh được tạo sẵn trong process con nên chỉ đo phần tính toán.
+    speedup / efficiency tính so với số worker đầu tiên.
+    """
+    runtime = runtime or RuntimeConfig()
+    shape = (size * 3 // 4, size)
+    rows: List[dict] = []
+    for workers in worker_counts:
+        with process_pool(workers, runtime) as pool:
+            # khởi động process con và tạo ảnh trước khi đo
+            list(pool.map(_scaling_task, [shape] * workers))
+            start = time.perf_counter()
+            list(pool.map(_scaling_task, [shape] * images))
+            elapsed = time.perf_counter() - start
+        row = {
+            "workers": workers,
+            "cv_threads": for_workers(runtime, workers).cv_threads,
+            "images": images,
+            "seconds": elapsed,
+            "images_per_s": images / elapsed,
+        }
+        base = rows[0] if rows else row
+        row["speedup"] = row["images_per_s"] / base["images_per_s"]
+        row["efficiency"] = row["speedup"] * base["workers"] / workers
+        rows.append(row)
+        if verbose:
+            print(f"{workers:>3} worker x {row['cv_threads']:>2} thread OpenCV"
+                  f" {row['images_per_s']:>8.2f} ảnh/s  x{row['speedup']:.2f}"
+                  f"  hiệu suất {row['efficiency']:.0%}")
+    return rows
+
+
+def environment_info() -> dict:
+    return {
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "machine": platform.machine(),
+        "cpu_count": os.cpu_count(),
+        "opencv": cv2.__version__,
+        "numpy": np.__version__,
+        "cv_threads": cv2.getNumThreads(),
+    }
+
+
+# ---------- so sánh với baseline ----------
+
+def _result_key(row: dict) -> str:
+    return json.dumps([row["name"], row["input"], row["shape"], row["params"]], sort_keys=True)
+
+
+def compare_results(current: dict, baseline: dict, threshold: float = 0.15) -> List[dict]:
+    """
+    Ghép từng kết quả với baseline tương ứng.
+    ratio = median hiện tại / median baseline; ratio > 1 + threshold là chậm đi (regression).
+    """
+    base = {_result_key(row): row for row in baseline.get("results", [])}
+    rows = []
+    for row in current.get("results", []):
+        ref = base.get(_result_key(row))
+        if ref is None or ref["median_ms"] <= 0:
+            continue
+        ratio = row["median_ms"] / ref["median_ms"]
+        rows.append({
+            "name": row["name"],
+            "input": row["input"],
+            "shape": row["shape"],
+            "baseline_ms": ref["median_ms"],
+            "current_ms": row["median_ms"],
+            "ratio": ratio,
+            "regression": ratio > 1.0 + threshold,
+        })
+    return rows
+
+
+def print_comparison(rows: Sequence[dict]) -> None:
+    print(f"\n{'tầng':<22} {'ảnh':<16} {'kích thước':>11} {'baseline':>10} {'hiện tại':>10} {'tỉ lệ':>7}")
+    for row in rows:
+        h, w = row["shape"]
+        flag = "  <-- chậm hơn" if row["regression"] else ""
+        print(f"{row['name']:<22} {row['input']:<16} {w:>5}x{h:<5} {row['baseline_ms']:>10.2f}"
+              f" {row['current_ms']:>10.2f} {row['ratio']:>7.2f}{flag}")
+
+
+# ---------- CLI ----------
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description="Benchmark pipeline sketch.")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[512, 1024, 2048],
+                        help="Cạnh dài của ảnh đầu vào (pixel)")
+    parser.add_argument("--inputs", nargs="+", choices=["synthetic", "examples"],
+                        default=["synthetic", "examples"])
+    parser.add_argument("--repeats", type=int, default=5)
+    parser.add_argument("--sweep", action="store_true",
+                        help="Đo thêm các biến thể tham số (diameter, iterations, blur, Canny)")
+    parser.add_argument("--only", nargs="+", default=None, help="Chỉ đo các tầng này")
+    parser.add_argument("--out", default=None, help="Ghi kết quả JSON ra file")
+    parser.add_argument("--baseline", default=None, help="File JSON của lần chạy trước để so sánh")
+    parser.add_argument("--threshold", type=float, default=0.15,
+                        help="Ngưỡng chậm đi tương đối để coi là regression")
+    parser.add_argument("--scaling", type=int, nargs="+", default=None, metavar="WORKERS",
+                        help="Chỉ đo thông lượng process pool với các số worker này")
+    parser.add_argument("--scaling-images", type=int, default=32,
+                        help="Số ảnh render cho mỗi số worker")
+    add_runtime_arguments(parser)
+    return parser
+
+
+def main(argv: Optional[Sequence[str]] = None) -> int:
+    args = build_parser().parse_args(argv)
+    runtime = runtime_from_args(args)
+
+    if args.scaling:
+        rows = scaling_benchmark(args.scaling, images=args.scaling_images,
+                                 size=max(args.sizes), runtime=runtime)
+        if args.out:
+            report = {"meta": environment_info(), "scaling": rows}
+            with open(args.out, "w", encoding="utf-8") as f:
+                json.dump(report, f, indent=2, ensure_ascii=False)
+            print(f"Đã ghi kết quả: {args.out}")
+        return 0
+
+    apply_runtime(runtime)
+    inputs = load_inputs(args.inputs, args.sizes)
+    report = run_benchmarks(inputs, sweep_configs(args.sweep), repeats=args.repeats, only=args.only)
+
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2, ensure_ascii=False)
+        print(f"Đã ghi kết quả: {args.out}")
+
+    if args.baseline:
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            baseline = json.load(f)
+        rows = compare_results(report, baseline, args.threshold)
+        print_comparison(rows)
+        regressions = [row for row in rows if row["regression"]]
+        if regressions:
+            print(f"\n{len(regressions)} kết quả chậm hơn baseline quá {args.threshold:.0%}")
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
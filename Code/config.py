@@ -1,4 +1,5 @@
-from dataclasses import dataclass, field
+from dataclasses import dataclass, field, fields
+from typing import Any, Dict, Optional
 
 
 @dataclass
@@ -15,6 +16,8 @@ class BilateralConfig:
     sigma_color: float = 75.0
     sigma_space: float = 75.0
     iterations: int = 1
+    # "exact" (cv2.bilateralFilter), "grid" (bilateral grid) hoặc "guided" (guided filter)
+    backend: str = "exact"
 
 
 @dataclass
@@ -23,11 +26,60 @@ class SketchConfig:
     blur_ksize: int = 21
 
 
+@dataclass
+class RuntimeConfig:
+    """
+    Cấu hình thực thi (xem runtime.py). Không ảnh hưởng kết quả render nên
+    không nằm trong khoá cache và không đọc từ config_from_dict.
+    """
+    # số thread nội bộ của OpenCV; None = để OpenCV tự chọn (hoặc chia đều khi chạy pool)
+    cv_threads: Optional[int] = None
+    # cv2.setUseOptimized: dùng nhánh SIMD (SSE/AVX/NEON)
+    use_optimized: bool = True
+    # số thread của BLAS/OpenMP mà NumPy dùng; None = không đổi
+    blas_threads: Optional[int] = None
+    # gán mỗi process con vào một nhóm nhân CPU riêng (chỉ Linux)
+    pin_workers: bool = False
+
+
 @dataclass
 class AppConfig:
     edge: EdgeConfig = field(default_factory=EdgeConfig)
     smooth: BilateralConfig = field(default_factory=BilateralConfig)
     sketch: SketchConfig = field(default_factory=SketchConfig)
+    runtime: RuntimeConfig = field(default_factory=RuntimeConfig)
 
 # Cấu hình mặc định dùng chung
 DEFAULT_CONFIG = AppConfig()
+
+
+def _update_section(section: Any, values: Dict[str, Any], name: str) -> None:
+    if not isinstance(values, dict):
+        raise ValueError(f"Nhóm tham số {name} phải là object, nhận {type(values).__name__}")
+    known = {f.name: f for f in fields(section)}
+    for key, value in values.items():
+        if key not in known:
+            raise ValueError(f"Tham số không hợp lệ: {name}.{key}")
+        # ép về kiểu của giá trị mặc định (JSON chỉ có số / chuỗi)
+        kind = type(getattr(section, key))
+        try:
+            setattr(section, key, kind(value))
+        except (TypeError, ValueError):
+            raise ValueError(f"Giá trị không hợp lệ cho {name}.{key}: {value!r}") from None
+
+
+def config_from_dict(data: Dict[str, Any]) -> AppConfig:
+    """
+    Tạo AppConfig từ dict cùng dạng với asdict(AppConfig()) (ví dụ JSON).
+    Khoá bị thiếu giữ giá trị mặc định, khoá lạ hoặc sai kiểu -> ValueError.
+    """
+    if data is None:
+        data = {}
+    if not isinstance(data, dict):
+        raise ValueError(f"config phải là object, nhận {type(data).__name__}")
+    cfg = AppConfig()
+    for name, values in data.items():
+        if name not in ("edge", "smooth", "sketch"):
+            raise ValueError(f"Nhóm tham số không hợp lệ: {name}")
+        _update_section(getattr(cfg, name), values, name)
+    return cfg
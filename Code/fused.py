@@ -0,0 +1,316 @@
+"""
+Gộp phần đuôi của pipeline sketch thành ít lượt duyệt ảnh hơn.
+
+Bản gốc (xem image_processing.dodge_blend / sharpen_with_edges) duyệt cả ảnh
+nhiều lần, mỗi lần ghi ra một ảnh tạm:
+    255 - smooth -> GaussianBlur -> 255 - blur -> divide -> and(~edges) -> filter2D
+Ở đây GaussianBlur vẫn dùng OpenCV (tách được, đã SIMD), phần còn lại là phép
+tính theo từng pixel được gộp lại:
+  - dodge:          255 - blur + divide                 -> 1 lượt
+  - masked_sharpen: ~edges + and + sharpen 3x3          -> 1 lượt
+  - dodge_sharpen:  cả hai, giữ 3 dòng dodge trượt      -> 1 lượt
+Backend "numba" (nếu cài numba) chạy song song theo khối dòng; backend "numpy"
+là bản vector hoá để đối chiếu. Kết quả giống hệt bản OpenCV (xem check_agreement).
+
+    python fused.py examples/anh3.jpg --repeats 5
+"""
+import argparse
+import sys
+import time
+from typing import Dict, List, Optional, Sequence
+
+import cv2
+import numpy as np
+
+from config import AppConfig, DEFAULT_CONFIG
+from image_processing import (
+    SHARPEN_KERNEL,
+    SketchPipeline,
+    _ensure_odd,
+    apply_bilateral,
+    detect_edges,
+    dodge_blend,
+    sharpen_with_edges,
+)
+
+try:
+    import numba
+    from numba import njit, prange
+except ImportError:   # numba là tuỳ chọn
+    numba = None
+
+HAS_NUMBA = numba is not None
+FUSED_BACKENDS = ("numba", "numpy") if HAS_NUMBA else ("numpy",)
+
+# các kernel dưới đây viết sẵn phép nhân với SHARPEN_KERNEL (5 ở tâm, -1 ở 4 điểm kề)
+_SHARPEN_TAPS = ((0, -1, 0), (-1, 5, -1), (0, -1, 0))
+if not np.array_equal(SHARPEN_KERNEL, _SHARPEN_TAPS):
+    raise ImportError("fused.py cần cập nhật theo SHARPEN_KERNEL mới")
+
+
+def _build_dodge_lut() -> np.ndarray:
+    """
+    Bảng 256 x 256: LUT[g, b] = cv2.divide(g, 255 - b, scale=256) cho mọi cặp
+    (gray, blur_inv). Phép chia trở thành một lần tra bảng 64 KB (nằm trong cache).
+    """
+    g = np.arange(256, dtype=np.uint8).repeat(256).reshape(256, 256)
+    b = cv2.bitwise_not(g.T.copy())
+    return cv2.divide(g, b, scale=256)
+
+
+DODGE_LUT = _build_dodge_lut()
+_DODGE_LUT_FLAT = DODGE_LUT.ravel()
+
+
+# ---------- NumPy ----------
+
+def _dodge_numpy(gray: np.ndarray, blur_inv: np.ndarray) -> np.ndarray:
+    index = gray.astype(np.uint16)
+    index <<= 8
+    index |= blur_inv
+    return _DODGE_LUT_FLAT[index]
+
+
+def _masked_sharpen_numpy(sketch: np.ndarray, edges: np.ndarray) -> np.ndarray:
+    combined = np.where(edges != 0, 0, sketch).astype(np.int16)
+    # BORDER_REFLECT_101 của filter2D tương ứng mode="reflect" của NumPy
+    # (trục chỉ có 1 phần tử thì lặp lại chính nó)
+    p = combined
+    for axis in (0, 1):
+        width = [(0, 0), (0, 0)]
+        width[axis] = (1, 1)
+        p = np.pad(p, width, mode="reflect" if combined.shape[axis] > 1 else "edge")
+    out = 5 * p[1:-1, 1:-1] - p[:-2, 1:-1] - p[2:, 1:-1] - p[1:-1, :-2] - p[1:-1, 2:]
+    return np.clip(out, 0, 255).astype(np.uint8)
+
+
+def _dodge_sharpen_numpy(gray: np.ndarray, blur_inv: np.ndarray, edges: np.ndarray) -> np.ndarray:
+    return _masked_sharpen_numpy(_dodge_numpy(gray, blur_inv), edges)
+
+
+# ---------- Numba ----------
+
+if HAS_NUMBA:
+
+    @njit(inline="always")
+    def _reflect(i, n):
+        if i < 0:
+            return 1 if n > 1 else 0
+        if i >= n:
+            return n - 2 if n > 1 else 0
+        return i
+
+    @njit(parallel=True, cache=True)
+    def _dodge_numba(gray, blur_inv, lut, out):
+        h, w = gray.shape
+        for y in prange(h):
+            for x in range(w):
+                out[y, x] = lut[(np.int32(gray[y, x]) << 8) | blur_inv[y, x]]
+        return out
+
+    @njit(inline="always")
+    def _masked_row(values, edges_row, w, row):
+        for x in range(w):
+            row[x + 1] = 0 if edges_row[x] != 0 else values[x]
+        # viền trái / phải theo BORDER_REFLECT_101
+        row[0] = row[2] if w > 1 else row[1]
+        row[w + 1] = row[w - 1] if w > 1 else row[w]
+
+    @njit(inline="always")
+    def _dodge_masked_row(gray_row, blur_row, edges_row, lut, w, row):
+        for x in range(w):
+            v = lut[(np.int32(gray_row[x]) << 8) | blur_row[x]]
+            row[x + 1] = 0 if edges_row[x] != 0 else v
+        row[0] = row[2] if w > 1 else row[1]
+        row[w + 1] = row[w - 1] if w > 1 else row[w]
+
+    @njit(inline="always")
+    def _sharpen_row(top, mid, bot, w, out_row):
+        for x in range(w):
+            v = 5 * mid[x + 1] - top[x + 1] - bot[x + 1] - mid[x] - mid[x + 2]
+            out_row[x] = 0 if v < 0 else (255 if v > 255 else v)
+
+    @njit(parallel=True, cache=True)
+    def _masked_sharpen_numba(sketch, edges, out, band):
+        h, w = sketch.shape
+        n_bands = (h + band - 1) // band
+        for b in prange(n_bands):
+            y0 = b * band
+            y1 = min(h, y0 + band)
+            # 3 dòng đã che biên (có thêm 1 cột viền mỗi bên) trượt theo y
+            rows = np.empty((3, w + 2), dtype=np.int32)
+            for j in range(2):
+                src = _reflect(y0 - 1 + j, h)
+                _masked_row(sketch[src], edges[src], w, rows[j])
+            for y in range(y0, y1):
+                nxt = (y - y0 + 2) % 3
+                src = _reflect(y + 1, h)
+                _masked_row(sketch[src], edges[src], w, rows[nxt])
+                _sharpen_row(rows[(y - y0) % 3], rows[(y - y0 + 1) % 3], rows[nxt], w, out[y])
+        return out
+
+    @njit(parallel=True, cache=True)
+    def _dodge_sharpen_numba(gray, blur_inv, edges, lut, out, band):
+        h, w = gray.shape
+        n_bands = (h + band - 1) // band
+        for b in prange(n_bands):
+            y0 = b * band
+            y1 = min(h, y0 + band)
+            # mỗi dòng dodge chỉ tính một lần, không ghi ra ảnh tạm
+            rows = np.empty((3, w + 2), dtype=np.int32)
+            for j in range(2):
+                src = _reflect(y0 - 1 + j, h)
+                _dodge_masked_row(gray[src], blur_inv[src], edges[src], lut, w, rows[j])
+            for y in range(y0, y1):
+                nxt = (y - y0 + 2) % 3
+                src = _reflect(y + 1, h)
+                _dodge_masked_row(gray[src], blur_inv[src], edges[src], lut, w, rows[nxt])
+                _sharpen_row(rows[(y - y0) % 3], rows[(y - y0 + 1) % 3], rows[nxt], w, out[y])
+        return out
+
+
+# số dòng mỗi khối song song (mỗi khối tính lại 2 dòng viền)
+_BAND_ROWS = 64
+
+
+def _resolve(backend: str) -> str:
+    if backend == "auto":
+        return "numba" if HAS_NUMBA else "numpy"
+    if backend not in FUSED_BACKENDS:
+        raise ValueError(
+            f"Backend gộp không hợp lệ: {backend!r} (hỗ trợ: {', '.join(FUSED_BACKENDS)})"
+        )
+    return backend
+
+
+def _out(shape, out: Optional[np.ndarray]) -> np.ndarray:
+    return np.empty(shape, dtype=np.uint8) if out is None else out
+
+
+def blur_inverted(smooth: np.ndarray, ksize: int, dst: Optional[np.ndarray] = None) -> np.ndarray:
+    """GaussianBlur(255 - smooth): phần tách được, vẫn để OpenCV làm."""
+    inverted = cv2.bitwise_not(smooth)
+    return cv2.GaussianBlur(inverted, (ksize, ksize), 0, dst=dst)
+
+
+def dodge(gray: np.ndarray, blur_inv: np.ndarray, backend: str = "auto",
+          out: Optional[np.ndarray] = None) -> np.ndarray:
+    """gray * 256 / (255 - blur_inv), giống cv2.divide(gray, 255 - blur_inv, scale=256)."""
+    if _resolve(backend) == "numba":
+        return _dodge_numba(gray, blur_inv, _DODGE_LUT_FLAT, _out(gray.shape, out))
+    result = _dodge_numpy(gray, blur_inv)
+    if out is None:
+        return result
+    np.copyto(out, result)
+    return out
+
+
+def masked_sharpen(sketch: np.ndarray, edges: np.ndarray, backend: str = "auto",
+                   out: Optional[np.ndarray] = None) -> np.ndarray:
+    """Giống image_processing.sharpen_with_edges trong một lượt."""
+    if _resolve(backend) == "numba":
+        return _masked_sharpen_numba(sketch, edges, _out(sketch.shape, out), _BAND_ROWS)
+    result = _masked_sharpen_numpy(sketch, edges)
+    if out is None:
+        return result
+    np.copyto(out, result)
+    return out
+
+
+def dodge_sharpen(gray: np.ndarray, blur_inv: np.ndarray, edges: np.ndarray,
+                  backend: str = "auto", out: Optional[np.ndarray] = None) -> np.ndarray:
+    """Cả phần đuôi sketch đậm (dodge + che biên + sharpen) trong một lượt."""
+    if _resolve(backend) == "numba":
+        return _dodge_sharpen_numba(
+            gray, blur_inv, edges, _DODGE_LUT_FLAT, _out(gray.shape, out), _BAND_ROWS
+        )
+    result = _dodge_sharpen_numpy(gray, blur_inv, edges)
+    if out is None:
+        return result
+    np.copyto(out, result)
+    return out
+
+
+def fused_sketch(
+    image_bgr: np.ndarray,
+    config: AppConfig = DEFAULT_CONFIG,
+    sharpness: int = 50,
+    backend: str = "auto",
+) -> np.ndarray:
+    """Như process_image(..., output="gray") nhưng phần đuôi dùng kernel gộp."""
+    gray = cv2.cvtColor(image_bgr, cv2.COLOR_BGR2GRAY)
+    smooth = apply_bilateral(gray, config.smooth)
+    blur_inv = blur_inverted(smooth, _ensure_odd(config.sketch.blur_ksize))
+    if sharpness is not None and sharpness < 50:
+        return dodge(gray, blur_inv, backend)
+    return dodge_sharpen(gray, blur_inv, detect_edges(gray, config.edge), backend)
+
+
+# ---------- đối chiếu với bản OpenCV ----------
+
+def check_agreement(
+    image_bgr: np.ndarray,
+    config: AppConfig = DEFAULT_CONFIG,
+    backends: Optional[Sequence[str]] = None,
+) -> Dict[str, Dict[str, int]]:
+    """
+    So sánh kernel gộp với pipeline hiện tại (SketchPipeline) cho cả hai nhánh.
+    Trả về {"<backend>/<nhánh>": {"max_abs_diff": ..., "mismatched": số pixel khác}}.
+    """
+    pipeline = SketchPipeline()
+    expected = {
+        "soft": pipeline.dodge(image_bgr, config),
+        "strong": pipeline.strong(image_bgr, config),
+    }
+    report: Dict[str, Dict[str, int]] = {}
+    for backend in backends or FUSED_BACKENDS:
+        for branch, sharpness in (("soft", 0), ("strong", 100)):
+            result = fused_sketch(image_bgr, config, sharpness, backend)
+            diff = cv2.absdiff(result, expected[branch])
+            report[f"{backend}/{branch}"] = {
+                "max_abs_diff": int(diff.max()),
+                "mismatched": int(cv2.countNonZero(diff)),
+            }
+    return report
+
+
+def main(argv: Optional[Sequence[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Đối chiếu và đo kernel gộp dodge + sharpen.")
+    parser.add_argument("images", nargs="+")
+    parser.add_argument("--repeats", type=int, default=5)
+    args = parser.parse_args(argv)
+
+    failed = False
+    for path in args.images:
+        image = cv2.imread(path, cv2.IMREAD_COLOR)
+        if image is None:
+            print(f"Không đọc được ảnh từ: {path}", file=sys.stderr)
+            continue
+        for name, stats in check_agreement(image).items():
+            failed |= stats["mismatched"] > 0
+            print(f"{path[-24:]:<24} {name:<14} max diff {stats['max_abs_diff']:>3}"
+                  f"  pixel khác {stats['mismatched']}")
+
+        # đo riêng phần đuôi (sau bilateral) của nhánh đậm
+        pipeline = SketchPipeline()
+        gray = pipeline.gray(image)
+        smooth = pipeline.smooth(image, DEFAULT_CONFIG.smooth)
+        edges = pipeline.edges(image, DEFAULT_CONFIG.edge)
+        k = _ensure_odd(DEFAULT_CONFIG.sketch.blur_ksize)
+        cases = {"opencv": lambda: sharpen_with_edges(dodge_blend(gray, smooth, k), edges)}
+        for backend in FUSED_BACKENDS:
+            cases[backend] = lambda b=backend: dodge_sharpen(gray, blur_inverted(smooth, k), edges, b)
+        for name, fn in cases.items():
+            fn()
+            times: List[float] = []
+            for _ in range(max(1, args.repeats)):
+                start = time.perf_counter()
+                fn()
+                times.append((time.perf_counter() - start) * 1000.0)
+            times.sort()
+            print(f"{path[-24:]:<24} tail/{name:<9} {times[len(times) // 2]:>8.2f} ms")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,40 +1,93 @@
 import os
+import time
 from typing import Optional
 
 import cv2
 import numpy as np
-from PyQt5.QtCore import Qt
-from PyQt5.QtGui import QImage, QPixmap
+from PyQt5.QtCore import QSize, Qt, QTimer
+from PyQt5.QtGui import QIcon, QKeySequence, QPixmap
 from PyQt5.QtWidgets import (
     QApplication,
     QFileDialog,
     QGroupBox,
     QHBoxLayout,
     QLabel,
+    QListView,
+    QListWidget,
+    QListWidgetItem,
     QMainWindow,
     QMessageBox,
     QPushButton,
+    QShortcut,
     QSlider,
     QVBoxLayout,
     QWidget,
 )
 
+from analysis import ImageAnalysis
 from config import AppConfig
-from image_processing import process_image
-from auto_params import auto_suggest_params   # <=== THÊM IMPORT AUTO
+from image_processing import make_proxy, process_image, scale_config
+from image_view import ImageLabel, displayable, numpy_to_qimage
+from io_utils import decode_flags, list_images_in_folder, probe_image_size, reduction_factor
+from render_scheduler import RenderResult, RenderScheduler
+from result_cache import ResultCache
+from runtime import apply_runtime
+from session import FolderSession
+from auto_params import auto_suggest_params, params_to_config   # <=== THÊM IMPORT AUTO
 
 
 class SketchMainWindow(QMainWindow):
+    # thời gian chờ sau lần đổi slider cuối cùng trước khi render
+    PREVIEW_DEBOUNCE_MS = 40
+    # thời gian "rảnh" (không chỉnh gì) trước khi render ảnh độ phân giải gốc
+    FULL_RES_IDLE_MS = 400
+    RESULT_CACHE_MB = 256
+    # phiên thư mục: số ảnh render trước mỗi phía, bộ nhớ cho ảnh đã giải mã
+    SESSION_RADIUS = 2
+    SESSION_MEMORY_MB = 512
+    THUMB_SIZE = 96
+
     def __init__(self) -> None:
         super().__init__()
         self.setWindowTitle("SketchLab - Chuyển ảnh thành tranh vẽ")
 
         self.original_image: Optional[np.ndarray] = None
+        # result_image: kết quả độ phân giải gốc ứng với tham số hiện tại (None nếu chưa có)
+        # preview_image: kết quả đang hiển thị (có thể chỉ là bản proxy)
         self.result_image: Optional[np.ndarray] = None
+        self.preview_image: Optional[np.ndarray] = None
         self.current_path: Optional[str] = None
-
-        self.original_label: QLabel
-        self.result_label: QLabel
+        self._opening_path: Optional[str] = None
+        # ảnh xám / Canny của ảnh gốc, dùng chung giữa gợi ý tham số và render
+        self._analysis: Optional[ImageAnalysis] = None
+
+        # ảnh proxy thu nhỏ theo kích thước khung hiển thị
+        self._proxy_image: Optional[np.ndarray] = None
+        self._proxy_scale = 1.0
+        self._proxy_target: Optional[tuple] = None
+
+        # render chạy nền (latest-wins), slider được gom lại bằng debounce
+        # kết quả đã render (theo nội dung ảnh + cấu hình) được dùng lại ngay
+        self._cache = ResultCache(memory_mb=self.RESULT_CACHE_MB)
+        self._scheduler = RenderScheduler(self, cache=self._cache)
+        self._scheduler.finished.connect(self._on_render_finished)
+        self._scheduler.failed.connect(self._on_render_failed)
+        self._last_edit_at: Optional[float] = None
+        self._session: Optional[FolderSession] = None
+
+        self._preview_timer = QTimer(self)
+        self._preview_timer.setSingleShot(True)
+        self._preview_timer.setInterval(self.PREVIEW_DEBOUNCE_MS)
+        self._preview_timer.timeout.connect(self.update_preview)
+
+        self._full_res_timer = QTimer(self)
+        self._full_res_timer.setSingleShot(True)
+        self._full_res_timer.setInterval(self.FULL_RES_IDLE_MS)
+        self._full_res_timer.timeout.connect(self._render_full_res)
+
+        self.original_label: ImageLabel
+        self.result_label: ImageLabel
+        self.filmstrip: QListWidget
 
         # sliders
         self.low_thresh_slider: QSlider
@@ -60,14 +113,14 @@ class SketchMainWindow(QMainWindow):
 
         # top: hai ảnh
         images_layout = QHBoxLayout()
-        self.original_label = QLabel("Ảnh gốc")
+        self.original_label = ImageLabel("Ảnh gốc")
         self.original_label.setAlignment(Qt.AlignCenter)
         self.original_label.setMinimumSize(320, 240)
         self.original_label.setStyleSheet(
             "background: #f0f0f0; border: 1px solid #cccccc;"
         )
 
-        self.result_label = QLabel("Kết quả")
+        self.result_label = ImageLabel("Kết quả")
         self.result_label.setAlignment(Qt.AlignCenter)
         self.result_label.setMinimumSize(320, 240)
         self.result_label.setStyleSheet(
@@ -77,6 +130,19 @@ class SketchMainWindow(QMainWindow):
         images_layout.addWidget(self.original_label, stretch=1)
         images_layout.addWidget(self.result_label, stretch=1)
 
+        # filmstrip của phiên thư mục (ẩn khi chỉ mở một ảnh)
+        self.filmstrip = QListWidget()
+        self.filmstrip.setViewMode(QListView.IconMode)
+        self.filmstrip.setFlow(QListView.LeftToRight)
+        self.filmstrip.setWrapping(False)
+        self.filmstrip.setMovement(QListView.Static)
+        self.filmstrip.setIconSize(QSize(self.THUMB_SIZE, self.THUMB_SIZE))
+        self.filmstrip.setFixedHeight(self.THUMB_SIZE + 44)
+        self.filmstrip.currentRowChanged.connect(self._on_filmstrip_row_changed)
+        self.filmstrip.hide()
+        QShortcut(QKeySequence("Ctrl+Right"), self, lambda: self.step_image(1))
+        QShortcut(QKeySequence("Ctrl+Left"), self, lambda: self.step_image(-1))
+
         # bottom: controls
         controls_layout = QHBoxLayout()
         controls_layout.addWidget(self._create_mode_group(), stretch=1)
@@ -85,8 +151,11 @@ class SketchMainWindow(QMainWindow):
         controls_layout.addWidget(self._create_sketch_params_group(), stretch=1)
 
         main_layout.addLayout(images_layout, stretch=3)
+        main_layout.addWidget(self.filmstrip)
         main_layout.addLayout(controls_layout, stretch=2)
 
+        self.latency_label = QLabel("")
+        self.statusBar().addPermanentWidget(self.latency_label)
         self.statusBar().showMessage("Chưa mở ảnh nào")
 
     def _create_mode_group(self) -> QGroupBox:
@@ -99,6 +168,9 @@ class SketchMainWindow(QMainWindow):
         btn_open = QPushButton("Mở ảnh...")
         btn_open.clicked.connect(self.open_image)
 
+        btn_open_folder = QPushButton("Mở thư mục...")
+        btn_open_folder.clicked.connect(self.open_folder)
+
         btn_save = QPushButton("Lưu kết quả...")
         btn_save.clicked.connect(self.save_result)
 
@@ -111,6 +183,7 @@ class SketchMainWindow(QMainWindow):
         layout.addWidget(mode_label)
         layout.addSpacing(10)
         layout.addWidget(btn_open)
+        layout.addWidget(btn_open_folder)
         layout.addWidget(btn_save)
         layout.addWidget(btn_reset)
         layout.addWidget(btn_apply)
@@ -286,16 +359,15 @@ class SketchMainWindow(QMainWindow):
             QMessageBox.warning(self, "Thông báo", "Bạn chưa mở ảnh.")
             return
 
-        gray = cv2.cvtColor(self.original_image, cv2.COLOR_BGR2GRAY)
-        params = auto_suggest_params(gray)
+        cfg, sharpness = params_to_config(auto_suggest_params(self._get_analysis()))
 
-        self.sharpness_slider.setValue(params["sharpness"])
-        self.sketch_blur_slider.setValue(params["blur_ksize"])
-        self.bf_sigma_color_slider.setValue(params["sigma_color"])
-        self.bf_sigma_space_slider.setValue(params["sigma_space"])
-        self.bf_iterations_slider.setValue(params["iterations"])
-        self.low_thresh_slider.setValue(params["canny_low"])
-        self.high_thresh_slider.setValue(params["canny_high"])
+        self.sharpness_slider.setValue(sharpness)
+        self.sketch_blur_slider.setValue(cfg.sketch.blur_ksize)
+        self.bf_sigma_color_slider.setValue(int(cfg.smooth.sigma_color))
+        self.bf_sigma_space_slider.setValue(int(cfg.smooth.sigma_space))
+        self.bf_iterations_slider.setValue(cfg.smooth.iterations)
+        self.low_thresh_slider.setValue(cfg.edge.low_threshold)
+        self.high_thresh_slider.setValue(cfg.edge.high_threshold)
 
         self.update_preview()
 
@@ -310,24 +382,192 @@ class SketchMainWindow(QMainWindow):
         )
         if not path:
             return
+        self._close_session()
+
+        # chỉ đọc header trước: ảnh lớn hơn khung nhiều thì hiện ngay bản giải mã
+        # thu nhỏ (1/2, 1/4, 1/8), ảnh gốc được giải mã ngay sau đó
+        self._opening_path = path
+        target = self._proxy_target_size()
+        size = probe_image_size(path)
+        factor = reduction_factor(size, target) if size is not None else 1
+        reduced = self._decode_file(path, factor) if factor > 1 else None
+        if reduced is None:
+            self._load_full_image(path)
+            return
+
+        self.original_image = None
+        self.current_path = path
+        self.result_image = None
+        self.preview_image = None
+        self._proxy_image, _ = make_proxy(reduced, target[0], target[1])
+        # tỉ lệ tạm tính, được tính lại chính xác khi có ảnh gốc
+        self._proxy_scale = self._proxy_image.shape[1] / float(reduced.shape[1] * factor)
+        self._proxy_target = target
+        self.original_label.set_image(reduced)
+        self.statusBar().showMessage(
+            f"Đang mở ảnh: {os.path.basename(path)} ({size[0]}x{size[1]})"
+        )
+        self._scheduler.submit(
+            self._proxy_image,
+            scale_config(self._build_config_from_ui(), self._proxy_scale),
+            self.sharpness_slider.value(),
+            mode=self._current_mode_key(),
+            full_res=False,
+        )
+        # để giao diện vẽ bản thu nhỏ trước khi giải mã ảnh gốc
+        QTimer.singleShot(0, lambda: self._load_full_image(path))
 
+    @staticmethod
+    def _decode_file(path: str, factor: int = 1) -> Optional[np.ndarray]:
+        # np.fromfile + imdecode: đọc được cả đường dẫn có dấu trên Windows
         data = np.fromfile(path, dtype=np.uint8)
-        img = cv2.imdecode(data, cv2.IMREAD_COLOR)
+        return cv2.imdecode(data, decode_flags(factor))
+
+    def _load_full_image(self, path: str) -> None:
+        if path != self._opening_path:
+            return   # người dùng đã mở ảnh khác
+        img = self._decode_file(path)
         if img is None:
             QMessageBox.critical(self, "Lỗi khi mở ảnh", f"Không đọc được ảnh từ: {path}")
             return
 
+        self._set_original_image(img, path)
+
+    def _set_original_image(self, img: np.ndarray, path: str) -> None:
         self.original_image = img
         self.current_path = path
-        self.statusBar().showMessage(f"Đã mở ảnh: {os.path.basename(path)}")
+        self.result_image = None
+        h, w = img.shape[:2]
+        proxy = self._proxy_image
+        if proxy is not None and abs(proxy.shape[1] / proxy.shape[0] - w / h) < 0.02 * w / h:
+            # giữ proxy làm từ bản giải mã thu nhỏ, chỉ tính lại tỉ lệ chính xác
+            self._proxy_scale = proxy.shape[1] / float(w)
+        else:
+            self.preview_image = None
+            self._proxy_image = None
+            self._proxy_target = None
+        self.statusBar().showMessage(f"Đã mở ảnh: {os.path.basename(path)} ({w}x{h})")
 
         self.update_preview()
 
+    # ---------- phiên thư mục ----------
+
+    def open_folder(self) -> None:
+        folder = QFileDialog.getExistingDirectory(self, "Chọn thư mục ảnh")
+        if not folder:
+            return
+        paths = list_images_in_folder(folder)
+        if not paths:
+            QMessageBox.warning(self, "Thông báo", "Thư mục không có ảnh nào.")
+            return
+
+        self._close_session()
+        self._session = FolderSession(
+            paths,
+            self._cache,
+            radius=self.SESSION_RADIUS,
+            memory_mb=self.SESSION_MEMORY_MB,
+            thumb_size=self.THUMB_SIZE,
+            parent=self,
+        )
+        self._session.thumbnail_ready.connect(self._on_thumbnail_ready)
+        self._session.prerendered.connect(self._on_prerendered)
+
+        self.filmstrip.blockSignals(True)
+        for index in range(len(paths)):
+            item = QListWidgetItem(self._session.name(index))
+            item.setToolTip(paths[index])
+            self.filmstrip.addItem(item)
+        self.filmstrip.blockSignals(False)
+        self.filmstrip.show()
+        self.filmstrip.setCurrentRow(0)
+
+    def step_image(self, delta: int) -> None:
+        """Sang ảnh kế tiếp (delta=1) / trước đó (delta=-1) trong phiên."""
+        if self._session is None:
+            return
+        row = self.filmstrip.currentRow() + delta
+        if 0 <= row < len(self._session):
+            self.filmstrip.setCurrentRow(row)
+
+    def _close_session(self) -> None:
+        if self._session is None:
+            return
+        self._session.shutdown()
+        self._session.deleteLater()
+        self._session = None
+        self.filmstrip.blockSignals(True)
+        self.filmstrip.clear()
+        self.filmstrip.blockSignals(False)
+        self.filmstrip.hide()
+
+    def _on_filmstrip_row_changed(self, row: int) -> None:
+        if self._session is not None and row >= 0:
+            self._show_session_image(row)
+
+    def _show_session_image(self, index: int) -> None:
+        session = self._session
+        path = session.paths[index]
+        self._opening_path = path
+        try:
+            img = session.load(index)
+        except (FileNotFoundError, ValueError) as exc:
+            self.original_image = None
+            self.result_image = None
+            self.preview_image = None
+            self.original_label.set_image(None)
+            self.result_label.set_image(None)
+            self.statusBar().showMessage(f"Không đọc được ảnh: {session.name(index)} ({exc})")
+            return
+
+        # proxy của ảnh trước không dùng lại được
+        self._proxy_image = None
+        self._proxy_target = None
+        self.preview_image = None
+        mode = self._current_mode_key()
+        cfg = self._build_config_from_ui()
+        sharpness = self.sharpness_slider.value()
+        cached, _ = self._cache.get(self._cache.key(img, mode, cfg, sharpness))
+        if cached is not None:
+            # đã render trước ở nền -> hiện ngay, không cần proxy
+            self._preview_timer.stop()
+            self._full_res_timer.stop()
+            self.original_image = img
+            self.current_path = path
+            self.result_image = cached
+            self.preview_image = cached
+            self._refresh_viewers()
+        else:
+            self._set_original_image(img, path)
+
+        h, w = img.shape[:2]
+        self.statusBar().showMessage(
+            f"[{index + 1}/{len(session)}] {session.name(index)} ({w}x{h})"
+        )
+        session.set_current(index, cfg, sharpness, mode)
+
+    def _on_thumbnail_ready(self, index: int, thumb: np.ndarray) -> None:
+        item = self.filmstrip.item(index)
+        if item is None:
+            return
+        # QPixmap.fromImage sao chép dữ liệu -> mảng chỉ cần sống tới hết lệnh
+        data = displayable(thumb)
+        item.setIcon(QIcon(QPixmap.fromImage(numpy_to_qimage(data))))
+
+    def _on_prerendered(self, index: int) -> None:
+        item = self.filmstrip.item(index)
+        if item is not None and self._session is not None:
+            item.setToolTip(f"{self._session.paths[index]} (đã render trước)")
+
     def save_result(self) -> None:
-        if self.result_image is None:
+        if self.original_image is None:
             QMessageBox.warning(self, "Chưa có kết quả", "Bạn chưa xử lý ảnh nào.")
             return
 
+        # preview có thể chỉ là bản proxy -> render ảnh gốc trước khi lưu
+        if self.result_image is None and not self._render_full_res_now():
+            return
+
         path, _ = QFileDialog.getSaveFileName(
             self,
             "Lưu kết quả",
@@ -376,63 +616,152 @@ class SketchMainWindow(QMainWindow):
         self.blur_label.setText(str(self.sketch_blur_slider.value()))
         self.sharpness_label.setText(str(self.sharpness_slider.value()))
 
-        self.update_preview()
+        if self.original_image is None:
+            return
+        self._last_edit_at = time.perf_counter()
+        # gom các giá trị trung gian khi đang kéo slider
+        self._preview_timer.start()
+
+    def _get_analysis(self) -> ImageAnalysis:
+        """ImageAnalysis của ảnh gốc hiện tại (tạo lại khi đổi ảnh)."""
+        if self._analysis is None or self._analysis.image is not self.original_image:
+            self._analysis = ImageAnalysis(self.original_image)
+        return self._analysis
+
+    def _proxy_target_size(self) -> tuple:
+        """Kích thước khung kết quả tính theo pixel thật của màn hình."""
+        ratio = self.result_label.devicePixelRatioF()
+        return (
+            max(1, int(self.result_label.width() * ratio)),
+            max(1, int(self.result_label.height() * ratio)),
+        )
+
+    def _get_proxy(self):
+        """Ảnh proxy vừa với khung kết quả (tính lại khi khung đổi kích thước)."""
+        target = self._proxy_target_size()
+        if self._proxy_image is None or self._proxy_target != target:
+            self._proxy_image, self._proxy_scale = make_proxy(
+                self.original_image, target[0], target[1]
+            )
+            self._proxy_target = target
+        return self._proxy_image, self._proxy_scale
 
     def update_preview(self) -> None:
+        """Render nhanh trên proxy; ảnh gốc được render khi người dùng ngừng chỉnh."""
+        self._preview_timer.stop()
+        self._full_res_timer.stop()
+        if self.original_image is None:
+            return
+
+        self.result_image = None
+        proxy, scale = self._get_proxy()
+        if proxy is self.original_image:
+            self._render_full_res()
+            return
+
+        self._scheduler.submit(
+            proxy,
+            scale_config(self._build_config_from_ui(), scale),
+            self.sharpness_slider.value(),
+            mode=self._current_mode_key(),
+            full_res=False,
+        )
+        self._full_res_timer.start()
+
+    def _render_full_res(self) -> None:
+        self._full_res_timer.stop()
         if self.original_image is None:
             return
+        cfg = self._build_config_from_ui()
+        self._scheduler.submit(
+            self._get_analysis(),
+            cfg,
+            self.sharpness_slider.value(),
+            mode=self._current_mode_key(),
+            full_res=True,
+        )
+        if self._session is not None:
+            # tham số đã ổn định -> render trước ảnh lân cận với tham số mới
+            self._session.set_current(
+                self._session.index, cfg, self.sharpness_slider.value(), self._current_mode_key()
+            )
 
+    def _render_full_res_now(self) -> bool:
+        """Render đồng bộ ảnh gốc (dùng khi lưu mà chưa có kết quả full-res)."""
+        self._preview_timer.stop()
+        self._full_res_timer.stop()
+        QApplication.setOverrideCursor(Qt.WaitCursor)
         try:
-            cfg = self._build_config_from_ui()
-            sharpness = self.sharpness_slider.value()
-            mode = self._current_mode_key()
             result, _ = process_image(
-                self.original_image,
-                mode=mode,
-                config=cfg,
-                sharpness=sharpness,
+                self._get_analysis(),
+                mode=self._current_mode_key(),
+                config=self._build_config_from_ui(),
+                sharpness=self.sharpness_slider.value(),
+                cache=self._cache,
+                output="gray",
             )
         except Exception as exc:
             QMessageBox.critical(self, "Lỗi xử lý ảnh", str(exc))
-            return
+            return False
+        finally:
+            QApplication.restoreOverrideCursor()
 
         self.result_image = result
+        self.preview_image = result
         self._refresh_viewers()
+        return True
 
-    def _refresh_viewers(self) -> None:
-        if self.original_image is not None:
-            self._set_image_on_label(self.original_image, self.original_label)
-
-        if self.result_image is not None:
-            self._set_image_on_label(self.result_image, self.result_label)
-
-    def _set_image_on_label(self, img_bgr: np.ndarray, label: QLabel) -> None:
-        if img_bgr is None:
+    def _on_render_finished(self, result: RenderResult) -> None:
+        # chỉ hiển thị kết quả mới nhất, của đúng ảnh đang mở
+        if not self._scheduler.is_current(result.generation):
+            return
+        # render ảnh gốc chạy trên ImageAnalysis của ảnh gốc
+        if result.full_res and getattr(result.source, "image", None) is not self.original_image:
+            return
+        if not result.full_res and result.source is not self._proxy_image:
             return
 
-        if len(img_bgr.shape) == 2:
-            height, width = img_bgr.shape
-            bytes_per_line = width
-            qimg = QImage(
-                img_bgr.data, width, height, bytes_per_line, QImage.Format_Grayscale8
-            )
-        else:
-            rgb = cv2.cvtColor(img_bgr, cv2.COLOR_BGR2RGB)
-            height, width, ch = rgb.shape
-            bytes_per_line = ch * width
-            qimg = QImage(
-                rgb.data, width, height, bytes_per_line, QImage.Format_RGB888
-            )
+        if result.full_res:
+            self.result_image = result.image
+        self.preview_image = result.image
+        self._refresh_viewers()
 
-        pix = QPixmap.fromImage(qimg)
-        label.setPixmap(
-            pix.scaled(label.size(), Qt.KeepAspectRatio, Qt.SmoothTransformation)
+        latency_ms = result.latency_ms
+        if self._last_edit_at is not None:
+            latency_ms = (time.perf_counter() - self._last_edit_at) * 1000.0
+            self._last_edit_at = None
+        kind = "gốc" if result.full_res else "proxy"
+        self.latency_label.setText(
+            f"Render ({kind}): {result.compute_ms:.0f} ms | độ trễ: {latency_ms:.0f} ms"
         )
 
+    def _on_render_failed(self, generation: int, message: str) -> None:
+        self._last_edit_at = None
+        QMessageBox.critical(self, "Lỗi xử lý ảnh", message)
+
+    def closeEvent(self, event) -> None:
+        self._preview_timer.stop()
+        self._full_res_timer.stop()
+        self._scheduler.shutdown()
+        self._close_session()
+        super().closeEvent(event)
+
+    def _refresh_viewers(self) -> None:
+        # ảnh gốc không đổi -> ImageLabel dùng lại bản đã thu nhỏ
+        if self.original_image is not None:
+            self.original_label.set_image(self.original_image)
+
+        if self.preview_image is not None:
+            self.result_label.set_image(self.preview_image)
+
 
 def main() -> None:
     import sys
 
+    # cấu hình mặc định (OpenCV dùng hết các nhân, bật nhánh SIMD); khi
+    # FolderSession render trước trên thread nền, nó chia số thread OpenCV với
+    # RenderScheduler trong lúc render (xem session.py)
+    apply_runtime(AppConfig().runtime)
     app = QApplication(sys.argv)
     window = SketchMainWindow()
     window.resize(1200, 600)
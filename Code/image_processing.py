@@ -1,9 +1,43 @@
-from typing import Dict, Tuple
+from dataclasses import replace
+from typing import Any, Dict, Optional, Tuple
 
 import cv2
 import numpy as np
 
+from analysis import ImageAnalysis
 from config import AppConfig, DEFAULT_CONFIG, EdgeConfig, BilateralConfig
+from profiling import StageProfiler, profiled
+from smoothing import backend_radius, smooth
+
+
+class SketchWorkspace:
+    """
+    Bộ buffer cấp phát sẵn, đặt tên theo từng bước của pipeline. Buffer chỉ
+    được cấp phát lại khi kích thước ảnh đổi, nên render lặp lại trên ảnh cùng
+    kích thước (kéo slider, frame video, batch) không cấp phát mảng mới.
+
+    Kết quả trả về khi dùng workspace trỏ vào buffer của nó và sẽ bị ghi đè ở
+    lần gọi sau: hãy copy nếu cần giữ lại. Mỗi thread cần một workspace riêng.
+    """
+
+    def __init__(self) -> None:
+        self._buffers: Dict[str, np.ndarray] = {}
+        self.allocations = 0
+
+    def get(self, name: str, shape: Tuple[int, ...], dtype=np.uint8) -> np.ndarray:
+        buf = self._buffers.get(name)
+        if buf is None or buf.shape != tuple(shape) or buf.dtype != dtype:
+            buf = np.empty(shape, dtype=dtype)
+            self._buffers[name] = buf
+            self.allocations += 1
+        return buf
+
+    @property
+    def nbytes(self) -> int:
+        return sum(buf.nbytes for buf in self._buffers.values())
+
+    def clear(self) -> None:
+        self._buffers.clear()
 
 
 def _ensure_odd(k: int) -> int:
@@ -13,70 +47,375 @@ def _ensure_odd(k: int) -> int:
         k += 1
     return k
 
-def apply_bilateral(gray: np.ndarray, cfg: BilateralConfig) -> np.ndarray:
-    """Làm mịn bằng bilateral filter nhiều lần."""
-    result = gray.copy()
-    d = max(1, cfg.diameter)
-    if d % 2 == 0:
-        d += 1
-    for _ in range(max(1, cfg.iterations)):
-        result = cv2.bilateralFilter(result, d, cfg.sigma_color, cfg.sigma_space)
+def normalize_config(config: AppConfig) -> AppConfig:
+    """
+    Bản sao của config ở dạng chuẩn: kernel lẻ, iterations >= 1, ngưỡng Canny
+    low <= high. Hai config cho cùng kết quả sẽ có cùng dạng chuẩn.
+    """
+    low, high = _edge_key(config.edge)
+    d = _bilateral_key(config.smooth)[0]
+    return replace(
+        config,
+        edge=replace(config.edge, low_threshold=low, high_threshold=high),
+        smooth=replace(
+            config.smooth,
+            diameter=d,
+            sigma_color=float(config.smooth.sigma_color),
+            sigma_space=float(config.smooth.sigma_space),
+            iterations=max(1, config.smooth.iterations),
+        ),
+        sketch=replace(config.sketch, blur_ksize=_ensure_odd(config.sketch.blur_ksize)),
+    )
+
+
+def scale_config(config: AppConfig, scale: float) -> AppConfig:
+    """
+    Bản sao của config với các tham số tính theo pixel (diameter, sigma_space,
+    blur_ksize) được nhân theo `scale`, dùng khi render trên ảnh thu nhỏ.
+    """
+    if scale == 1.0:
+        return config
+    smooth = replace(
+        config.smooth,
+        diameter=max(1, int(round(config.smooth.diameter * scale))),
+        sigma_space=max(1.0, config.smooth.sigma_space * scale),
+    )
+    sketch = replace(
+        config.sketch,
+        blur_ksize=_ensure_odd(round(config.sketch.blur_ksize * scale)),
+    )
+    return replace(config, edge=replace(config.edge), smooth=smooth, sketch=sketch)
+
+
+def make_proxy(image: np.ndarray, max_width: int, max_height: int) -> Tuple[np.ndarray, float]:
+    """
+    Thu nhỏ ảnh để vừa khung max_width x max_height (không phóng to).
+    Trả về (ảnh proxy, tỉ lệ so với ảnh gốc).
+    """
+    h, w = image.shape[:2]
+    scale = min(max_width / float(w), max_height / float(h), 1.0)
+    if scale >= 1.0:
+        return image, 1.0
+    size = (max(1, int(round(w * scale))), max(1, int(round(h * scale))))
+    proxy = cv2.resize(image, size, interpolation=cv2.INTER_AREA)
+    return proxy, proxy.shape[1] / float(w)
+
+
+def apply_bilateral(
+    gray: np.ndarray,
+    cfg: BilateralConfig,
+    workspace: Optional[SketchWorkspace] = None,
+) -> np.ndarray:
+    """Làm mịn giữ biên nhiều lần (backend chọn qua cfg.backend, mặc định bilateral chính xác)."""
+    result = gray
+    for i in range(max(1, cfg.iterations)):
+        # hai buffer luân phiên vì bộ lọc không chạy tại chỗ được
+        dst = None if workspace is None else workspace.get(f"smooth_{i % 2}", gray.shape)
+        result = smooth(result, cfg, dst=dst)
     return result
 
 
-def detect_edges(gray: np.ndarray, cfg: EdgeConfig) -> np.ndarray:
+def detect_edges(
+    gray: np.ndarray,
+    cfg: EdgeConfig,
+    dst: Optional[np.ndarray] = None,
+) -> np.ndarray:
     """Phát hiện biên Canny."""
     low = int(cfg.low_threshold)
     high = int(cfg.high_threshold)
     if low > high:
         low, high = high, low
-    edges = cv2.Canny(gray, low, high)
+    edges = cv2.Canny(gray, low, high, edges=dst)
     return edges
 
 
-def pencil_sketch(image_bgr: np.ndarray, config: AppConfig = DEFAULT_CONFIG) -> np.ndarray:
-    """Sketch mềm (ít nét, giống phác hoạ)."""
-    gray = cv2.cvtColor(image_bgr, cv2.COLOR_BGR2GRAY)
+def _bilateral_key(cfg: BilateralConfig) -> tuple:
+    """Khoá cache cho tầng bilateral (đã chuẩn hoá như apply_bilateral)."""
+    d = max(1, cfg.diameter)
+    if d % 2 == 0:
+        d += 1
+    return (
+        d,
+        float(cfg.sigma_color),
+        float(cfg.sigma_space),
+        max(1, cfg.iterations),
+        cfg.backend,
+    )
 
-    # làm mịn trước để nhìn giống vẽ tay
-    smooth = apply_bilateral(gray, config.smooth)
 
-    # hiệu ứng dodge blend
-    inverted = 255 - smooth
-    k = _ensure_odd(config.sketch.blur_ksize)
-    blur = cv2.GaussianBlur(inverted, (k, k), 0)
+def _edge_key(cfg: EdgeConfig) -> tuple:
+    """Khoá cache cho tầng Canny (đã đổi chỗ ngưỡng như detect_edges)."""
+    low = int(cfg.low_threshold)
+    high = int(cfg.high_threshold)
+    if low > high:
+        low, high = high, low
+    return (low, high)
 
-    sketch_gray = cv2.divide(gray, 255 - blur, scale=256)
 
-    sketch_bgr = cv2.cvtColor(sketch_gray, cv2.COLOR_GRAY2BGR)
-    return sketch_bgr
+def is_strong(mode: str, sharpness: Optional[int]) -> bool:
+    """Nhánh sketch đậm (Canny + sharpen) hay sketch mềm, như process_image chọn."""
+    mode = (mode or "pencil").lower().strip()
+    return mode == "pencil" and (50 if sharpness is None else sharpness) >= 50
 
 
-def pencil_sketch_strong(image_bgr: np.ndarray, config: AppConfig = DEFAULT_CONFIG) -> np.ndarray:
-    """Sketch đậm, nét rõ (dùng thêm biên Canny + sharpen)."""
-    gray = cv2.cvtColor(image_bgr, cv2.COLOR_BGR2GRAY)
+def full_edges(image_bgr, cfg: EdgeConfig) -> np.ndarray:
+    """
+    Biên Canny của cả ảnh (ảnh BGR hoặc ImageAnalysis), dùng cho xử lý theo
+    tile / theo vùng: hysteresis của Canny lan theo đường biên không giới hạn,
+    nên Canny chạy trên một cửa sổ có thể khác Canny trên cả ảnh dù halo rộng
+    bao nhiêu. Chỉ là một mặt phẳng uint8, rẻ so với bilateral.
+    """
+    if isinstance(image_bgr, ImageAnalysis):
+        return image_bgr.edges(*_edge_key(cfg), keep=False)
+    return detect_edges(_gray_of(image_bgr), cfg)
+
+
+def _gray_of(image_bgr) -> np.ndarray:
+    if isinstance(image_bgr, ImageAnalysis):
+        return image_bgr.gray
+    return cv2.cvtColor(image_bgr, cv2.COLOR_BGR2GRAY)
+
 
-    smooth = apply_bilateral(gray, config.smooth)
-    inverted = 255 - smooth
+def compute_halo(config: AppConfig, sharpness: int = 50) -> int:
+    """
+    Bán kính ảnh hưởng (pixel) của pipeline khi biên Canny được lấy từ cả ảnh
+    (full_edges): một pixel đầu ra chỉ phụ thuộc vào các pixel đầu vào cách nó
+    không quá số pixel này, cộng với biên Canny tại đúng vị trí đó.
+    Dùng để xử lý theo tile / theo vùng mà không bị lộ đường nối
+    (với backend "grid", lưới phụ thuộc vị trí tile nên kết quả chỉ xấp xỉ).
+    """
+    iterations = max(1, config.smooth.iterations)
     k = _ensure_odd(config.sketch.blur_ksize)
-    blur = cv2.GaussianBlur(inverted, (k, k), 0)
-    sketch = cv2.divide(gray, 255 - blur, scale=256)
+    halo = backend_radius(config.smooth) * iterations + k // 2
+    if sharpness is None or sharpness >= 50:
+        # nhánh sketch đậm: kernel sharpen 3x3
+        halo += 1
+    return halo
 
-    # biên Canny
-    edges = detect_edges(gray, config.edge)
-    edges_inv = cv2.bitwise_not(edges)
 
-    # kết hợp sketch + edges
-    combined = cv2.bitwise_and(sketch, edges_inv)
+SHARPEN_KERNEL = np.array([[0, -1, 0],
+                            [-1, 5, -1],
+                            [0, -1, 0]], dtype=np.float32)
+
+
+def _ws_buffer(workspace: Optional[SketchWorkspace], name: str, shape) -> Optional[np.ndarray]:
+    return None if workspace is None else workspace.get(name, shape)
+
+
+def dodge_blend(
+    gray: np.ndarray,
+    smooth: np.ndarray,
+    ksize: int,
+    workspace: Optional[SketchWorkspace] = None,
+) -> np.ndarray:
+    """Hiệu ứng dodge blend: gray / (255 - blur(255 - smooth)), ksize lẻ."""
+    shape = gray.shape
+    # 255 - x với ảnh 8-bit chính là bitwise_not
+    inverted = cv2.bitwise_not(smooth, dst=_ws_buffer(workspace, "inverted", shape))
+    blur = cv2.GaussianBlur(inverted, (ksize, ksize), 0, dst=_ws_buffer(workspace, "blur", shape))
+    blur = cv2.bitwise_not(blur, dst=blur)
+    return cv2.divide(gray, blur, dst=_ws_buffer(workspace, "dodge", shape), scale=256)
+
 
+def sharpen_with_edges(
+    sketch: np.ndarray,
+    edges: np.ndarray,
+    workspace: Optional[SketchWorkspace] = None,
+) -> np.ndarray:
+    """Sketch đậm: xoá nét biên Canny khỏi sketch rồi sharpen."""
+    shape = sketch.shape
+    edges_inv = cv2.bitwise_not(edges, dst=_ws_buffer(workspace, "edges_inv", shape))
+    # kết hợp sketch + edges
+    combined = cv2.bitwise_and(sketch, edges_inv, dst=_ws_buffer(workspace, "combined", shape))
     # sharpen cho nét đậm hơn
-    kernel = np.array([[0, -1, 0],
-                       [-1, 5, -1],
-                       [0, -1, 0]], dtype=np.float32)
-    combined = cv2.filter2D(combined, -1, kernel)
+    return cv2.filter2D(combined, -1, SHARPEN_KERNEL, dst=_ws_buffer(workspace, "strong", shape))
+
+
+class SketchPipeline:
+    """
+    Pipeline sketch nhiều tầng, ghi nhớ kết quả trung gian của lần chạy gần nhất.
+
+    Mỗi tầng chỉ phụ thuộc vào ảnh đầu vào (so sánh theo identity) và đúng
+    những trường cấu hình nó dùng:
+      gray   <- ảnh
+      smooth <- gray + BilateralConfig
+      dodge  <- smooth + blur_ksize
+      edges  <- gray + EdgeConfig
+      strong <- dodge + edges
+    Ví dụ: kéo sharpness qua mốc 50 chỉ chạy lại phần Canny/sharpen,
+    đổi ngưỡng Canny không chạy lại bilateral.
+
+    Lưu ý: ảnh đầu vào không được sửa tại chỗ giữa các lần gọi
+    (cache nhận diện ảnh theo `is`).
+
+    Nếu gán `profiler`, mỗi tầng được tính lại (hoặc lấy từ cache) đều được ghi nhận.
+    Nếu có `workspace`, mọi bước ghi vào buffer cấp phát sẵn (xem SketchWorkspace).
+    Nếu đặt `fused` ("auto", "numba" hoặc "numpy"), phần đuôi dodge / sharpen
+    dùng kernel gộp trong fused.py (kết quả giống hệt).
+    Ảnh đầu vào có thể là ImageAnalysis: gray và edges được lấy từ ngữ cảnh đó
+    (dùng chung với auto_suggest_params) thay vì tính lại; biên tính mới chỉ
+    nằm trong cache của pipeline, không được giữ lại trong ngữ cảnh.
+    """
+
+    def __init__(
+        self,
+        profiler: Optional[StageProfiler] = None,
+        workspace: Optional[SketchWorkspace] = None,
+        fused: Optional[str] = None,
+    ) -> None:
+        self._image: Optional[np.ndarray] = None
+        self._cache: Dict[str, Tuple[tuple, np.ndarray]] = {}
+        self.profiler = profiler
+        self.workspace = workspace
+        self.fused = fused
+
+    def clear(self) -> None:
+        self._image = None
+        self._cache.clear()
+
+    def _bind(self, image_bgr: np.ndarray) -> None:
+        if image_bgr is not self._image:
+            self._image = image_bgr
+            self._cache.clear()
+
+    def buffer(self, name: str, shape: Tuple[int, ...]) -> Optional[np.ndarray]:
+        """Buffer của workspace, hoặc None (để OpenCV tự cấp phát) nếu không có workspace."""
+        if self.workspace is None:
+            return None
+        return self.workspace.get(name, shape)
+
+    def _stage(self, name: str, key: tuple, compute) -> np.ndarray:
+        hit = self._cache.get(name)
+        if hit is not None and hit[0] == key:
+            if self.profiler is not None:
+                self.profiler.hit(name)
+            return hit[1]
+        with profiled(self.profiler, name):
+            value = compute()
+        self._cache[name] = (key, value)
+        return value
+
+    # ---------- các tầng ----------
+
+    def gray(self, image_bgr: np.ndarray) -> np.ndarray:
+        self._bind(image_bgr)
+        if isinstance(image_bgr, ImageAnalysis):
+            return self._stage("gray", (), lambda: image_bgr.gray)
+        dst = self.buffer("gray", image_bgr.shape[:2])
+        return self._stage(
+            "gray", (), lambda: cv2.cvtColor(image_bgr, cv2.COLOR_BGR2GRAY, dst=dst)
+        )
+
+    def smooth(self, image_bgr: np.ndarray, cfg: BilateralConfig) -> np.ndarray:
+        gray = self.gray(image_bgr)
+        return self._stage(
+            "smooth", _bilateral_key(cfg), lambda: apply_bilateral(gray, cfg, self.workspace)
+        )
 
-    sketch_bgr = cv2.cvtColor(combined, cv2.COLOR_GRAY2BGR)
-    return sketch_bgr
+    def dodge(self, image_bgr: np.ndarray, config: AppConfig) -> np.ndarray:
+        """Hiệu ứng dodge blend: gray / (255 - blur(255 - smooth))."""
+        gray = self.gray(image_bgr)
+        smooth = self.smooth(image_bgr, config.smooth)
+        k = _ensure_odd(config.sketch.blur_ksize)
+
+        if self.fused:
+            import fused   # nạp khi cần (fused.py import module này)
+
+            def compute() -> np.ndarray:
+                shape = gray.shape
+                inverted = cv2.bitwise_not(smooth, dst=self.buffer("inverted", shape))
+                blur = cv2.GaussianBlur(inverted, (k, k), 0, dst=self.buffer("blur", shape))
+                return fused.dodge(gray, blur, self.fused, out=self.buffer("dodge", shape))
+        else:
+            def compute() -> np.ndarray:
+                return dodge_blend(gray, smooth, k, self.workspace)
+
+        return self._stage("dodge", (_bilateral_key(config.smooth), k), compute)
+
+    def edges(self, image_bgr: np.ndarray, cfg: EdgeConfig) -> np.ndarray:
+        gray = self.gray(image_bgr)
+        if isinstance(image_bgr, ImageAnalysis):
+            return self._stage(
+                "edges", _edge_key(cfg), lambda: image_bgr.edges(*_edge_key(cfg), keep=False)
+            )
+        dst = self.buffer("edges", gray.shape)
+        return self._stage("edges", _edge_key(cfg), lambda: detect_edges(gray, cfg, dst))
+
+    def strong(self, image_bgr: np.ndarray, config: AppConfig) -> np.ndarray:
+        """Sketch đậm (ảnh xám): dodge + biên Canny + sharpen."""
+        sketch = self.dodge(image_bgr, config)
+        edges = self.edges(image_bgr, config.edge)
+
+        key = (
+            _bilateral_key(config.smooth),
+            _ensure_odd(config.sketch.blur_ksize),
+            _edge_key(config.edge),
+        )
+        if self.fused:
+            import fused
+
+            def compute() -> np.ndarray:
+                out = self.buffer("strong", sketch.shape)
+                return fused.masked_sharpen(sketch, edges, self.fused, out=out)
+        else:
+            def compute() -> np.ndarray:
+                return sharpen_with_edges(sketch, edges, self.workspace)
+
+        return self._stage("strong", key, compute)
+
+
+# "gray": giữ kết quả 1 kênh (nhỏ hơn 3 lần); "bgr": mở rộng thành 3 kênh
+OUTPUT_FORMATS = ("bgr", "gray")
+
+
+def to_bgr(image: np.ndarray, dst: Optional[np.ndarray] = None) -> np.ndarray:
+    """Mở rộng ảnh xám thành BGR 3 kênh (ảnh đã có 3 kênh được giữ nguyên)."""
+    if image.ndim == 3:
+        return image
+    return cv2.cvtColor(image, cv2.COLOR_GRAY2BGR, dst=dst)
+
+
+def to_output_format(image: np.ndarray, output: str) -> np.ndarray:
+    """Đưa kết quả (1 hoặc 3 kênh) về định dạng `output` ("bgr" / "gray")."""
+    if output == "gray":
+        return image if image.ndim == 2 else cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+    return to_bgr(image)
+
+
+def _finish(sketch_gray: np.ndarray, pipeline: SketchPipeline, output: str) -> np.ndarray:
+    """Chỉ chuyển sang 3 kênh khi người dùng yêu cầu."""
+    if output == "gray":
+        return sketch_gray
+    with profiled(pipeline.profiler, "to_bgr"):
+        return to_bgr(sketch_gray, pipeline.buffer("bgr", sketch_gray.shape + (3,)))
+
+
+def pencil_sketch(
+    image_bgr: np.ndarray,
+    config: AppConfig = DEFAULT_CONFIG,
+    pipeline: Optional[SketchPipeline] = None,
+    output: str = "bgr",
+) -> np.ndarray:
+    """Sketch mềm (ít nét, giống phác hoạ)."""
+    if pipeline is None:
+        pipeline = SketchPipeline()
+    return _finish(pipeline.dodge(image_bgr, config), pipeline, output)
+
+
+def pencil_sketch_strong(
+    image_bgr: np.ndarray,
+    config: AppConfig = DEFAULT_CONFIG,
+    pipeline: Optional[SketchPipeline] = None,
+    output: str = "bgr",
+) -> np.ndarray:
+    """Sketch đậm, nét rõ (dùng thêm biên Canny + sharpen)."""
+    if pipeline is None:
+        pipeline = SketchPipeline()
+    return _finish(pipeline.strong(image_bgr, config), pipeline, output)
+
+
+# (y0, y1, x0, x1): vùng chữ nhật (tile, ROI), nửa mở như slice của NumPy
+Tile = Tuple[int, int, int, int]
 
 
 def process_image(
@@ -84,27 +423,255 @@ def process_image(
     mode: str = "pencil",
     config: AppConfig = None,
     sharpness: int = 50,
-) -> Tuple[np.ndarray, Dict[str, np.ndarray]]:
+    pipeline: Optional[SketchPipeline] = None,
+    profiler: Optional[StageProfiler] = None,
+    cache=None,
+    workspace: Optional[SketchWorkspace] = None,
+    output: str = "bgr",
+    roi: Optional[Tile] = None,
+    base: Optional[np.ndarray] = None,
+) -> Tuple[np.ndarray, Dict[str, Any]]:
     """
     Hàm xử lý ảnh chính.
+    pipeline: nếu truyền vào, các tầng trung gian được tái sử dụng giữa các lần gọi
+    (ví dụ khi kéo slider trên cùng một ảnh).
+    profiler: nếu truyền vào, extras["timings"] chứa wall/CPU time và đỉnh bộ nhớ
+    của từng tầng (xem profiling.py).
+    cache: ResultCache (xem result_cache.py); kết quả trùng khoá được lấy lại
+    thay vì tính, extras["cache"] cho biết tầng trúng ("memory"/"disk"/"miss").
+    Kết quả đi qua cache là mảng chỉ đọc.
+    workspace: buffer cấp phát sẵn (khi không truyền pipeline); kết quả trỏ vào
+    workspace và bị ghi đè ở lần gọi sau.
+    output: "bgr" (mặc định) hoặc "gray" để giữ kết quả 1 kênh; cache luôn lưu
+    bản 1 kênh và chỉ mở rộng ra 3 kênh khi được yêu cầu.
+    image_bgr có thể là ImageAnalysis (xem analysis.py): ảnh xám và biên Canny
+    đã tính (ví dụ bởi auto_suggest_params) được dùng lại.
+    roi=(y0, y1, x0, x1): chỉ tính vùng này cùng viền halo (xem process_region);
+    có `base` thì trả về cả ảnh với vùng bị ảnh hưởng được vá vào `base`.
     Trả về:
-      - result_bgr: ảnh kết quả BGR
-      - extras: dict (để GUI có thể unpack, tạm để rỗng)
+      - result_bgr: ảnh kết quả BGR (hoặc ảnh xám nếu output="gray")
+      - extras: dict (để GUI có thể unpack; rỗng nếu không bật profiler/cache)
     """
     if config is None:
         config = DEFAULT_CONFIG
+    if output not in OUTPUT_FORMATS:
+        raise ValueError(f"output không hợp lệ: {output!r} (hỗ trợ: {', '.join(OUTPUT_FORMATS)})")
+    if roi is not None:
+        return process_region(
+            image_bgr, roi, mode, config, sharpness,
+            base=base, cache=cache, workspace=workspace, output=output,
+        )
+    if pipeline is None and workspace is not None:
+        pipeline = SketchPipeline(workspace=workspace)
+
+    if cache is not None:
+        source = image_bgr.source if isinstance(image_bgr, ImageAnalysis) else image_bgr
+        key = cache.key(source, mode, config, sharpness)
+        cached, tier = cache.get(key)
+        extras: Dict[str, Any] = {}
+        if cached is None:
+            cached, extras = process_image(
+                image_bgr, mode, config, sharpness,
+                pipeline=pipeline, profiler=profiler, output="gray",
+            )
+            if pipeline is not None and pipeline.workspace is not None:
+                # kết quả nằm trong buffer của workspace -> cache giữ bản sao
+                cached = cached.copy()
+            cache.put(key, cached)
+        extras["cache"] = tier
+        return to_output_format(cached, output), extras
 
     mode = (mode or "pencil").lower().strip()
+    # mode khác "pencil" -> fallback an toàn về sketch mềm
+    strong = is_strong(mode, sharpness)
+    sketch_fn = pencil_sketch_strong if strong else pencil_sketch
 
-    if mode == "pencil":
-        if sharpness is None:
-            sharpness = 50
-        if sharpness < 50:
-            result = pencil_sketch(image_bgr, config)
-        else:
-            result = pencil_sketch_strong(image_bgr, config)
-        return result, {}
+    if profiler is None:
+        return sketch_fn(image_bgr, config, pipeline, output), {}
+
+    if pipeline is None:
+        pipeline = SketchPipeline()
+    previous = pipeline.profiler
+    pipeline.profiler = profiler
+    labels = {"mode": mode, "branch": "strong" if strong else "soft"}
+    try:
+        with profiler.session(labels):
+            result = sketch_fn(image_bgr, config, pipeline, output)
+    finally:
+        pipeline.profiler = previous
+    return result, {"timings": profiler.report()}
+
+
+# ---------- xử lý theo vùng ----------
+
+def expand_region(region: Tile, margin: int, shape: Tuple[int, ...]) -> Tile:
+    """Nới rộng `region` thêm `margin` pixel mỗi phía, cắt theo kích thước ảnh."""
+    h, w = shape[:2]
+    y0, y1, x0, x1 = region
+    return max(0, y0 - margin), min(h, y1 + margin), max(0, x0 - margin), min(w, x1 + margin)
+
+
+def _union(a: Tile, b: Tile) -> Tile:
+    return min(a[0], b[0]), max(a[1], b[1]), min(a[2], b[2]), max(a[3], b[3])
+
+
+# Canny tại một pixel (Sobel 3x3 + non-maximum suppression) chỉ đọc ảnh xám
+# trong bán kính 2; trước hysteresis, sửa trong roi không đổi gì ngoài roi + 2
+_CANNY_RADIUS = 2
+
+
+def _edge_change_bounds(
+    image_bgr,
+    cfg: EdgeConfig,
+    edges: np.ndarray,
+    roi: Tile,
+    base_edges: Optional[np.ndarray] = None,
+) -> Optional[Tile]:
+    """
+    Vùng bao mọi pixel mà biên Canny có thể đã đổi khi ảnh chỉ bị sửa trong roi
+    (None nếu không có pixel nào). Hysteresis lan theo đường biên nên vùng này
+    có thể vượt xa roi + halo.
+
+    - base_edges (biên của ảnh trước khi sửa): đúng vùng bao của edges XOR base_edges.
+    - không có: hysteresis chỉ lan giữa các pixel ứng viên (qua non-maximum
+      suppression, gradient > ngưỡng thấp — tức Canny với hai ngưỡng bằng
+      ngưỡng thấp) liền kề 8 hướng, và ứng viên ngoài roi + 2 không đổi. Một
+      pixel đổi trạng thái thì thành phần ứng viên của nó (trên ảnh mới) phải
+      chạm roi + 3, nên lấy vùng bao của các thành phần đó (rộng hơn cần thiết).
+    """
+    if base_edges is not None:
+        if base_edges.shape != edges.shape:
+            raise ValueError(f"base_edges có kích thước {base_edges.shape}, cần {edges.shape}")
+        points = cv2.findNonZero(cv2.bitwise_xor(edges, base_edges))
+        if points is None:
+            return None
+        x, y, w, h = cv2.boundingRect(points)
+        return y, y + h, x, x + w
+
+    low = _edge_key(cfg)[0]
+    candidates = cv2.Canny(_gray_of(image_bgr), low, low)
+    y0, y1, x0, x1 = near = expand_region(roi, _CANNY_RADIUS + 1, edges.shape)
+    bounds = near
+    # tô từng thành phần chạm vùng gần roi (255 -> 128), chỉ duyệt các thành phần đó
+    for y, x in zip(*np.nonzero(candidates[y0:y1, x0:x1])):
+        if candidates[y0 + y, x0 + x] != 255:
+            continue   # đã tô cùng một thành phần trước đó
+        _, _, _, (rx, ry, rw, rh) = cv2.floodFill(
+            candidates, None, (int(x0 + x), int(y0 + y)), 128, flags=8
+        )
+        bounds = _union(bounds, (ry, ry + rh, rx, rx + rw))
+    return bounds
+
+
+def render_window(
+    image_bgr: np.ndarray,
+    core: Tile,
+    halo: int,
+    mode: str,
+    config: AppConfig,
+    sharpness: int,
+    workspace: Optional[SketchWorkspace] = None,
+    output: str = "bgr",
+    edges: Optional[np.ndarray] = None,
+) -> np.ndarray:
+    """
+    Xử lý phần lõi `core` cùng viền halo, trả về đúng phần lõi.
+    edges: biên Canny của cả ảnh (full_edges), bắt buộc với nhánh sketch đậm;
+    bilateral / dodge / sharpen chạy trên cửa sổ, biên lấy đúng lát cắt tương ứng.
+    Nếu có workspace, kết quả trỏ vào buffer của nó (copy trước lần gọi sau).
+    """
+    y0, y1, x0, x1 = core
+    wy0, wy1, wx0, wx1 = expand_region(core, halo, image_bgr.shape)
+
+    window = image_bgr[wy0:wy1, wx0:wx1]
+    if is_strong(mode, sharpness):
+        if edges is None:
+            raise ValueError("Nhánh sketch đậm cần biên Canny của cả ảnh (full_edges)")
+        pipeline = SketchPipeline(workspace=workspace)
+        sketch = sharpen_with_edges(
+            pipeline.dodge(window, config), edges[wy0:wy1, wx0:wx1], workspace
+        )
+        result = _finish(sketch, pipeline, output)
+    else:
+        result, _ = process_image(
+            window, mode=mode, config=config, sharpness=sharpness, workspace=workspace,
+            output=output,
+        )
+    return result[y0 - wy0:y1 - wy0, x0 - wx0:x1 - wx0]
+
+
+def process_region(
+    image_bgr: np.ndarray,
+    roi: Tile,
+    mode: str = "pencil",
+    config: AppConfig = None,
+    sharpness: int = 50,
+    base: Optional[np.ndarray] = None,
+    cache=None,
+    workspace: Optional[SketchWorkspace] = None,
+    output: str = "bgr",
+    base_edges: Optional[np.ndarray] = None,
+) -> Tuple[np.ndarray, Dict[str, Any]]:
+    """
+    Chỉ tính lại một vùng chữ nhật roi=(y0, y1, x0, x1) thay vì cả ảnh.
+    Halo = compute_halo(config, sharpness): bán kính bilateral (diameter, số lần
+    lặp), blur_ksize của dodge và kernel sharpen 3x3. Nhánh sketch đậm luôn lấy
+    biên Canny từ cả ảnh (full_edges).
+
+    - base=None (xem trước vùng cắt): trả về kết quả của riêng vùng roi, tính
+      trên roi + halo; lấy thẳng từ kết quả đầy đủ trong cache nếu có.
+    - base = kết quả đầy đủ của ảnh trước khi sửa, roi = vùng ảnh vừa bị sửa
+      (ví dụ một nét cọ): phần dodge chỉ đổi trong roi + halo, còn biên Canny
+      có thể đổi xa hơn theo đường biên (xem _edge_change_bounds), nên vùng
+      tính lại là roi + halo cộng với vùng biên đổi (+1 cho sharpen), vá vào
+      bản sao của `base`. base không bị sửa; kết quả mới được đưa vào cache
+      (nếu có) theo ảnh mới. base_edges: biên Canny của ảnh trước khi sửa
+      (extras["edges"] của lần vá trước) cho vùng biên đổi nhỏ nhất.
+
+    extras["region"]: vùng kết quả đã tính lại; extras["cache"] khi trúng cache;
+    extras["edges"]: biên Canny của ảnh mới (nhánh đậm, khi có base).
+    Kết quả giống hệt xử lý cả ảnh (trừ các backend xấp xỉ, xem compute_halo).
+    """
+    if config is None:
+        config = DEFAULT_CONFIG
+    if output not in OUTPUT_FORMATS:
+        raise ValueError(f"output không hợp lệ: {output!r} (hỗ trợ: {', '.join(OUTPUT_FORMATS)})")
+    source = image_bgr.source if isinstance(image_bgr, ImageAnalysis) else image_bgr
+    roi = expand_region(tuple(int(v) for v in roi), 0, source.shape)
+    y0, y1, x0, x1 = roi
+    if y0 >= y1 or x0 >= x1:
+        raise ValueError(f"Vùng không hợp lệ hoặc nằm ngoài ảnh: {roi}")
+    halo = compute_halo(config, sharpness)
+    key = cache.key(source, mode, config, sharpness) if cache is not None else None
+
+    if base is None:
+        if cache is not None:
+            cached, tier = cache.get(key)
+            if cached is not None:
+                return to_output_format(cached[y0:y1, x0:x1], output), {"region": roi, "cache": tier}
+    edges = full_edges(image_bgr, config.edge) if is_strong(mode, sharpness) else None
+    if base is None:
+        result = render_window(source, roi, halo, mode, config, sharpness, workspace, output, edges)
+        return result, {"region": roi}
 
-    # fallback an toàn
-    result = pencil_sketch(image_bgr, config)
-    return result, {}
+    if base.shape[:2] != source.shape[:2]:
+        raise ValueError(f"base có kích thước {base.shape[:2]}, ảnh có {source.shape[:2]}")
+    # pixel ra chịu ảnh hưởng của pixel vào trong bán kính halo
+    region = expand_region(roi, halo, source.shape)
+    if edges is not None:
+        changed = _edge_change_bounds(image_bgr, config.edge, edges, roi, base_edges)
+        if changed is not None:
+            region = _union(region, expand_region(changed, 1, source.shape))
+    ry0, ry1, rx0, rx1 = region
+    # vá trên bản 1 kênh (như cache), chỉ mở rộng ra BGR khi được yêu cầu
+    result = to_output_format(base, "gray")
+    result = result.copy() if result is base else result
+    result[ry0:ry1, rx0:rx1] = render_window(
+        source, region, halo, mode, config, sharpness, workspace, "gray", edges
+    )
+    if cache is not None:
+        cache.put(key, result)
+    extras: Dict[str, Any] = {"region": region}
+    if edges is not None:
+        extras["edges"] = edges
+    return to_output_format(result, output), extras
@@ -0,0 +1,101 @@
+"""
+Hiển thị ảnh NumPy trên QLabel mà không chuyển màu / sao chép trung gian.
+
+QImage được tạo thẳng trên bộ nhớ của mảng: Format_BGR888 cho ảnh màu
+(Qt >= 5.14, bản cũ hơn mới phải đổi sang RGB) và Format_Grayscale8 cho ảnh
+xám. Chỉ bản đã thu nhỏ vừa khung mới được chuyển thành QPixmap, và được giữ
+lại theo kích thước khung: ảnh không đổi (ảnh gốc) chỉ được vẽ lại khi khung
+đổi kích thước, không phải ở mỗi lần render.
+"""
+from collections import OrderedDict
+from typing import Optional, Tuple
+
+import cv2
+import numpy as np
+from PyQt5.QtCore import QSize, Qt
+from PyQt5.QtGui import QImage, QPixmap
+from PyQt5.QtWidgets import QLabel, QSizePolicy
+
+HAS_BGR888 = hasattr(QImage, "Format_BGR888")
+
+
+def displayable(image: np.ndarray) -> np.ndarray:
+    """
+    Mảng mà Qt đọc được trực tiếp: chính `image` nếu đã liên tục (C-contiguous),
+    chỉ sao chép / đổi sang RGB khi cần (mảng bị cắt, Qt < 5.14).
+    """
+    if image.ndim == 3 and not HAS_BGR888:
+        return cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
+    return np.ascontiguousarray(image)
+
+
+def numpy_to_qimage(image: np.ndarray) -> QImage:
+    """
+    QImage dùng chung bộ nhớ với `image` (kết quả của displayable()).
+    QImage không giữ tham chiếu tới mảng: mảng phải sống lâu hơn QImage.
+    """
+    if image.ndim == 2:
+        fmt = QImage.Format_Grayscale8
+    elif HAS_BGR888:
+        fmt = QImage.Format_BGR888
+    else:
+        fmt = QImage.Format_RGB888
+    height, width = image.shape[:2]
+    return QImage(image.data, width, height, image.strides[0], fmt)
+
+
+class ImageLabel(QLabel):
+    """
+    QLabel hiển thị một ảnh NumPy vừa khung (giữ tỉ lệ).
+    Bản thu nhỏ được cache theo kích thước khung; đặt lại đúng mảng đang
+    hiển thị không tốn gì.
+    """
+
+    MAX_CACHED_SIZES = 4
+
+    def __init__(self, text: str = "", parent=None) -> None:
+        super().__init__(text, parent)
+        # không để pixmap quyết định kích thước khung -> thu nhỏ cửa sổ được
+        self.setSizePolicy(QSizePolicy.Ignored, QSizePolicy.Ignored)
+        self._image: Optional[np.ndarray] = None
+        self._display: Optional[np.ndarray] = None
+        self._pixmaps: "OrderedDict[Tuple[int, int, float], QPixmap]" = OrderedDict()
+
+    def image(self) -> Optional[np.ndarray]:
+        return self._image
+
+    def set_image(self, image: Optional[np.ndarray]) -> None:
+        if image is self._image:
+            return
+        self._image = image
+        self._pixmaps.clear()
+        if image is None:
+            self._display = None
+            self.clear()
+            return
+        self._display = displayable(image)
+        self._show_scaled()
+
+    def resizeEvent(self, event) -> None:
+        super().resizeEvent(event)
+        if self._image is not None:
+            self._show_scaled()
+
+    def _show_scaled(self) -> None:
+        ratio = self.devicePixelRatioF()
+        key = (self.width(), self.height(), ratio)
+        pix = self._pixmaps.get(key)
+        if pix is None:
+            target = QSize(max(1, int(key[0] * ratio)), max(1, int(key[1] * ratio)))
+            # thu nhỏ trên QImage dùng chung bộ nhớ, chỉ bản nhỏ được chép sang pixmap
+            scaled = numpy_to_qimage(self._display).scaled(
+                target, Qt.KeepAspectRatio, Qt.SmoothTransformation
+            )
+            pix = QPixmap.fromImage(scaled)
+            pix.setDevicePixelRatio(ratio)
+            self._pixmaps[key] = pix
+            while len(self._pixmaps) > self.MAX_CACHED_SIZES:
+                self._pixmaps.popitem(last=False)
+        else:
+            self._pixmaps.move_to_end(key)
+        self.setPixmap(pix)
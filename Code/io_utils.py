@@ -1,11 +1,32 @@
+import json
+import mmap
 import os
-from typing import List
+import queue
+import struct
+import threading
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Tuple
 
 import cv2
 import numpy as np
 
 IMAGE_EXTENSIONS = {".png", ".jpg", ".jpeg", ".bmp", ".tif", ".tiff"}
 
+# giải mã thu nhỏ: libjpeg scale ngay trong IDCT nên nhanh hơn nhiều so với
+# giải mã đủ rồi mới resize; các định dạng khác được OpenCV thu nhỏ sau khi giải mã
+REDUCTION_FACTORS = (8, 4, 2)
+_REDUCED_FLAGS = {
+    (2, False): cv2.IMREAD_REDUCED_COLOR_2,
+    (4, False): cv2.IMREAD_REDUCED_COLOR_4,
+    (8, False): cv2.IMREAD_REDUCED_COLOR_8,
+    (2, True): cv2.IMREAD_REDUCED_GRAYSCALE_2,
+    (4, True): cv2.IMREAD_REDUCED_GRAYSCALE_4,
+    (8, True): cv2.IMREAD_REDUCED_GRAYSCALE_8,
+}
+# các marker SOF của JPEG (chứa kích thước ảnh)
+_JPEG_SOF = {0xC0, 0xC1, 0xC2, 0xC3, 0xC5, 0xC6, 0xC7, 0xC9, 0xCA, 0xCB, 0xCD, 0xCE, 0xCF}
+
 
 def is_image_file(path: str) -> bool:
     """Kiểm tra path có phải file ảnh hay không dựa trên phần mở rộng."""
@@ -13,27 +34,133 @@ def is_image_file(path: str) -> bool:
     return ext in IMAGE_EXTENSIONS
 
 
-def list_images_in_folder(folder: str) -> List[str]:
-    """Liệt kê tất cả ảnh trong một thư mục (không đệ quy)."""
-    files: List[str] = []
-    if not os.path.isdir(folder):
-        return files
+def iter_images(folder: str, recursive: bool = False) -> Iterator[str]:
+    """
+    Duyệt lười các file ảnh bằng os.scandir (không stat từng file trên phần lớn
+    hệ thống file). Trong mỗi thư mục, file được trả về theo thứ tự tên,
+    rồi mới tới các thư mục con. Như os.walk, không đi vào symlink tới thư mục
+    (tránh vòng lặp kiểu sub/back -> ..); symlink tới file ảnh vẫn được liệt kê.
+    """
+    try:
+        with os.scandir(folder) as it:
+            entries = sorted(it, key=lambda e: e.name)
+    except (FileNotFoundError, NotADirectoryError, PermissionError):
+        return
+
+    subdirs = []
+    for entry in entries:
+        try:
+            if entry.is_file():
+                if is_image_file(entry.name):
+                    yield entry.path
+            elif recursive and entry.is_dir(follow_symlinks=False):
+                subdirs.append(entry.path)
+        except OSError:
+            continue
+    for path in subdirs:
+        yield from iter_images(path, recursive=True)
+
+
+def list_images_in_folder(folder: str, recursive: bool = False) -> List[str]:
+    """Liệt kê tất cả ảnh trong một thư mục (mặc định không đệ quy)."""
+    return sorted(iter_images(folder, recursive=recursive))
+
+
+def _probe_jpeg(f) -> Optional[Tuple[int, int]]:
+    while True:
+        byte = f.read(1)
+        if not byte:
+            return None
+        if byte != b"\xff":
+            continue
+        marker = f.read(1)
+        while marker == b"\xff":   # byte đệm
+            marker = f.read(1)
+        if not marker:
+            return None
+        code = marker[0]
+        if code == 0xD8 or 0xD0 <= code <= 0xD7 or code == 0x01:
+            continue                  # marker không có phần dữ liệu
+        if code in (0xD9, 0xDA):
+            return None               # hết ảnh / bắt đầu dữ liệu nén mà chưa thấy SOF
+        head = f.read(2)
+        if len(head) < 2:
+            return None
+        (length,) = struct.unpack(">H", head)
+        if code in _JPEG_SOF:
+            data = f.read(5)
+            if len(data) < 5:
+                return None
+            height, width = struct.unpack(">HH", data[1:5])
+            return width, height
+        f.seek(length - 2, os.SEEK_CUR)
 
-    for name in os.listdir(folder):
-        path = os.path.join(folder, name)
-        if os.path.isfile(path) and is_image_file(path):
-            files.append(path)
 
-    files.sort()
-    return files
+def probe_image_size(path: str) -> Optional[Tuple[int, int]]:
+    """
+    (width, height) đọc từ header của file JPEG / PNG / BMP mà không giải mã ảnh.
+    None nếu không nhận ra định dạng (ví dụ TIFF) hoặc header hỏng.
+    Với JPEG có EXIF xoay, kích thước là trước khi xoay.
+    """
+    try:
+        with open(path, "rb") as f:
+            head = f.read(26)
+            if head[:2] == b"\xff\xd8":
+                f.seek(2)
+                return _probe_jpeg(f)
+            if head[:8] == b"\x89PNG\r\n\x1a\n" and head[12:16] == b"IHDR":
+                return struct.unpack(">II", head[16:24])
+            if head[:2] == b"BM" and len(head) >= 26:
+                width, height = struct.unpack("<ii", head[18:26])
+                return abs(width), abs(height)
+    except (OSError, struct.error):
+        return None
+    return None
 
 
-def load_image(path: str) -> np.ndarray:
-    """Đọc ảnh màu (BGR)."""
+def reduction_factor(size: Tuple[int, int], target_size: Tuple[int, int]) -> int:
+    """
+    Hệ số thu nhỏ lớn nhất (1, 2, 4 hoặc 8) mà ảnh `size` sau khi chia vẫn
+    không nhỏ hơn kích thước cần để vừa khung `target_size` (cả hai: width, height).
+    """
+    w, h = size
+    tw, th = target_size
+    if w <= 0 or h <= 0:
+        return 1
+    # xét cả hai chiều xoay (EXIF) để không bao giờ giải mã nhỏ hơn cần thiết
+    scale = max(min(tw / w, th / h), min(tw / h, th / w))
+    for factor in REDUCTION_FACTORS:
+        if factor * scale <= 1.0:
+            return factor
+    return 1
+
+
+def decode_flags(factor: int = 1, grayscale: bool = False) -> int:
+    """Cờ cv2.imread / imdecode cho hệ số thu nhỏ `factor`."""
+    if factor > 1:
+        return _REDUCED_FLAGS[(factor, grayscale)]
+    return cv2.IMREAD_GRAYSCALE if grayscale else cv2.IMREAD_COLOR
+
+
+def load_image(
+    path: str,
+    target_size: Optional[Tuple[int, int]] = None,
+    grayscale: bool = False,
+) -> np.ndarray:
+    """
+    Đọc ảnh màu (BGR), hoặc ảnh xám nếu grayscale=True.
+    target_size=(width, height): chỉ cần ảnh vừa khung này -> giải mã ở 1/2,
+    1/4 hoặc 1/8 kích thước nếu được (ảnh trả về vẫn có thể lớn hơn khung).
+    """
     if not os.path.isfile(path):
         raise FileNotFoundError(f"Không tìm thấy file ảnh: {path}")
 
-    image = cv2.imread(path, cv2.IMREAD_COLOR)
+    factor = 1
+    if target_size is not None:
+        size = probe_image_size(path)
+        if size is not None:
+            factor = reduction_factor(size, target_size)
+    image = cv2.imread(path, decode_flags(factor, grayscale))
     if image is None:
         raise ValueError(f"Không đọc được ảnh từ: {path}")
 
@@ -49,3 +176,294 @@ def save_image(path: str, image: np.ndarray) -> None:
     success = cv2.imwrite(path, image)
     if not success:
         raise IOError(f"Lưu ảnh thất bại: {path}")
+
+
+# ---------- đọc trước / ghi nền ----------
+
+# (đường dẫn, ảnh hoặc None, lỗi hoặc None)
+Loaded = Tuple[str, Optional[np.ndarray], Optional[Exception]]
+
+
+def prefetch_images(
+    paths: Iterable[str],
+    workers: int = 4,
+    ahead: int = 8,
+    loader: Callable[[str], np.ndarray] = load_image,
+) -> Iterator[Loaded]:
+    """
+    Đọc và giải mã trước tối đa `ahead` ảnh trên thread pool, trả về theo đúng
+    thứ tự `paths`. Lỗi đọc của từng file được trả kèm thay vì ném ra.
+    cv2 nhả GIL khi đọc / giải mã nên các thread chạy song song thật sự.
+    """
+    ahead = max(1, ahead)
+    pending: "deque" = deque()
+    it = iter(paths)
+    with ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix="io-load") as pool:
+        for path in it:
+            pending.append((path, pool.submit(loader, path)))
+            if len(pending) >= ahead:
+                break
+        while pending:
+            path, future = pending.popleft()
+            next_path = next(it, None)
+            if next_path is not None:
+                pending.append((next_path, pool.submit(loader, next_path)))
+            try:
+                yield path, future.result(), None
+            except Exception as exc:
+                yield path, None, exc
+
+
+class AsyncImageWriter:
+    """
+    Hàng đợi ghi ảnh chạy nền: submit() trả về ngay, mã hoá + ghi file chạy
+    trên `workers` thread. Hàng đợi có giới hạn nên submit() chặn lại khi tầng
+    ghi không theo kịp. Lỗi ghi được gom vào `failures` thay vì ném ra; Future
+    mà submit() trả về cho biết kết quả ghi của từng ảnh.
+
+        with AsyncImageWriter(workers=2) as writer:
+            writer.submit("out/a.png", result)   # `result` không được sửa sau đó
+    """
+
+    def __init__(
+        self,
+        workers: int = 2,
+        max_queue: int = 16,
+        saver: Callable[[str, np.ndarray], None] = save_image,
+    ) -> None:
+        self.saver = saver
+        self.failures: List[Tuple[str, str]] = []
+        self.written = 0
+        self._lock = threading.Lock()
+        self._queue: "queue.Queue[Optional[Tuple[str, np.ndarray, Future]]]" = queue.Queue(
+            maxsize=max(1, max_queue)
+        )
+        self._threads = [
+            threading.Thread(target=self._run, name=f"io-write-{i}", daemon=True)
+            for i in range(max(1, workers))
+        ]
+        for t in self._threads:
+            t.start()
+
+    def submit(self, path: str, image: np.ndarray) -> Future:
+        """Future có kết quả None khi ghi xong, hoặc chuỗi lỗi (như trong `failures`)."""
+        future: Future = Future()
+        self._queue.put((path, image, future))
+        return future
+
+    def _run(self) -> None:
+        while True:
+            item = self._queue.get()
+            if item is None:
+                return
+            path, image, future = item
+            try:
+                self.saver(path, image)
+            except Exception as exc:
+                error = f"{type(exc).__name__}: {exc}"
+                with self._lock:
+                    self.failures.append((path, error))
+                future.set_result(error)
+            else:
+                with self._lock:
+                    self.written += 1
+                future.set_result(None)
+
+    def close(self) -> None:
+        """Chờ ghi hết các ảnh đã nhận rồi dừng các thread."""
+        for _ in self._threads:
+            self._queue.put(None)
+        for t in self._threads:
+            t.join()
+
+    def __enter__(self) -> "AsyncImageWriter":
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+
+# ---------- kho frame đã giải mã (mmap) ----------
+
+class FrameStore:
+    """
+    Kho ảnh đã giải mã trên đĩa, để các tầng / process khác nhau không phải
+    giải mã lại cùng một file nguồn.
+
+    frames.bin chứa điểm ảnh thô (BGR, tuỳ chọn thêm ảnh xám), mỗi mặt phẳng
+    bắt đầu ở biên 4 KiB; index.json ghi vị trí, kích thước và mtime / size
+    của file nguồn (file nguồn đổi -> frame bị coi là cũ). get() trả về mảng
+    chỉ đọc trỏ thẳng vào mmap: nhiều process dùng chung một bản trong page
+    cache thay vì mỗi process giữ một bản giải mã riêng.
+
+    Chỉ một process được ghi (update); process đọc tự mở lại index khi không
+    tìm thấy frame. Frame cũ bị bỏ lại trong frames.bin cho tới khi tạo lại kho.
+
+        store = FrameStore("cache/frames")
+        store.update(paths)                                  # giải mã một lần
+        gray = load_frame(paths[0], store, grayscale=True)   # không sao chép
+    """
+
+    DATA_FILE = "frames.bin"
+    INDEX_FILE = "index.json"
+    ALIGNMENT = 4096
+    VERSION = 1
+
+    def __init__(self, directory: str) -> None:
+        self.directory = os.path.abspath(os.path.expanduser(directory))
+        os.makedirs(self.directory, exist_ok=True)
+        self.data_path = os.path.join(self.directory, self.DATA_FILE)
+        self.index_path = os.path.join(self.directory, self.INDEX_FILE)
+        self._lock = threading.Lock()
+        self._map: Optional[mmap.mmap] = None
+        self._frames: Dict[str, Dict[str, Any]] = {}
+        self._index_mtime: Optional[int] = None
+        self._load_index()
+
+    # gửi sang process con chỉ kèm thư mục; process con tự mmap
+    def __getstate__(self) -> Dict[str, Any]:
+        return {"directory": self.directory}
+
+    def __setstate__(self, state: Dict[str, Any]) -> None:
+        self.__init__(state["directory"])
+
+    def __len__(self) -> int:
+        return len(self._frames)
+
+    def __contains__(self, path: str) -> bool:
+        return self._entry(path) is not None
+
+    def _load_index(self) -> None:
+        try:
+            mtime = os.stat(self.index_path).st_mtime_ns
+            with open(self.index_path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+        except FileNotFoundError:
+            self._frames, self._index_mtime = {}, None
+            return
+        if data.get("version") != self.VERSION:
+            raise ValueError(f"Kho frame không đúng phiên bản: {self.index_path}")
+        self._frames, self._index_mtime = data["frames"], mtime
+
+    def _write_index(self) -> None:
+        tmp = f"{self.index_path}.{os.getpid()}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump({"version": self.VERSION, "alignment": self.ALIGNMENT,
+                       "frames": self._frames}, f)
+        os.replace(tmp, self.index_path)
+        self._index_mtime = os.stat(self.index_path).st_mtime_ns
+
+    def _entry(self, path: str) -> Optional[Dict[str, Any]]:
+        """Mục của `path` trong index, None nếu chưa có hoặc file nguồn đã đổi."""
+        key = os.path.abspath(path)
+        entry = self._frames.get(key)
+        if entry is None:
+            # process ghi có thể vừa thêm frame
+            try:
+                mtime = os.stat(self.index_path).st_mtime_ns
+            except FileNotFoundError:
+                return None
+            if mtime != self._index_mtime:
+                with self._lock:
+                    self._load_index()
+                entry = self._frames.get(key)
+            if entry is None:
+                return None
+        try:
+            st = os.stat(key)
+        except OSError:
+            return None
+        if st.st_mtime_ns != entry["mtime_ns"] or st.st_size != entry["size"]:
+            return None
+        return entry
+
+    def _view(self, offset: int, shape: Tuple[int, ...]) -> np.ndarray:
+        end = offset + int(np.prod(shape))
+        with self._lock:
+            if self._map is None or end > len(self._map):
+                # file đã dài thêm -> map lại; map cũ còn sống tới khi hết mảng trỏ vào
+                with open(self.data_path, "rb") as f:
+                    self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            buffer = self._map
+        return np.ndarray(shape, dtype=np.uint8, buffer=buffer, offset=offset)
+
+    def get(self, path: str, grayscale: bool = False) -> Optional[np.ndarray]:
+        """
+        Frame của `path` (mảng chỉ đọc, không sao chép), None nếu kho không có
+        hoặc file nguồn đã đổi. Kho không có ảnh xám -> chuyển từ BGR (có sao chép).
+        """
+        entry = self._entry(path)
+        if entry is None:
+            return None
+        h, w = entry["height"], entry["width"]
+        if grayscale and entry["gray"] is not None:
+            return self._view(entry["gray"], (h, w))
+        image = self._view(entry["bgr"], (h, w, 3))
+        return cv2.cvtColor(image, cv2.COLOR_BGR2GRAY) if grayscale else image
+
+    def _write_plane(self, f, plane: np.ndarray) -> int:
+        offset = f.tell()
+        pad = -offset % self.ALIGNMENT
+        if pad:
+            f.write(b"\0" * pad)
+        f.write(memoryview(np.ascontiguousarray(plane)).cast("B"))
+        return offset + pad
+
+    def update(
+        self,
+        paths: Iterable[str],
+        grayscale: bool = True,
+        workers: int = 4,
+    ) -> List[Tuple[str, str]]:
+        """
+        Giải mã (trên `workers` thread) và ghi vào kho các ảnh chưa có hoặc đã
+        đổi. grayscale=True: lưu thêm mặt phẳng xám. Trả về [(đường dẫn, lỗi)].
+        """
+        failures: List[Tuple[str, str]] = []
+        # stat trước khi giải mã: file bị sửa trong lúc đọc sẽ bị coi là cũ
+        stats: Dict[str, os.stat_result] = {}
+        for path in paths:
+            key = os.path.abspath(path)
+            if key in stats or self._entry(key) is not None:
+                continue
+            try:
+                stats[key] = os.stat(key)
+            except OSError as exc:
+                failures.append((key, f"{type(exc).__name__}: {exc}"))
+        if not stats:
+            return failures
+
+        with open(self.data_path, "ab") as f:
+            for key, image, error in prefetch_images(stats, workers=workers):
+                if error is not None:
+                    failures.append((key, f"{type(error).__name__}: {error}"))
+                    continue
+                st = stats[key]
+                h, w = image.shape[:2]
+                gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY) if grayscale else None
+                self._frames[key] = {
+                    "mtime_ns": st.st_mtime_ns,
+                    "size": st.st_size,
+                    "height": h,
+                    "width": w,
+                    "bgr": self._write_plane(f, image),
+                    "gray": self._write_plane(f, gray) if gray is not None else None,
+                }
+        self._write_index()
+        return failures
+
+
+def load_frame(
+    path: str,
+    store: Optional[FrameStore] = None,
+    grayscale: bool = False,
+) -> np.ndarray:
+    """
+    Như load_image, nhưng lấy frame từ `store` nếu có (mảng chỉ đọc, không
+    giải mã / sao chép); ảnh chưa có trong kho được giải mã như bình thường.
+    """
+    if store is not None:
+        image = store.get(path, grayscale=grayscale)
+        if image is not None:
+            return image
+    return load_image(path, grayscale=grayscale)
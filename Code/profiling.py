@@ -0,0 +1,192 @@
+"""
+Đo thời gian và bộ nhớ cho từng tầng của pipeline (bật khi cần).
+
+    profiler = StageProfiler(sinks=[LoggingSink()])
+    result, extras = process_image(image, config=cfg, profiler=profiler)
+    extras["timings"]  # {"smooth": {"wall_ms": ..., "cpu_ms": ..., "peak_bytes": ...}, ...}
+
+cpu_ms là CPU time của cả process (gồm các thread nội bộ của OpenCV);
+peak_bytes là đỉnh bộ nhớ cấp phát thêm trong tầng, đo bằng tracemalloc
+(NumPy và các mảng kết quả của OpenCV đều được theo dõi).
+"""
+import logging
+import os
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterator, List, Optional
+
+# sink nhận (báo cáo theo tầng, nhãn) sau mỗi lần xử lý
+Sink = Callable[[Dict[str, dict], Dict[str, str]], None]
+
+
+class StageProfiler:
+    """Ghi lại wall time, CPU time và đỉnh bộ nhớ cho từng tầng trong một lần xử lý."""
+
+    def __init__(self, sinks: Optional[List[Sink]] = None, track_memory: bool = True) -> None:
+        self.sinks: List[Sink] = list(sinks or [])
+        self.track_memory = track_memory
+        self._stages: Dict[str, dict] = {}
+        self._started_tracing = False
+
+    def reset(self) -> None:
+        self._stages = {}
+
+    @contextmanager
+    def session(self, labels: Optional[Dict[str, str]] = None) -> Iterator["StageProfiler"]:
+        """Một lần xử lý: xoá số liệu cũ, bật tracemalloc nếu cần, gửi báo cáo cho các sink."""
+        self.reset()
+        if self.track_memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self._started_tracing = True
+        try:
+            yield self
+        finally:
+            if self._started_tracing:
+                tracemalloc.stop()
+                self._started_tracing = False
+        self.emit(labels or {})
+
+    @contextmanager
+    def stage(self, name: str) -> Iterator[None]:
+        memory = self.track_memory and tracemalloc.is_tracing()
+        if memory:
+            base, _ = tracemalloc.get_traced_memory()
+            tracemalloc.reset_peak()
+        wall = time.perf_counter()
+        cpu = time.process_time()
+        try:
+            yield
+        finally:
+            wall = time.perf_counter() - wall
+            cpu = time.process_time() - cpu
+            peak = 0
+            if memory:
+                _, peak_total = tracemalloc.get_traced_memory()
+                peak = max(0, peak_total - base)
+
+            stats = self._stages.setdefault(
+                name, {"wall_ms": 0.0, "cpu_ms": 0.0, "peak_bytes": 0, "calls": 0, "hits": 0}
+            )
+            stats["wall_ms"] += wall * 1000.0
+            stats["cpu_ms"] += cpu * 1000.0
+            stats["peak_bytes"] = max(stats["peak_bytes"], peak)
+            stats["calls"] += 1
+
+    def hit(self, name: str) -> None:
+        """Tầng được lấy từ cache, không phải tính lại."""
+        stats = self._stages.setdefault(
+            name, {"wall_ms": 0.0, "cpu_ms": 0.0, "peak_bytes": 0, "calls": 0, "hits": 0}
+        )
+        stats["hits"] += 1
+
+    def report(self) -> Dict[str, dict]:
+        return {name: dict(stats) for name, stats in self._stages.items()}
+
+    def emit(self, labels: Dict[str, str]) -> None:
+        report = self.report()
+        for sink in self.sinks:
+            sink(report, labels)
+
+
+@contextmanager
+def profiled(profiler: Optional[StageProfiler], name: str) -> Iterator[None]:
+    """Như profiler.stage(name) nhưng không làm gì khi profiler là None."""
+    if profiler is None:
+        yield
+    else:
+        with profiler.stage(name):
+            yield
+
+
+# ---------- sinks ----------
+
+class LoggingSink:
+    """Ghi một dòng log cho mỗi lần xử lý."""
+
+    def __init__(self, logger: Optional[logging.Logger] = None, level: int = logging.INFO) -> None:
+        self.logger = logger or logging.getLogger("sketch.profiling")
+        self.level = level
+
+    def __call__(self, report: Dict[str, dict], labels: Dict[str, str]) -> None:
+        parts = [
+            f"{name}={stats['wall_ms']:.1f}ms/cpu {stats['cpu_ms']:.1f}ms/"
+            f"{stats['peak_bytes'] / 1e6:.1f}MB"
+            for name, stats in report.items()
+            if stats["calls"]
+        ]
+        prefix = " ".join(f"{k}={v}" for k, v in sorted(labels.items()))
+        self.logger.log(self.level, "%s %s", prefix, " ".join(parts))
+
+
+class PrometheusTextSink:
+    """
+    Cộng dồn số liệu theo tầng và xuất theo định dạng text của Prometheus.
+    Nếu có `path`, file được ghi lại (nguyên tử) sau mỗi lần xử lý, dùng được
+    với textfile collector của node_exporter.
+    """
+
+    METRICS = (
+        ("wall_ms", "sketch_stage_wall_seconds", "Wall time theo tầng", 1e-3),
+        ("cpu_ms", "sketch_stage_cpu_seconds", "CPU time theo tầng", 1e-3),
+    )
+
+    def __init__(self, path: Optional[str] = None, prefix: str = "") -> None:
+        self.path = path
+        self.prefix = prefix
+        self._lock = threading.Lock()
+        self._totals: Dict[tuple, Dict[str, float]] = {}
+
+    def __call__(self, report: Dict[str, dict], labels: Dict[str, str]) -> None:
+        with self._lock:
+            for name, stats in report.items():
+                key = (name,) + tuple(sorted(labels.items()))
+                total = self._totals.setdefault(
+                    key, {"wall_ms": 0.0, "cpu_ms": 0.0, "count": 0, "hits": 0, "peak_bytes": 0}
+                )
+                total["wall_ms"] += stats["wall_ms"]
+                total["cpu_ms"] += stats["cpu_ms"]
+                total["count"] += stats["calls"]
+                total["hits"] += stats["hits"]
+                total["peak_bytes"] = max(total["peak_bytes"], stats["peak_bytes"])
+            text = self._render_locked()
+
+        if self.path:
+            tmp = self.path + ".tmp"
+            with open(tmp, "w", encoding="utf-8") as f:
+                f.write(text)
+            os.replace(tmp, self.path)
+
+    def render(self) -> str:
+        with self._lock:
+            return self._render_locked()
+
+    def _render_locked(self) -> str:
+        lines: List[str] = []
+
+        def label_str(key: tuple) -> str:
+            pairs = [("stage", key[0])] + list(key[1:])
+            return ",".join(f'{k}="{v}"' for k, v in pairs)
+
+        for field, metric, help_text, scale in self.METRICS:
+            metric = self.prefix + metric
+            lines.append(f"# HELP {metric} {help_text}")
+            lines.append(f"# TYPE {metric} summary")
+            for key, total in self._totals.items():
+                lines.append(f"{metric}_sum{{{label_str(key)}}} {total[field] * scale:.6f}")
+                lines.append(f"{metric}_count{{{label_str(key)}}} {total['count']}")
+
+        metric = self.prefix + "sketch_stage_cache_hits_total"
+        lines.append(f"# HELP {metric} Số lần tầng được lấy từ cache")
+        lines.append(f"# TYPE {metric} counter")
+        for key, total in self._totals.items():
+            lines.append(f"{metric}{{{label_str(key)}}} {total['hits']}")
+
+        metric = self.prefix + "sketch_stage_peak_bytes"
+        lines.append(f"# HELP {metric} Đỉnh bộ nhớ cấp phát thêm trong tầng")
+        lines.append(f"# TYPE {metric} gauge")
+        for key, total in self._totals.items():
+            lines.append(f"{metric}{{{label_str(key)}}} {total['peak_bytes']}")
+
+        return "\n".join(lines) + "\n"
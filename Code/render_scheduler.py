@@ -0,0 +1,156 @@
+"""
+Bộ lập lịch render chạy nền cho GUI.
+
+Chỉ giữ đúng một job đang chờ (latest-wins): job mới thay thế job cũ chưa
+chạy, và kết quả của job đã bị thay thế sẽ bị bỏ đi thay vì hiển thị.
+"""
+import threading
+import time
+from dataclasses import dataclass
+from typing import Dict, Optional
+
+import numpy as np
+from PyQt5.QtCore import QObject, pyqtSignal
+
+from config import AppConfig
+from image_processing import SketchPipeline, process_image
+from result_cache import ResultCache
+
+
+@dataclass
+class RenderJob:
+    generation: int
+    image: np.ndarray
+    config: AppConfig
+    sharpness: int
+    mode: str = "pencil"
+    full_res: bool = True
+    submitted_at: float = 0.0
+    # GUI hiển thị trực tiếp ảnh xám (Format_Grayscale8), không cần 3 kênh
+    output: str = "gray"
+
+
+@dataclass
+class RenderResult:
+    generation: int
+    image: np.ndarray
+    source: np.ndarray
+    full_res: bool
+    compute_ms: float
+    latency_ms: float
+
+
+class RenderScheduler(QObject):
+    """
+    Chạy process_image trên một thread riêng.
+    Tín hiệu `finished`/`failed` được phát về thread GUI (queued connection).
+    """
+
+    finished = pyqtSignal(object)   # RenderResult
+    failed = pyqtSignal(int, str)   # generation, thông báo lỗi
+
+    def __init__(
+        self,
+        parent: Optional[QObject] = None,
+        cache: Optional[ResultCache] = None,
+    ) -> None:
+        super().__init__(parent)
+        self.cache = cache
+        self._cond = threading.Condition()
+        self._pending: Optional[RenderJob] = None
+        self._generation = 0
+        self._stopped = False
+        # pipeline chỉ được dùng trên thread worker; proxy và ảnh gốc
+        # dùng pipeline riêng để không xoá cache của nhau
+        self._pipelines: Dict[bool, SketchPipeline] = {
+            True: SketchPipeline(),
+            False: SketchPipeline(),
+        }
+
+        self._thread = threading.Thread(
+            target=self._run, name="sketch-render", daemon=True
+        )
+        self._thread.start()
+
+    @property
+    def latest_generation(self) -> int:
+        return self._generation
+
+    def submit(
+        self,
+        image: np.ndarray,
+        config: AppConfig,
+        sharpness: int,
+        mode: str = "pencil",
+        full_res: bool = True,
+        output: str = "gray",
+    ) -> int:
+        """Đặt job mới, thay thế job đang chờ (nếu có). Trả về generation của job."""
+        with self._cond:
+            self._generation += 1
+            self._pending = RenderJob(
+                generation=self._generation,
+                image=image,
+                config=config,
+                sharpness=sharpness,
+                mode=mode,
+                full_res=full_res,
+                output=output,
+                submitted_at=time.perf_counter(),
+            )
+            self._cond.notify()
+            return self._generation
+
+    def is_current(self, generation: int) -> bool:
+        return generation == self._generation
+
+    def shutdown(self, timeout: float = 2.0) -> None:
+        with self._cond:
+            self._stopped = True
+            self._pending = None
+            self._cond.notify()
+        self._thread.join(timeout)
+
+    # ---------- thread worker ----------
+
+    def _run(self) -> None:
+        while True:
+            with self._cond:
+                while self._pending is None and not self._stopped:
+                    self._cond.wait()
+                if self._stopped:
+                    return
+                job = self._pending
+                self._pending = None
+
+            start = time.perf_counter()
+            try:
+                result, _ = process_image(
+                    job.image,
+                    mode=job.mode,
+                    config=job.config,
+                    sharpness=job.sharpness,
+                    pipeline=self._pipelines[job.full_res],
+                    cache=self.cache,
+                    output=job.output,
+                )
+            except Exception as exc:
+                if self.is_current(job.generation):
+                    self.failed.emit(job.generation, str(exc))
+                continue
+
+            # job đã bị thay thế trong lúc chạy -> bỏ kết quả
+            if not self.is_current(job.generation):
+                continue
+
+            end = time.perf_counter()
+            self.finished.emit(
+                RenderResult(
+                    generation=job.generation,
+                    image=result,
+                    source=job.image,
+                    full_res=job.full_res,
+                    compute_ms=(end - start) * 1000.0,
+                    latency_ms=(end - job.submitted_at) * 1000.0,
+                )
+            )
@@ -0,0 +1,231 @@
+"""
+Cache kết quả render theo nội dung (content-addressed).
+
+Khoá = sha256(bytes ảnh + shape/dtype) + cấu hình đã chuẩn hoá (kernel lẻ,
+ngưỡng Canny đã đổi chỗ) + nhánh sketch (mềm/đậm, suy ra từ sharpness).
+Hai tầng: LRU trong bộ nhớ và thư mục trên đĩa, cả hai giới hạn theo dung lượng.
+process_image lưu kết quả ở dạng 1 kênh (ảnh xám), mở rộng ra BGR khi đọc nếu cần.
+
+    cache = ResultCache(memory_mb=256, disk_dir="~/.cache/xla", disk_mb=2048)
+    result, extras = process_image(image, config=cfg, sharpness=60, cache=cache)
+"""
+import hashlib
+import json
+import os
+import threading
+import weakref
+from collections import OrderedDict
+from dataclasses import asdict
+from typing import Dict, Optional, Tuple
+
+import numpy as np
+
+from config import AppConfig
+from image_processing import is_strong, normalize_config
+
+MB = 1024 * 1024
+
+
+class MemoryLRU:
+    """LRU giới hạn theo tổng số byte của các mảng NumPy, an toàn khi dùng từ nhiều thread."""
+
+    def __init__(self, max_bytes: int) -> None:
+        self.max_bytes = int(max_bytes)
+        self._items: "OrderedDict[str, np.ndarray]" = OrderedDict()
+        self._nbytes = 0
+        self._lock = threading.Lock()
+
+    @property
+    def nbytes(self) -> int:
+        return self._nbytes
+
+    def __len__(self) -> int:
+        return len(self._items)
+
+    def __contains__(self, key: str) -> bool:
+        with self._lock:
+            return key in self._items
+
+    def get(self, key: str) -> Optional[np.ndarray]:
+        with self._lock:
+            value = self._items.get(key)
+            if value is not None:
+                self._items.move_to_end(key)
+            return value
+
+    def put(self, key: str, value: np.ndarray) -> None:
+        size = value.nbytes
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            old = self._items.pop(key, None)
+            if old is not None:
+                self._nbytes -= old.nbytes
+            self._items[key] = value
+            self._nbytes += size
+            while self._nbytes > self.max_bytes:
+                _, evicted = self._items.popitem(last=False)
+                self._nbytes -= evicted.nbytes
+
+    def discard(self, key: str) -> None:
+        with self._lock:
+            old = self._items.pop(key, None)
+            if old is not None:
+                self._nbytes -= old.nbytes
+
+    def clear(self) -> None:
+        with self._lock:
+            self._items.clear()
+            self._nbytes = 0
+
+
+class DiskCache:
+    """
+    Lưu mảng dạng .npy trong thư mục, xoá file dùng lâu nhất (theo mtime)
+    khi vượt dung lượng. Nhiều process có thể dùng chung một thư mục.
+    """
+
+    def __init__(self, directory: str, max_bytes: int) -> None:
+        self.directory = os.path.abspath(os.path.expanduser(directory))
+        self.max_bytes = int(max_bytes)
+        self._lock = threading.Lock()
+        os.makedirs(self.directory, exist_ok=True)
+        self._nbytes = sum(size for _, _, size in self._entries())
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, key[:2], key + ".npy")
+
+    def _entries(self):
+        for root, _, names in os.walk(self.directory):
+            for name in names:
+                if not name.endswith(".npy"):
+                    continue
+                path = os.path.join(root, name)
+                try:
+                    st = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                yield path, st.st_mtime, st.st_size
+
+    def get(self, key: str) -> Optional[np.ndarray]:
+        path = self._path(key)
+        try:
+            value = np.load(path, allow_pickle=False)
+            os.utime(path)   # đánh dấu vừa dùng
+        except (FileNotFoundError, ValueError, OSError):
+            return None
+        return value
+
+    def put(self, key: str, value: np.ndarray) -> None:
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp, "wb") as f:
+            np.save(f, value, allow_pickle=False)
+        with self._lock:
+            # ghi đè cùng khoá: trừ kích thước file cũ để không đếm hai lần
+            try:
+                old_size = os.path.getsize(path)
+            except FileNotFoundError:
+                old_size = 0
+            os.replace(tmp, path)
+            self._nbytes += os.path.getsize(path) - old_size
+            if self._nbytes > self.max_bytes:
+                self._evict_locked()
+
+    def _evict_locked(self) -> None:
+        entries = sorted(self._entries(), key=lambda e: e[1])
+        total = sum(size for _, _, size in entries)
+        # xoá bớt xuống 90% giới hạn để không phải quét thư mục sau mỗi lần ghi
+        target = int(self.max_bytes * 0.9)
+        for path, _, size in entries:
+            if total <= target:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+        self._nbytes = total
+
+
+class ResultCache:
+    """Cache kết quả process_image: LRU trong bộ nhớ, tuỳ chọn thêm tầng đĩa."""
+
+    def __init__(
+        self,
+        memory_mb: float = 256.0,
+        disk_dir: Optional[str] = None,
+        disk_mb: float = 2048.0,
+    ) -> None:
+        self.memory = MemoryLRU(int(memory_mb * MB))
+        self.disk = DiskCache(disk_dir, int(disk_mb * MB)) if disk_dir else None
+        self.hits_memory = 0
+        self.hits_disk = 0
+        self.misses = 0
+        # digest của vài ảnh gần nhất, nhận diện theo identity để không băm lại
+        self._digests: "OrderedDict[int, Tuple[weakref.ref, str]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def image_digest(self, image: np.ndarray) -> str:
+        """sha256 của nội dung ảnh (ảnh không được sửa tại chỗ sau khi đã băm)."""
+        with self._lock:
+            entry = self._digests.get(id(image))
+            if entry is not None and entry[0]() is image:
+                self._digests.move_to_end(id(image))
+                return entry[1]
+
+        h = hashlib.sha256()
+        h.update(f"{image.shape}|{image.dtype.str}|".encode())
+        h.update(memoryview(np.ascontiguousarray(image)).cast("B"))
+        digest = h.hexdigest()
+
+        with self._lock:
+            self._digests[id(image)] = (weakref.ref(image), digest)
+            while len(self._digests) > 8:
+                self._digests.popitem(last=False)
+        return digest
+
+    def key(self, image: np.ndarray, mode: str, config: AppConfig, sharpness: int) -> str:
+        cfg = normalize_config(config)
+        branch = "strong" if is_strong(mode, sharpness) else "soft"
+        params = {
+            "edge": asdict(cfg.edge),
+            "smooth": asdict(cfg.smooth),
+            "sketch": asdict(cfg.sketch),
+            "branch": branch,
+        }
+        h = hashlib.sha256(self.image_digest(image).encode())
+        h.update(json.dumps(params, sort_keys=True).encode())
+        return h.hexdigest()
+
+    def get(self, key: str) -> Tuple[Optional[np.ndarray], str]:
+        """Trả về (kết quả hoặc None, tầng: "memory" / "disk" / "miss")."""
+        value = self.memory.get(key)
+        if value is not None:
+            self.hits_memory += 1
+            return value, "memory"
+        if self.disk is not None:
+            value = self.disk.get(key)
+            if value is not None:
+                value.flags.writeable = False
+                self.memory.put(key, value)
+                self.hits_disk += 1
+                return value, "disk"
+        self.misses += 1
+        return None, "miss"
+
+    def put(self, key: str, value: np.ndarray) -> None:
+        # mảng trong cache được dùng chung -> không cho sửa tại chỗ
+        value.flags.writeable = False
+        self.memory.put(key, value)
+        if self.disk is not None:
+            self.disk.put(key, value)
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "hits_memory": self.hits_memory,
+            "hits_disk": self.hits_disk,
+            "misses": self.misses,
+            "memory_bytes": self.memory.nbytes,
+        }
@@ -0,0 +1,160 @@
+"""
+Cấu hình thực thi đa nhân: số thread nội bộ của OpenCV, nhánh tối ưu SIMD,
+số thread BLAS và gán process con vào nhân CPU.
+
+cv2.bilateralFilter / GaussianBlur / Canny tự chia việc cho nhiều thread. Khi đã
+chạy N process (hoặc N thread) song song, mỗi cái lại mở thêm ~số-nhân thread
+của OpenCV -> quá tải (oversubscription), chậm hơn cả chạy ít worker.
+process_pool() chia đều số nhân cho các process con; split_cv_threads() làm
+điều tương tự cho thread pool trong cùng process.
+
+    runtime = RuntimeConfig(pin_workers=True)
+    apply_runtime(runtime)                          # process hiện tại
+    with process_pool(8, runtime) as pool: ...      # process con
+
+Đo khả năng mở rộng theo số worker: python benchmark.py --scaling 1 2 4 8
+"""
+import argparse
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
+from dataclasses import replace
+from typing import Iterator, List, Optional
+
+import cv2
+
+from config import RuntimeConfig
+
+# biến môi trường mà OpenBLAS / MKL / OpenMP đọc khi khởi tạo
+BLAS_ENV_VARS = (
+    "OMP_NUM_THREADS",
+    "OPENBLAS_NUM_THREADS",
+    "MKL_NUM_THREADS",
+    "VECLIB_MAXIMUM_THREADS",
+    "NUMEXPR_NUM_THREADS",
+)
+
+
+def cpu_count() -> int:
+    """Số nhân process hiện tại được phép dùng (tính cả affinity / cpuset)."""
+    if hasattr(os, "sched_getaffinity"):
+        return max(1, len(os.sched_getaffinity(0)))
+    return os.cpu_count() or 1
+
+
+def for_workers(runtime: RuntimeConfig, workers: int) -> RuntimeConfig:
+    """
+    Cấu hình cho mỗi process con khi chạy `workers` process song song:
+    giá trị chưa đặt (None) được thay bằng phần nhân chia đều cho mỗi process.
+    """
+    share = max(1, cpu_count() // max(1, workers))
+    return replace(
+        runtime,
+        cv_threads=share if runtime.cv_threads is None else runtime.cv_threads,
+        blas_threads=share if runtime.blas_threads is None else runtime.blas_threads,
+    )
+
+
+def _limit_blas(threads: int) -> None:
+    # thư viện BLAS đã khởi tạo không đọc lại biến môi trường -> dùng threadpoolctl nếu có
+    try:
+        from threadpoolctl import threadpool_limits
+    except ImportError:
+        return
+    threadpool_limits(limits=threads)
+
+
+def apply_runtime(runtime: RuntimeConfig) -> None:
+    """Áp cấu hình cho process hiện tại (gọi lại được, giá trị None giữ nguyên)."""
+    if runtime.blas_threads is not None:
+        threads = max(1, int(runtime.blas_threads))
+        for name in BLAS_ENV_VARS:
+            os.environ[name] = str(threads)
+        _limit_blas(threads)
+    cv2.setUseOptimized(bool(runtime.use_optimized))
+    if runtime.cv_threads is not None:
+        cv2.setNumThreads(max(0, int(runtime.cv_threads)))
+
+
+def _pin(index: int, threads: int) -> None:
+    """Gán process hiện tại vào nhóm nhân thứ `index` (mỗi nhóm `threads` nhân)."""
+    if not hasattr(os, "sched_setaffinity"):
+        return
+    cpus: List[int] = sorted(os.sched_getaffinity(0))
+    size = max(1, min(threads, len(cpus)))
+    groups = max(1, len(cpus) // size)
+    start = (index % groups) * size
+    os.sched_setaffinity(0, cpus[start:start + size])
+
+
+def _init_worker(runtime: RuntimeConfig, counter) -> None:
+    if counter is not None:
+        # chỉ số của process con, tăng dần theo thứ tự khởi động
+        with counter.get_lock():
+            index = counter.value
+            counter.value += 1
+        _pin(index, runtime.cv_threads or 1)
+    apply_runtime(runtime)
+
+
+def process_pool(workers: int, runtime: Optional[RuntimeConfig] = None) -> ProcessPoolExecutor:
+    """ProcessPoolExecutor mà mỗi process con áp for_workers(runtime, workers) khi khởi động."""
+    workers = max(1, int(workers))
+    runtime = for_workers(runtime or RuntimeConfig(), workers)
+    counter = multiprocessing.Value("i", 0) if runtime.pin_workers else None
+    return ProcessPoolExecutor(
+        max_workers=workers, initializer=_init_worker, initargs=(runtime, counter)
+    )
+
+
+_split_lock = threading.Lock()
+_split_depth = 0
+_split_saved = 0
+
+
+@contextmanager
+def split_cv_threads(workers: int) -> Iterator[None]:
+    """
+    Trong khối with, chia số thread OpenCV hiện có cho `workers` thread chạy
+    song song. cv2.setNumThreads có hiệu lực cho cả process nên các khối lồng
+    nhau / chồng nhau dùng chung một giá trị gốc, khôi phục khi khối cuối kết thúc.
+    """
+    global _split_depth, _split_saved
+    with _split_lock:
+        if _split_depth == 0:
+            _split_saved = cv2.getNumThreads()
+        _split_depth += 1
+        cv2.setNumThreads(min(cv2.getNumThreads(), max(1, _split_saved // max(1, workers))))
+    try:
+        yield
+    finally:
+        with _split_lock:
+            _split_depth -= 1
+            if _split_depth == 0:
+                cv2.setNumThreads(_split_saved)
+
+
+# ---------- CLI ----------
+
+def add_runtime_arguments(parser: argparse.ArgumentParser) -> None:
+    """Thêm các tuỳ chọn của RuntimeConfig vào parser của một CLI."""
+    group = parser.add_argument_group("thực thi")
+    group.add_argument("--cv-threads", type=int, default=None,
+                       help="Số thread OpenCV cho mỗi process (mặc định: chia đều số nhân)")
+    group.add_argument("--blas-threads", type=int, default=None,
+                       help="Số thread BLAS/OpenMP cho mỗi process")
+    group.add_argument("--pin-workers", action="store_true",
+                       help="Gán mỗi process con vào nhóm nhân CPU riêng (Linux)")
+    group.add_argument("--no-optimized", action="store_true",
+                       help="Tắt nhánh SIMD của OpenCV (cv2.setUseOptimized(False))")
+
+
+def runtime_from_args(args: argparse.Namespace) -> RuntimeConfig:
+    return RuntimeConfig(
+        cv_threads=args.cv_threads,
+        use_optimized=not args.no_optimized,
+        blas_threads=args.blas_threads,
+        pin_workers=args.pin_workers,
+    )
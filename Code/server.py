@@ -0,0 +1,429 @@
+"""
+Dịch vụ HTTP cục bộ cho process_image và auto_suggest_params (chỉ dùng thư viện chuẩn).
+
+    POST /sketch        ảnh (multipart field "image" hoặc body thô) -> ảnh sketch đã mã hoá
+    POST /auto-params   ảnh -> JSON tham số gợi ý
+    GET  /health        trạng thái hàng đợi
+
+Tham số đi kèm (field multipart hoặc query string):
+    config     JSON dạng asdict(AppConfig), ví dụ {"edge": {"low_threshold": 40}}
+    sharpness  0..100 (mặc định 50)
+    format     png | jpg (mặc định png)
+    output     gray | bgr (mặc định gray)
+
+Ảnh hoặc tham số không hợp lệ -> 400; lỗi khi xử lý phía máy chủ -> 500.
+
+Ảnh được giải mã / xử lý / mã hoá trong process pool. Số request đang chờ bị
+giới hạn (vượt quá -> 503 + Retry-After) và có thể gom nhiều request nhỏ
+thành một lô gửi cho process con (micro-batching).
+
+Ví dụ:
+    python server.py --port 8080 -j 4 --max-pending 32 --batch-size 4
+    curl -F image=@examples/anh3.jpg -F sharpness=70 localhost:8080/sketch -o out.png
+"""
+import argparse
+import json
+import os
+import queue
+import sys
+import threading
+import time
+from concurrent.futures import Future
+from concurrent.futures import TimeoutError as FutureTimeout
+from dataclasses import dataclass, field
+from email.parser import BytesParser
+from email.policy import HTTP
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+from urllib.parse import parse_qs, urlparse
+
+import cv2
+import numpy as np
+
+from auto_params import auto_suggest_params
+from config import AppConfig, RuntimeConfig, config_from_dict
+from image_processing import OUTPUT_FORMATS, SketchWorkspace, process_image
+from runtime import add_runtime_arguments, process_pool, runtime_from_args
+from smoothing import SMOOTHING_BACKENDS
+
+ENCODINGS = {"png": ".png", "jpg": ".jpg", "jpeg": ".jpg"}
+CONTENT_TYPES = {".png": "image/png", ".jpg": "image/jpeg"}
+
+
+class ServiceBusy(Exception):
+    """Hàng đợi đã đầy, client nên thử lại sau."""
+
+
+class BadRequest(ValueError):
+    """Ảnh / tham số của client không hợp lệ (-> 400)."""
+
+
+class WorkerError(Exception):
+    """Lỗi phía máy chủ khi xử lý trong process con (-> 500)."""
+
+
+@dataclass
+class ServiceSettings:
+    host: str = "127.0.0.1"
+    port: int = 8080
+    workers: Optional[int] = None
+    # số request được nhận cùng lúc (đang chờ + đang xử lý); vượt quá -> 503
+    max_pending: int = 32
+    # gom tối đa max_batch request, chờ thêm tối đa batch_wait_ms để đủ lô
+    max_batch: int = 1
+    batch_wait_ms: float = 5.0
+    max_upload_mb: float = 32.0
+    timeout: float = 60.0
+    # thread OpenCV / BLAS và gán nhân cho process con (xem runtime.py)
+    runtime: RuntimeConfig = field(default_factory=RuntimeConfig)
+
+
+@dataclass
+class Job:
+    """Một request đã được phân tích, gửi sang process con (phải pickle được)."""
+    kind: str                      # "sketch" hoặc "auto"
+    data: bytes
+    config: AppConfig = field(default_factory=AppConfig)
+    sharpness: int = 50
+    ext: str = ".png"
+    output: str = "gray"
+
+
+# ---------- phần chạy trong process con ----------
+
+_worker_workspace = SketchWorkspace()
+
+
+def _run_job(job: Job) -> Any:
+    buf = np.frombuffer(job.data, dtype=np.uint8)
+    if job.kind == "auto":
+        gray = cv2.imdecode(buf, cv2.IMREAD_GRAYSCALE)
+        if gray is None:
+            raise BadRequest("Không đọc được ảnh")
+        return auto_suggest_params(gray)
+
+    image = cv2.imdecode(buf, cv2.IMREAD_COLOR)
+    if image is None:
+        raise BadRequest("Không đọc được ảnh")
+    result, _ = process_image(
+        image, mode="pencil", config=job.config, sharpness=job.sharpness,
+        workspace=_worker_workspace, output=job.output,
+    )
+    ok, encoded = cv2.imencode(job.ext, result)
+    if not ok:
+        raise WorkerError(f"Mã hoá {job.ext} thất bại")
+    return encoded.tobytes()
+
+
+def _run_batch(jobs: List[Job]) -> List[Tuple[Any, Optional[Exception]]]:
+    """
+    Xử lý một lô; lỗi của từng job được trả riêng, không làm hỏng cả lô.
+    Lỗi trả về là BadRequest (ảnh không đọc được) hoặc WorkerError (mọi lỗi
+    khác), đều pickle được.
+    """
+    results: List[Tuple[Any, Optional[Exception]]] = []
+    for job in jobs:
+        try:
+            results.append((_run_job(job), None))
+        except BadRequest as exc:
+            results.append((None, BadRequest(str(exc))))
+        except WorkerError as exc:
+            results.append((None, WorkerError(str(exc))))
+        except Exception as exc:
+            results.append((None, WorkerError(f"{type(exc).__name__}: {exc}")))
+    return results
+
+
+# ---------- điều phối ----------
+
+class SketchService:
+    """
+    Nhận Job từ các thread HTTP, gom lô và gửi sang process pool.
+    submit() trả về Future; ném ServiceBusy khi đã có max_pending job chưa xong.
+    """
+
+    def __init__(self, settings: ServiceSettings) -> None:
+        self.settings = settings
+        workers = max(1, settings.workers or os.cpu_count() or 1)
+        self._pool = process_pool(workers, settings.runtime)
+        self._slots = threading.BoundedSemaphore(max(1, settings.max_pending))
+        self._queue: "queue.Queue[Optional[Tuple[Job, Future]]]" = queue.Queue()
+        self._lock = threading.Lock()
+        self.pending = 0
+        self.completed = 0
+        self.rejected = 0
+        self.batches = 0
+        self._batcher: Optional[threading.Thread] = None
+        if settings.max_batch > 1:
+            self._batcher = threading.Thread(
+                target=self._batch_loop, name="sketch-batcher", daemon=True
+            )
+            self._batcher.start()
+
+    def submit(self, job: Job) -> Future:
+        if not self._slots.acquire(blocking=False):
+            with self._lock:
+                self.rejected += 1
+            raise ServiceBusy("Máy chủ đang bận")
+        with self._lock:
+            self.pending += 1
+        future: Future = Future()
+        future.add_done_callback(self._release)
+        if self._batcher is None:
+            self._dispatch([(job, future)])
+        else:
+            self._queue.put((job, future))
+        return future
+
+    def _release(self, _future: Future) -> None:
+        with self._lock:
+            self.pending -= 1
+            self.completed += 1
+        self._slots.release()
+
+    def _batch_loop(self) -> None:
+        wait = self.settings.batch_wait_ms / 1000.0
+        while True:
+            item = self._queue.get()
+            if item is None:
+                return
+            batch = [item]
+            deadline = time.monotonic() + wait
+            while len(batch) < self.settings.max_batch:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    item = self._queue.get(timeout=remaining)
+                except queue.Empty:
+                    break
+                if item is None:
+                    self._dispatch(batch)
+                    return
+                batch.append(item)
+            self._dispatch(batch)
+
+    def _dispatch(self, batch: List[Tuple[Job, Future]]) -> None:
+        with self._lock:
+            self.batches += 1
+        try:
+            pool_future = self._pool.submit(_run_batch, [job for job, _ in batch])
+        except Exception as exc:
+            for _, future in batch:
+                future.set_exception(exc)
+            return
+
+        def done(f: Future) -> None:
+            try:
+                results = f.result()
+            except Exception as exc:
+                for _, future in batch:
+                    future.set_exception(exc)
+                return
+            for (_, future), (value, error) in zip(batch, results):
+                if error is None:
+                    future.set_result(value)
+                else:
+                    future.set_exception(error)
+
+        pool_future.add_done_callback(done)
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                "pending": self.pending,
+                "completed": self.completed,
+                "rejected": self.rejected,
+                "batches": self.batches,
+                "max_pending": self.settings.max_pending,
+            }
+
+    def close(self) -> None:
+        if self._batcher is not None:
+            self._queue.put(None)
+            self._batcher.join()
+        self._pool.shutdown(wait=True)
+
+
+# ---------- HTTP ----------
+
+def _parse_multipart(content_type: str, body: bytes) -> Dict[str, bytes]:
+    """Tách các field của multipart/form-data thành {tên: nội dung}."""
+    header = f"Content-Type: {content_type}\r\n\r\n".encode("latin-1")
+    message = BytesParser(policy=HTTP).parsebytes(header + body)
+    if not message.is_multipart():
+        raise ValueError("multipart/form-data không hợp lệ")
+    parts: Dict[str, bytes] = {}
+    for part in message.iter_parts():
+        name = part.get_param("name", header="content-disposition")
+        if name:
+            parts[name] = part.get_payload(decode=True) or b""
+    return parts
+
+
+def parse_job(kind: str, content_type: str, body: bytes, query: str) -> Job:
+    """Tạo Job từ body (multipart hoặc ảnh thô) và query string; lỗi -> ValueError."""
+    fields: Dict[str, str] = {k: v[-1] for k, v in parse_qs(query).items()}
+    if content_type.startswith("multipart/form-data"):
+        parts = _parse_multipart(content_type, body)
+        data = parts.pop("image", b"")
+        fields.update({k: v.decode("utf-8") for k, v in parts.items()})
+    else:
+        data = body
+    if not data:
+        raise ValueError("Thiếu ảnh")
+
+    try:
+        config = config_from_dict(json.loads(fields["config"])) if "config" in fields else AppConfig()
+    except json.JSONDecodeError as exc:
+        raise ValueError(f"config không phải JSON hợp lệ: {exc}") from None
+    if config.smooth.backend not in SMOOTHING_BACKENDS:
+        raise ValueError(
+            f"smooth.backend không hỗ trợ (hỗ trợ: {', '.join(SMOOTHING_BACKENDS)})"
+        )
+    try:
+        sharpness = int(fields.get("sharpness", 50))
+    except ValueError:
+        raise ValueError("sharpness phải là số nguyên") from None
+    ext = ENCODINGS.get(fields.get("format", "png").lower())
+    if ext is None:
+        raise ValueError(f"format không hỗ trợ (hỗ trợ: {', '.join(ENCODINGS)})")
+    output = fields.get("output", "gray")
+    if output not in OUTPUT_FORMATS:
+        raise ValueError(f"output không hỗ trợ (hỗ trợ: {', '.join(OUTPUT_FORMATS)})")
+
+    return Job(kind=kind, data=data, config=config, sharpness=sharpness, ext=ext, output=output)
+
+
+class SketchRequestHandler(BaseHTTPRequestHandler):
+    server_version = "SketchLab/1.0"
+    routes = {"/sketch": "sketch", "/auto-params": "auto"}
+
+    @property
+    def service(self) -> SketchService:
+        return self.server.service   # type: ignore[attr-defined]
+
+    def do_GET(self) -> None:
+        if urlparse(self.path).path == "/health":
+            self._send_json(200, self.service.stats())
+        else:
+            self._send_json(404, {"error": "Không tìm thấy"})
+
+    def do_POST(self) -> None:
+        url = urlparse(self.path)
+        kind = self.routes.get(url.path)
+        if kind is None:
+            self._send_json(404, {"error": "Không tìm thấy"})
+            return
+
+        try:
+            length = int(self.headers.get("Content-Length") or 0)
+        except ValueError:
+            length = -1
+        if length < 0:
+            self.close_connection = True
+            self._send_json(400, {"error": "Content-Length không hợp lệ"})
+            return
+        if length > self.service.settings.max_upload_mb * 1024 * 1024:
+            self.close_connection = True
+            self._send_json(413, {"error": "Ảnh quá lớn"})
+            return
+        body = self.rfile.read(length)
+
+        try:
+            job = parse_job(kind, self.headers.get("Content-Type", ""), body, url.query)
+            future = self.service.submit(job)
+            value = future.result(timeout=self.service.settings.timeout)
+        except ServiceBusy as exc:
+            self._send_json(503, {"error": str(exc)}, {"Retry-After": "1"})
+            return
+        except FutureTimeout:
+            self._send_json(504, {"error": "Xử lý quá thời gian"})
+            return
+        except ValueError as exc:
+            self._send_json(400, {"error": str(exc)})
+            return
+        except WorkerError as exc:
+            self._send_json(500, {"error": str(exc)})
+            return
+        except Exception as exc:
+            self._send_json(500, {"error": f"{type(exc).__name__}: {exc}"})
+            return
+
+        if kind == "auto":
+            self._send_json(200, value)
+        else:
+            self._send(200, CONTENT_TYPES[job.ext], value)
+
+    def _send(self, status: int, content_type: str, payload: bytes,
+              headers: Optional[Dict[str, str]] = None) -> None:
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(payload)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def _send_json(self, status: int, data: Any, headers: Optional[Dict[str, str]] = None) -> None:
+        payload = json.dumps(data, ensure_ascii=False).encode("utf-8")
+        self._send(status, "application/json; charset=utf-8", payload, headers)
+
+
+def make_server(settings: ServiceSettings) -> ThreadingHTTPServer:
+    """Tạo HTTP server (chưa chạy); gọi server.service.close() sau khi dừng."""
+    server = ThreadingHTTPServer((settings.host, settings.port), SketchRequestHandler)
+    server.daemon_threads = True
+    server.service = SketchService(settings)   # type: ignore[attr-defined]
+    return server
+
+
+# ---------- CLI ----------
+
+def build_parser() -> argparse.ArgumentParser:
+    defaults = ServiceSettings()
+    parser = argparse.ArgumentParser(description="Dịch vụ HTTP chuyển ảnh thành tranh vẽ chì.")
+    parser.add_argument("--host", default=defaults.host)
+    parser.add_argument("--port", type=int, default=defaults.port)
+    parser.add_argument("-j", "--workers", type=int, default=None,
+                        help="Số process xử lý (mặc định: số nhân CPU)")
+    parser.add_argument("--max-pending", type=int, default=defaults.max_pending,
+                        help="Số request tối đa đang chờ / đang xử lý (vượt quá -> 503)")
+    parser.add_argument("--batch-size", type=int, default=defaults.max_batch,
+                        help="Gom tối đa N request cho mỗi lần gửi sang process con")
+    parser.add_argument("--batch-wait-ms", type=float, default=defaults.batch_wait_ms,
+                        help="Thời gian chờ thêm request để đủ lô")
+    parser.add_argument("--max-upload-mb", type=float, default=defaults.max_upload_mb)
+    parser.add_argument("--timeout", type=float, default=defaults.timeout,
+                        help="Thời gian tối đa cho một request (giây)")
+    add_runtime_arguments(parser)
+    return parser
+
+
+def main(argv: Optional[Sequence[str]] = None) -> int:
+    args = build_parser().parse_args(argv)
+    settings = ServiceSettings(
+        host=args.host,
+        port=args.port,
+        workers=args.workers,
+        max_pending=args.max_pending,
+        max_batch=max(1, args.batch_size),
+        batch_wait_ms=args.batch_wait_ms,
+        max_upload_mb=args.max_upload_mb,
+        timeout=args.timeout,
+        runtime=runtime_from_args(args),
+    )
+    server = make_server(settings)
+    print(f"Đang chạy tại http://{settings.host}:{server.server_address[1]}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        server.service.close()   # type: ignore[attr-defined]
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
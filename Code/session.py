@@ -0,0 +1,171 @@
+"""
+Phiên xem cả thư mục ảnh cho GUI.
+
+Một thread nền giải mã và render trước ±radius ảnh quanh ảnh đang xem với cấu
+hình hiện tại, rồi tạo thumbnail cho filmstrip (ảnh gần trước). Ảnh đã giải
+mã nằm trong LRU giới hạn theo dung lượng, kết quả nằm trong ResultCache dùng
+chung với RenderScheduler -> chuyển sang ảnh kế bên không phải chờ render.
+Trong lúc render trước, số thread OpenCV được chia đôi (split_cv_threads) vì
+thread nền chạy song song với RenderScheduler của GUI.
+Kế hoạch chạy nền theo kiểu latest-wins: đổi ảnh / đổi tham số thì bỏ các
+việc chưa làm của kế hoạch cũ.
+"""
+import os
+import threading
+from typing import List, Optional, Set, Tuple
+
+import numpy as np
+from PyQt5.QtCore import QObject, pyqtSignal
+
+from config import AppConfig
+from image_processing import SketchWorkspace, make_proxy, process_image
+from io_utils import list_images_in_folder, load_image
+from result_cache import MB, MemoryLRU, ResultCache
+from runtime import split_cv_threads
+
+# (loại việc: "render" / "thumb", chỉ số ảnh)
+Task = Tuple[str, int]
+
+
+class FolderSession(QObject):
+    """
+    Danh sách ảnh của một thư mục cùng bộ giải mã / render trước chạy nền.
+    Tín hiệu được phát từ thread nền (queued connection về thread GUI).
+    """
+
+    thumbnail_ready = pyqtSignal(int, object)   # chỉ số ảnh, thumbnail (ndarray)
+    prerendered = pyqtSignal(int)               # chỉ số ảnh đã có kết quả trong cache
+
+    def __init__(
+        self,
+        paths: List[str],
+        cache: ResultCache,
+        radius: int = 2,
+        memory_mb: float = 512.0,
+        thumb_size: int = 96,
+        parent: Optional[QObject] = None,
+    ) -> None:
+        super().__init__(parent)
+        self.paths = list(paths)
+        self.cache = cache
+        self.radius = max(0, int(radius))
+        self.thumb_size = int(thumb_size)
+        self.index = 0
+        # ảnh đã giải mã, khoá = đường dẫn
+        self._images = MemoryLRU(int(memory_mb * MB))
+        self._thumbs: Set[int] = set()
+        self._workspace = SketchWorkspace()
+
+        self._cond = threading.Condition()
+        self._plan: List[Task] = []
+        self._params: Tuple[AppConfig, int, str] = (AppConfig(), 50, "pencil")
+        self._generation = 0
+        self._stopped = False
+        self._thread = threading.Thread(
+            target=self._run, name="session-prefetch", daemon=True
+        )
+        self._thread.start()
+
+    @classmethod
+    def from_folder(cls, folder: str, cache: ResultCache, **kwargs) -> "FolderSession":
+        return cls(list_images_in_folder(folder), cache, **kwargs)
+
+    def __len__(self) -> int:
+        return len(self.paths)
+
+    def name(self, index: int) -> str:
+        return os.path.basename(self.paths[index])
+
+    def image(self, index: int) -> Optional[np.ndarray]:
+        """Ảnh đã giải mã nếu đang có trong LRU, không thì None."""
+        return self._images.get(self.paths[index])
+
+    def load(self, index: int) -> np.ndarray:
+        """Ảnh thứ `index` (giải mã nếu chưa có). Lỗi đọc -> FileNotFoundError / ValueError."""
+        path = self.paths[index]
+        image = self._images.get(path)
+        if image is None:
+            image = load_image(path)
+            # ảnh dùng chung giữa các thread và là khoá của ResultCache -> không sửa tại chỗ
+            image.flags.writeable = False
+            self._images.put(path, image)
+        return image
+
+    def set_current(self, index: int, config: AppConfig, sharpness: int, mode: str = "pencil") -> None:
+        """
+        Đặt ảnh đang xem và cấu hình hiện tại; lập lại kế hoạch chạy nền:
+        render trước ảnh lân cận (gần trước, ảnh sau trước ảnh trước), rồi thumbnail.
+        Ảnh đang xem do RenderScheduler của GUI render.
+        """
+        n = len(self.paths)
+        neighbours: List[int] = []
+        for d in range(1, self.radius + 1):
+            neighbours += [i for i in (index + d, index - d) if 0 <= i < n]
+        by_distance = sorted(range(n), key=lambda i: abs(i - index))
+        with self._cond:
+            self.index = index
+            self._generation += 1
+            self._params = (config, sharpness, mode)
+            self._plan = [("render", i) for i in neighbours]
+            self._plan += [("thumb", i) for i in by_distance if i not in self._thumbs]
+            self._cond.notify()
+
+    def shutdown(self, timeout: float = 2.0) -> None:
+        with self._cond:
+            self._stopped = True
+            self._plan = []
+            self._cond.notify()
+        self._thread.join(timeout)
+
+    # ---------- thread nền ----------
+
+    def _run(self) -> None:
+        while True:
+            with self._cond:
+                while not self._plan and not self._stopped:
+                    self._cond.wait()
+                if self._stopped:
+                    return
+                kind, index = self._plan.pop(0)
+                generation = self._generation
+                config, sharpness, mode = self._params
+            try:
+                if kind == "render":
+                    self._prerender(index, generation, config, sharpness, mode)
+                elif index not in self._thumbs:
+                    self._make_thumbnail(index)
+            except Exception:
+                # ảnh lỗi được báo khi người dùng mở tới nó
+                continue
+
+    def _prerender(self, index: int, generation: int, config: AppConfig, sharpness: int, mode: str) -> None:
+        image = self.load(index)
+        if index not in self._thumbs:
+            self._emit_thumbnail(index, image)
+        if generation != self._generation:
+            return   # người dùng đã chuyển ảnh / đổi tham số trong lúc giải mã
+        # chạy song song với RenderScheduler -> không giành hết nhân của nó
+        with split_cv_threads(2):
+            process_image(
+                image,
+                mode=mode,
+                config=config,
+                sharpness=sharpness,
+                cache=self.cache,
+                workspace=self._workspace,
+                output="gray",
+            )
+        self.prerendered.emit(index)
+
+    def _make_thumbnail(self, index: int) -> None:
+        image = self.image(index)
+        if image is None:
+            # giải mã thu nhỏ (1/2 .. 1/8), không giữ lại ảnh gốc
+            size = (self.thumb_size, self.thumb_size)
+            image = load_image(self.paths[index], target_size=size)
+        self._emit_thumbnail(index, image)
+
+    def _emit_thumbnail(self, index: int, image: np.ndarray) -> None:
+        thumb, _ = make_proxy(image, self.thumb_size, self.thumb_size)
+        self._thumbs.add(index)
+        self.thumbnail_ready.emit(index, np.ascontiguousarray(thumb))
@@ -0,0 +1,214 @@
+"""
+Các backend làm mịn giữ biên dùng cho apply_bilateral.
+
+  - "exact":  cv2.bilateralFilter (chậm dần theo diameter)
+  - "grid":   bilateral grid tuyến tính từng khúc — thời gian không phụ thuộc diameter
+  - "guided": guided filter tự dẫn hướng (He et al. 2010) — chỉ dùng box filter, O(1)/pixel
+
+Chạy trực tiếp để so sánh tốc độ và PSNR của từng backend so với "exact":
+    python smoothing.py examples/anh3.jpg --diameter 15 --iterations 3
+"""
+import argparse
+import sys
+import time
+from typing import Callable, Dict, List, Optional, Sequence
+
+import cv2
+import numpy as np
+
+from config import BilateralConfig
+
+
+def normalized_diameter(cfg: BilateralConfig) -> int:
+    d = max(1, cfg.diameter)
+    if d % 2 == 0:
+        d += 1
+    return d
+
+
+def effective_sigma_space(cfg: BilateralConfig) -> float:
+    """
+    Với diameter > 0, cv2.bilateralFilter chỉ nhìn trong bán kính d/2 nên
+    sigma_space lớn hơn thế không còn tác dụng; các backend xấp xỉ dùng giá trị này.
+    """
+    return max(1.0, min(float(cfg.sigma_space), normalized_diameter(cfg) / 2.0))
+
+
+def _to_uint8(values: np.ndarray, dst: Optional[np.ndarray]) -> np.ndarray:
+    """Làm tròn, chặn về [0, 255] và ghi vào dst (nếu có)."""
+    np.rint(values, out=values)
+    np.clip(values, 0, 255, out=values)
+    if dst is None:
+        return values.astype(np.uint8)
+    dst[...] = values
+    return dst
+
+
+def _exact(gray: np.ndarray, cfg: BilateralConfig, dst: Optional[np.ndarray] = None) -> np.ndarray:
+    d = normalized_diameter(cfg)
+    return cv2.bilateralFilter(gray, d, cfg.sigma_color, cfg.sigma_space, dst=dst)
+
+
+def _grid(gray: np.ndarray, cfg: BilateralConfig, dst: Optional[np.ndarray] = None) -> np.ndarray:
+    """
+    Bilateral grid dạng tuyến tính từng khúc (Durand & Dorsey 2002): chia trục
+    cường độ thành các mức cách nhau sigma_color, với mỗi mức lọc Gaussian
+    (trên ảnh đã thu nhỏ theo sigma_space) rồi nội suy tuyến tính giữa hai mức
+    gần nhất. Số mức chỉ phụ thuộc sigma_color, không phụ thuộc diameter.
+    """
+    h, w = gray.shape
+    ss = effective_sigma_space(cfg)
+    sr = max(1.0, float(cfg.sigma_color))
+
+    levels = max(2, int(np.ceil(255.0 / sr)) + 1)
+    step = 255.0 / (levels - 1)
+    small = (max(1, int(round(w / ss))), max(1, int(round(h / ss))))
+
+    src = gray.astype(np.float32)
+    out = np.zeros_like(src)
+    tmp = np.empty_like(src)
+    weight = np.empty_like(src)
+    for i in range(levels):
+        level = i * step
+        # trọng số miền cường độ
+        cv2.subtract(src, level, dst=tmp)
+        cv2.multiply(tmp, tmp, dst=weight, scale=-0.5 / (sr * sr))
+        cv2.exp(weight, dst=weight)
+        cv2.multiply(weight, src, dst=tmp)
+
+        # lọc không gian trên lưới thu nhỏ (1 ô lưới = sigma_space pixel)
+        num = cv2.GaussianBlur(cv2.resize(tmp, small, interpolation=cv2.INTER_AREA), (0, 0), 1.0)
+        den = cv2.GaussianBlur(cv2.resize(weight, small, interpolation=cv2.INTER_AREA), (0, 0), 1.0)
+        level_img = cv2.resize(num / np.maximum(den, 1e-6), (w, h), interpolation=cv2.INTER_LINEAR)
+
+        # nội suy tuyến tính theo cường độ: trọng số hình tam giác quanh mức này
+        cv2.absdiff(src, level, dst=tmp)
+        cv2.subtract(1.0, tmp * (1.0 / step), dst=tmp)
+        cv2.max(tmp, 0.0, dst=tmp)
+        out += level_img * tmp
+
+    return _to_uint8(out, dst)
+
+
+def _guided(gray: np.ndarray, cfg: BilateralConfig, dst: Optional[np.ndarray] = None) -> np.ndarray:
+    r = normalized_diameter(cfg) // 2
+    if r < 1:
+        if dst is None:
+            return gray.copy()
+        np.copyto(dst, gray)
+        return dst
+    ksize = (2 * r + 1, 2 * r + 1)
+    eps = (float(cfg.sigma_color) / 255.0) ** 2
+
+    src = gray.astype(np.float32) * (1.0 / 255.0)
+    mean = cv2.boxFilter(src, -1, ksize)
+    var = cv2.boxFilter(src * src, -1, ksize) - mean * mean
+    a = var / (var + eps)
+    b = mean - a * mean
+    a = cv2.boxFilter(a, -1, ksize)
+    b = cv2.boxFilter(b, -1, ksize)
+    out = a * src + b
+    out *= 255.0
+    return _to_uint8(out, dst)
+
+
+SMOOTHING_BACKENDS: Dict[str, Callable[..., np.ndarray]] = {
+    "exact": _exact,
+    "grid": _grid,
+    "guided": _guided,
+}
+
+
+def backend_radius(cfg: BilateralConfig) -> int:
+    """Bán kính ảnh hưởng (pixel) của một lần lọc với backend đã chọn."""
+    backend = cfg.backend
+    if backend == "guided":
+        # hai lượt box filter nối tiếp
+        return 2 * (normalized_diameter(cfg) // 2)
+    if backend == "grid":
+        # Gaussian sigma 1 ô lưới (cắt ở 3 sigma) + nội suy: khoảng 5 ô lưới
+        return int(np.ceil(5 * effective_sigma_space(cfg)))
+    return normalized_diameter(cfg) // 2
+
+
+def smooth(gray: np.ndarray, cfg: BilateralConfig, dst: Optional[np.ndarray] = None) -> np.ndarray:
+    """
+    Một lần làm mịn giữ biên theo `cfg.backend`.
+    dst: buffer kết quả cấp phát sẵn (khác `gray`); backend "exact" ghi thẳng vào đó.
+    """
+    try:
+        fn = SMOOTHING_BACKENDS[cfg.backend]
+    except KeyError:
+        raise ValueError(
+            f"Backend làm mịn không hợp lệ: {cfg.backend!r} "
+            f"(hỗ trợ: {', '.join(SMOOTHING_BACKENDS)})"
+        ) from None
+    return fn(gray, cfg, dst)
+
+
+# ---------- so sánh độ chính xác / tốc độ ----------
+
+def compare_backends(
+    gray: np.ndarray,
+    cfg: BilateralConfig,
+    repeats: int = 3,
+    backends: Optional[Sequence[str]] = None,
+) -> List[dict]:
+    """
+    Đo thời gian (ms, trung vị) và PSNR (dB) so với backend "exact"
+    cho cùng một cấu hình.
+    """
+    names = list(backends or SMOOTHING_BACKENDS)
+    outputs: Dict[str, np.ndarray] = {}
+    rows: List[dict] = []
+    for name in ["exact"] + [n for n in names if n != "exact"]:
+        backend_cfg = BilateralConfig(
+            diameter=cfg.diameter,
+            sigma_color=cfg.sigma_color,
+            sigma_space=cfg.sigma_space,
+            iterations=cfg.iterations,
+            backend=name,
+        )
+        times = []
+        for _ in range(max(1, repeats)):
+            start = time.perf_counter()
+            result = gray
+            for _ in range(max(1, backend_cfg.iterations)):
+                result = smooth(result, backend_cfg)
+            outputs[name] = result
+            times.append((time.perf_counter() - start) * 1000.0)
+        times.sort()
+        psnr = float("inf") if name == "exact" else cv2.PSNR(outputs["exact"], outputs[name])
+        rows.append({"backend": name, "ms": times[len(times) // 2], "psnr": psnr})
+    return rows
+
+
+def main(argv: Optional[Sequence[str]] = None) -> int:
+    defaults = BilateralConfig()
+    parser = argparse.ArgumentParser(description="So sánh các backend làm mịn giữ biên.")
+    parser.add_argument("images", nargs="+", help="Ảnh đầu vào")
+    parser.add_argument("--diameter", type=int, nargs="+", default=[defaults.diameter])
+    parser.add_argument("--sigma-color", type=float, default=defaults.sigma_color)
+    parser.add_argument("--sigma-space", type=float, default=defaults.sigma_space)
+    parser.add_argument("--iterations", type=int, default=defaults.iterations)
+    parser.add_argument("--repeats", type=int, default=3)
+    args = parser.parse_args(argv)
+
+    print(f"{'ảnh':<24} {'d':>3} {'backend':<8} {'ms':>9} {'PSNR (dB)':>10}")
+    for path in args.images:
+        image = cv2.imread(path, cv2.IMREAD_GRAYSCALE)
+        if image is None:
+            print(f"Không đọc được ảnh từ: {path}", file=sys.stderr)
+            continue
+        for d in args.diameter:
+            cfg = BilateralConfig(d, args.sigma_color, args.sigma_space, args.iterations)
+            for row in compare_backends(image, cfg, repeats=args.repeats):
+                print(
+                    f"{path[-24:]:<24} {d:>3} {row['backend']:<8}"
+                    f" {row['ms']:>9.1f} {row['psnr']:>10.2f}"
+                )
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,350 @@
+"""
+Quét tham số: render một ảnh với nhiều tổ hợp cấu hình và ghép thành contact sheet.
+
+Các tổ hợp được dựng thành một đồ thị phụ thuộc (DAG) giữa các tầng:
+    gray -> smooth(BilateralConfig) -> dodge(+blur_ksize) -> strong(+edges)
+    gray -> edges(EdgeConfig) -----------------------------^
+Mỗi nút chỉ được tính một lần dù có bao nhiêu tổ hợp dùng chung nó (ví dụ
+một kết quả bilateral dùng cho mọi blur_ksize và mọi ngưỡng Canny). Nút
+được chạy song song ngay khi đủ đầu vào, kết quả trung gian được giải phóng
+khi không còn nút nào cần.
+
+Ví dụ:
+    python sweep.py examples/anh3.jpg sheet.png --diameter 5 9 15 \\
+        --blur-ksize 11 21 31 --canny 30:100 50:150 --sharpness 30 80
+"""
+import argparse
+import itertools
+import os
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field, fields
+from typing import Callable, Dict, Hashable, List, Optional, Sequence, Tuple
+
+import cv2
+import numpy as np
+
+from config import AppConfig, BilateralConfig, EdgeConfig, SketchConfig
+from image_processing import (
+    _bilateral_key,
+    _edge_key,
+    _ensure_odd,
+    apply_bilateral,
+    detect_edges,
+    dodge_blend,
+    sharpen_with_edges,
+)
+from runtime import split_cv_threads
+from smoothing import SMOOTHING_BACKENDS
+
+
+@dataclass
+class SweepGrid:
+    """Các giá trị cần quét; mọi tổ hợp (tích Descartes) đều được render."""
+    edge: List[EdgeConfig] = field(default_factory=lambda: [EdgeConfig()])
+    smooth: List[BilateralConfig] = field(default_factory=lambda: [BilateralConfig()])
+    sketch: List[SketchConfig] = field(default_factory=lambda: [SketchConfig()])
+    sharpness: List[int] = field(default_factory=lambda: [50])
+
+    def combinations(self) -> List[Tuple[AppConfig, int]]:
+        return [
+            (AppConfig(edge=e, smooth=s, sketch=k), sharpness)
+            for s, k, e, sharpness in itertools.product(
+                self.smooth, self.sketch, self.edge, self.sharpness
+            )
+        ]
+
+
+@dataclass
+class SweepResult:
+    config: AppConfig
+    sharpness: int
+    image: np.ndarray   # ảnh sketch 1 kênh
+
+
+@dataclass
+class _Node:
+    fn: Callable[..., np.ndarray]
+    deps: Tuple[Hashable, ...]
+
+
+class StageGraph:
+    """DAG các tầng pipeline; nút trùng khoá chỉ được thêm (và tính) một lần."""
+
+    def __init__(self, image_bgr: np.ndarray) -> None:
+        self.nodes: Dict[Hashable, _Node] = {}
+        self.gray = self._add(("gray",), lambda: cv2.cvtColor(image_bgr, cv2.COLOR_BGR2GRAY), ())
+
+    def _add(self, key: Hashable, fn: Callable[..., np.ndarray], deps: Tuple) -> Hashable:
+        if key not in self.nodes:
+            self.nodes[key] = _Node(fn, deps)
+        return key
+
+    def add_variant(self, config: AppConfig, sharpness: int) -> Hashable:
+        """Thêm các tầng cho một tổ hợp, trả về khoá của nút kết quả."""
+        bkey = _bilateral_key(config.smooth)
+        k = _ensure_odd(config.sketch.blur_ksize)
+        smooth_cfg, edge_cfg = config.smooth, config.edge
+
+        smooth = self._add(
+            ("smooth", bkey), lambda gray: apply_bilateral(gray, smooth_cfg), (self.gray,)
+        )
+        dodge = self._add(
+            ("dodge", bkey, k), lambda gray, s: dodge_blend(gray, s, k), (self.gray, smooth)
+        )
+        if sharpness is not None and sharpness < 50:
+            return dodge
+        ekey = _edge_key(edge_cfg)
+        edges = self._add(("edges", ekey), lambda gray: detect_edges(gray, edge_cfg), (self.gray,))
+        return self._add(("strong", bkey, k, ekey), sharpen_with_edges, (dodge, edges))
+
+    def stage_counts(self) -> Dict[str, int]:
+        counts: Dict[str, int] = {}
+        for key in self.nodes:
+            counts[key[0]] = counts.get(key[0], 0) + 1
+        return counts
+
+    def run(self, outputs: Sequence[Hashable], workers: Optional[int] = None) -> Dict[Hashable, np.ndarray]:
+        """
+        Tính các nút cần cho `outputs` trên thread pool (OpenCV nhả GIL).
+        Trả về {khoá: kết quả} chỉ cho các nút trong `outputs`.
+        """
+        wanted = set(outputs)
+        # chỉ giữ các nút mà outputs cần tới
+        needed: set = set()
+        stack = list(wanted)
+        while stack:
+            key = stack.pop()
+            if key not in needed:
+                needed.add(key)
+                stack.extend(self.nodes[key].deps)
+
+        dependents: Dict[Hashable, List[Hashable]] = {key: [] for key in needed}
+        waiting: Dict[Hashable, int] = {}
+        for key in needed:
+            deps = self.nodes[key].deps
+            waiting[key] = len(deps)
+            for dep in deps:
+                dependents[dep].append(key)
+        # số lần kết quả còn được dùng; về 0 thì giải phóng
+        refs = {key: len(dependents[key]) + (1 if key in wanted else 0) for key in needed}
+
+        values: Dict[Hashable, np.ndarray] = {}
+        lock = threading.Lock()
+        done = threading.Event()
+        errors: List[BaseException] = []
+        remaining = [len(needed)]
+
+        workers = max(1, workers or os.cpu_count() or 1)
+        with split_cv_threads(workers), ThreadPoolExecutor(max_workers=workers) as pool:
+
+            def run_node(key: Hashable) -> None:
+                try:
+                    node = self.nodes[key]
+                    with lock:
+                        args = [values[dep] for dep in node.deps]
+                    value = node.fn(*args)
+                except BaseException as exc:
+                    errors.append(exc)
+                    done.set()
+                    return
+                ready = []
+                with lock:
+                    values[key] = value
+                    for dep in node.deps:
+                        refs[dep] -= 1
+                        if refs[dep] == 0:
+                            del values[dep]
+                    for user in dependents[key]:
+                        waiting[user] -= 1
+                        if waiting[user] == 0:
+                            ready.append(user)
+                    remaining[0] -= 1
+                    if remaining[0] == 0:
+                        done.set()
+                for user in ready:
+                    pool.submit(run_node, user)
+
+            for key in needed:
+                if waiting[key] == 0:
+                    pool.submit(run_node, key)
+            done.wait()
+
+        if errors:
+            raise errors[0]
+        return {key: values[key] for key in wanted}
+
+
+def run_sweep(
+    image_bgr: np.ndarray,
+    grid: SweepGrid,
+    workers: Optional[int] = None,
+) -> Tuple[List[SweepResult], Dict[str, int]]:
+    """
+    Render mọi tổ hợp trong `grid`.
+    Trả về (kết quả theo thứ tự grid.combinations(), số lần tính mỗi tầng).
+    """
+    graph = StageGraph(image_bgr)
+    combos = grid.combinations()
+    keys = [graph.add_variant(config, sharpness) for config, sharpness in combos]
+    values = graph.run(keys, workers=workers)
+    results = [
+        SweepResult(config, sharpness, values[key])
+        for (config, sharpness), key in zip(combos, keys)
+    ]
+    return results, graph.stage_counts()
+
+
+# ---------- contact sheet ----------
+
+def _varying_fields(results: Sequence[SweepResult]) -> List[Tuple[str, str]]:
+    """Các trường (nhóm, tên) có giá trị khác nhau giữa các tổ hợp."""
+    varying = []
+    for group in ("edge", "smooth", "sketch"):
+        for f in fields(getattr(AppConfig(), group)):
+            values = {getattr(getattr(r.config, group), f.name) for r in results}
+            if len(values) > 1:
+                varying.append((group, f.name))
+    return varying
+
+
+# tên ngắn cho nhãn trên contact sheet
+_SHORT_NAMES = {
+    "low_threshold": "low", "high_threshold": "high", "diameter": "d",
+    "sigma_color": "sc", "sigma_space": "ss", "iterations": "it",
+    "backend": "bk", "blur_ksize": "k",
+}
+_FONT = cv2.FONT_HERSHEY_SIMPLEX
+_FONT_SCALE = 0.4
+_LINE_H = 14
+
+
+def _label_lines(
+    result: SweepResult,
+    varying: Sequence[Tuple[str, str]],
+    with_sharpness: bool,
+    width: int,
+) -> List[str]:
+    """Nhãn các tham số thay đổi, ngắt dòng cho vừa bề rộng ô."""
+    parts = [
+        f"{_SHORT_NAMES.get(name, name)}={getattr(getattr(result.config, group), name)}"
+        for group, name in varying
+    ]
+    if with_sharpness:
+        parts.append(f"sharp={result.sharpness}")
+    lines: List[str] = []
+    for part in parts or ["default"]:
+        candidate = f"{lines[-1]} {part}" if lines else part
+        if lines and cv2.getTextSize(candidate, _FONT, _FONT_SCALE, 1)[0][0] <= width - 4:
+            lines[-1] = candidate
+        else:
+            lines.append(part)
+    return lines
+
+
+def contact_sheet(
+    results: Sequence[SweepResult],
+    columns: Optional[int] = None,
+    thumb_width: int = 320,
+    labels: bool = True,
+) -> np.ndarray:
+    """Ghép các kết quả thành lưới (ảnh xám), mỗi ô có nhãn các tham số thay đổi."""
+    if not results:
+        raise ValueError("Không có kết quả để ghép")
+    columns = columns or int(np.ceil(np.sqrt(len(results))))
+    rows = int(np.ceil(len(results) / columns))
+
+    varying = _varying_fields(results)
+    with_sharpness = len({r.sharpness for r in results}) > 1
+    texts = [
+        _label_lines(r, varying, with_sharpness, thumb_width) if labels else []
+        for r in results
+    ]
+
+    h, w = results[0].image.shape[:2]
+    thumb_h = max(1, round(h * thumb_width / w))
+    label_h = max(len(t) for t in texts) * _LINE_H + 4 if labels else 0
+    gap = 4
+    sheet = np.full(
+        (rows * (thumb_h + label_h + gap) + gap, columns * (thumb_width + gap) + gap),
+        255, dtype=np.uint8,
+    )
+
+    for i, (result, lines) in enumerate(zip(results, texts)):
+        r, c = divmod(i, columns)
+        y = gap + r * (thumb_h + label_h + gap)
+        x = gap + c * (thumb_width + gap)
+        sheet[y:y + thumb_h, x:x + thumb_width] = cv2.resize(
+            result.image, (thumb_width, thumb_h), interpolation=cv2.INTER_AREA
+        )
+        # vẽ trong vùng nhãn của ô để chữ dài không tràn sang ô bên cạnh
+        cell = sheet[y + thumb_h:y + thumb_h + label_h, x:x + thumb_width]
+        for j, line in enumerate(lines):
+            cv2.putText(cell, line, (2, 12 + j * _LINE_H), _FONT, _FONT_SCALE, 0, 1, cv2.LINE_AA)
+    return sheet
+
+
+# ---------- CLI ----------
+
+def _parse_canny(text: str) -> EdgeConfig:
+    try:
+        low, high = (int(v) for v in text.split(":"))
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"Ngưỡng Canny phải có dạng low:high, nhận được {text!r}")
+    return EdgeConfig(low_threshold=low, high_threshold=high)
+
+
+def build_parser() -> argparse.ArgumentParser:
+    defaults = AppConfig()
+    parser = argparse.ArgumentParser(description="Quét tham số và ghép contact sheet.")
+    parser.add_argument("image", help="Ảnh đầu vào")
+    parser.add_argument("output", help="File contact sheet")
+    parser.add_argument("--canny", type=_parse_canny, nargs="+",
+                        default=[defaults.edge], help="Các cặp ngưỡng low:high")
+    parser.add_argument("--diameter", type=int, nargs="+", default=[defaults.smooth.diameter])
+    parser.add_argument("--sigma-color", type=float, nargs="+", default=[defaults.smooth.sigma_color])
+    parser.add_argument("--sigma-space", type=float, nargs="+", default=[defaults.smooth.sigma_space])
+    parser.add_argument("--iterations", type=int, nargs="+", default=[defaults.smooth.iterations])
+    parser.add_argument("--smooth-backend", choices=sorted(SMOOTHING_BACKENDS),
+                        default=defaults.smooth.backend)
+    parser.add_argument("--blur-ksize", type=int, nargs="+", default=[defaults.sketch.blur_ksize])
+    parser.add_argument("--sharpness", type=int, nargs="+", default=[50])
+    parser.add_argument("-j", "--workers", type=int, default=None)
+    parser.add_argument("--columns", type=int, default=None)
+    parser.add_argument("--thumb-width", type=int, default=320)
+    return parser
+
+
+def main(argv: Optional[Sequence[str]] = None) -> int:
+    args = build_parser().parse_args(argv)
+    image = cv2.imread(args.image, cv2.IMREAD_COLOR)
+    if image is None:
+        print(f"Không đọc được ảnh từ: {args.image}", file=sys.stderr)
+        return 2
+
+    grid = SweepGrid(
+        edge=args.canny,
+        smooth=[
+            BilateralConfig(d, sc, ss, it, args.smooth_backend)
+            for d, sc, ss, it in itertools.product(
+                args.diameter, args.sigma_color, args.sigma_space, args.iterations
+            )
+        ],
+        sketch=[SketchConfig(blur_ksize=k) for k in args.blur_ksize],
+        sharpness=args.sharpness,
+    )
+    results, counts = run_sweep(image, grid, workers=args.workers)
+    sheet = contact_sheet(results, columns=args.columns, thumb_width=args.thumb_width)
+    if not cv2.imwrite(args.output, sheet):
+        print(f"Lưu ảnh thất bại: {args.output}", file=sys.stderr)
+        return 2
+
+    stages = ", ".join(f"{name}={n}" for name, n in counts.items())
+    print(f"{len(results)} tổ hợp, số lần tính mỗi tầng: {stages}")
+    print(f"Đã ghi contact sheet: {args.output}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,64 @@
+"""
+Thống kê lấy mẫu của auto_params: sai số nằm trong cận của sampled_statistics,
+tham số gợi ý ở sample_fraction mặc định giống hệt khi tính trên cả ảnh.
+
+    python -m pytest -q test_auto_params.py
+"""
+import glob
+import os
+
+import cv2
+import numpy as np
+import pytest
+
+from analysis import ImageAnalysis
+from auto_params import auto_suggest_params, image_statistics, sampled_statistics
+
+EXAMPLES = sorted(glob.glob(os.path.join(os.path.dirname(__file__), "examples", "*")))
+
+
+def _gray(path: str, width: int = 0) -> np.ndarray:
+    """Ảnh xám, phóng tới chiều rộng `width` (0: giữ nguyên) để có đủ dải lấy mẫu."""
+    image = cv2.imread(path, cv2.IMREAD_GRAYSCALE)
+    assert image is not None, path
+    if width:
+        scale = width / float(image.shape[1])
+        image = cv2.resize(image, None, fx=scale, fy=scale, interpolation=cv2.INTER_CUBIC)
+    return image
+
+
+@pytest.mark.parametrize("path", EXAMPLES, ids=os.path.basename)
+def test_sampled_within_bound(path):
+    gray = _gray(path, 4000)
+    full, errors = sampled_statistics(gray)
+    assert all(value == 0.0 for value in errors.values())
+    sampled = 0
+    for fraction in (0.05, 0.1, 0.2):
+        stats, errors = sampled_statistics(gray, fraction)
+        if all(value == 0.0 for value in errors.values()):
+            assert stats == full, fraction   # quá ít dải -> tính trên cả ảnh
+            continue
+        sampled += 1
+        for name, value in stats.items():
+            assert abs(value - full[name]) <= errors[name], (name, fraction, value, full[name])
+    assert sampled > 0
+
+
+@pytest.mark.parametrize("path", EXAMPLES, ids=os.path.basename)
+def test_default_fraction_matches_full_image(path):
+    gray = _gray(path)
+    expected = auto_suggest_params(gray, 1.0)
+    assert auto_suggest_params(gray) == expected
+    assert auto_suggest_params(ImageAnalysis(gray=gray)) == expected
+
+
+def test_small_image_falls_back_to_full():
+    gray = _gray(EXAMPLES[0])
+    stats, errors = sampled_statistics(gray, 0.05)
+    assert stats == image_statistics(gray)
+    assert all(value == 0.0 for value in errors.values())
+
+
+def test_statistics_are_python_floats():
+    stats = image_statistics(_gray(EXAMPLES[0], 4000), 0.1)
+    assert all(type(value) is float for value in stats.values())
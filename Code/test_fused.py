@@ -0,0 +1,89 @@
+"""
+Đối chiếu bit-exact kernel gộp (fused.py) với pipeline OpenCV.
+
+    python -m pytest -q test_fused.py
+"""
+import glob
+import os
+
+import cv2
+import numpy as np
+import pytest
+
+import fused
+from config import AppConfig
+from image_processing import SketchPipeline, dodge_blend, sharpen_with_edges
+
+EXAMPLES = sorted(glob.glob(os.path.join(os.path.dirname(__file__), "examples", "*")))
+
+# viền REFLECT_101 với ảnh 1 dòng / 1 cột, và mép khối dòng song song
+B = fused._BAND_ROWS
+SHAPES = [
+    (1, 1), (1, 2), (2, 1), (1, 37), (37, 1), (2, 2), (3, 5),
+    (B - 1, 17), (B, 17), (B + 1, 17), (2 * B, 9), (2 * B + 1, 9), (3 * B - 2, 31),
+]
+
+
+def _synthetic(shape, seed=0) -> np.ndarray:
+    """Ảnh BGR có nhiễu và các khối tương phản (đủ biên Canny cho nhánh đậm)."""
+    rng = np.random.default_rng(seed)
+    h, w = shape
+    image = rng.integers(0, 256, (h, w, 3), dtype=np.uint8)
+    image[h // 3:, : w // 2] //= 4
+    image[: h // 2, w // 3:] |= 0xC0
+    return image
+
+
+def _assert_agree(image: np.ndarray, config: AppConfig) -> None:
+    for name, stats in fused.check_agreement(image, config).items():
+        assert stats["max_abs_diff"] == 0, (name, image.shape, stats)
+
+
+@pytest.mark.parametrize("shape", SHAPES)
+def test_shapes(shape):
+    config = AppConfig()
+    config.edge.low_threshold, config.edge.high_threshold = 20, 60
+    _assert_agree(_synthetic(shape), config)
+
+
+def test_non_contiguous_views():
+    base = _synthetic((3 * B + 7, 97), seed=1)
+    for view in (base[::2, ::3], base[5:-3, 7:-2], base[:, ::-1]):
+        assert not view.flags.c_contiguous
+        _assert_agree(view, AppConfig())
+
+
+@pytest.mark.parametrize("backend", fused.FUSED_BACKENDS)
+def test_kernels_on_plane_views(backend):
+    # gray / blur / edges là view không liên tục (ví dụ một kênh của ảnh BGR)
+    image = _synthetic((2 * B + 3, 45), seed=2)
+    image[:, :, 2] = np.where(image[:, :, 2] > 200, 255, 0)
+    gray, smooth, edges = image[:, :, 0], image[:, :, 1], image[:, :, 2]
+    k = 5
+    expected_soft = dodge_blend(np.ascontiguousarray(gray), np.ascontiguousarray(smooth), k)
+    expected_strong = sharpen_with_edges(expected_soft, edges)
+    blur_inv = fused.blur_inverted(np.ascontiguousarray(smooth), k)
+
+    assert np.array_equal(fused.dodge(gray, blur_inv, backend), expected_soft)
+    assert np.array_equal(fused.masked_sharpen(expected_soft, edges, backend), expected_strong)
+    assert np.array_equal(fused.dodge_sharpen(gray, blur_inv, edges, backend), expected_strong)
+    out = np.empty(gray.shape, np.uint8)
+    assert fused.dodge_sharpen(gray, blur_inv, edges, backend, out=out) is out
+    assert np.array_equal(out, expected_strong)
+
+
+@pytest.mark.parametrize("backend", fused.FUSED_BACKENDS)
+def test_pipeline_fused(backend):
+    image = _synthetic((B + 9, 70), seed=3)
+    config = AppConfig()
+    reference = SketchPipeline()
+    pipeline = SketchPipeline(fused=backend)
+    assert np.array_equal(pipeline.dodge(image, config), reference.dodge(image, config))
+    assert np.array_equal(pipeline.strong(image, config), reference.strong(image, config))
+
+
+@pytest.mark.parametrize("path", EXAMPLES, ids=os.path.basename)
+def test_examples(path):
+    image = cv2.imread(path, cv2.IMREAD_COLOR)
+    assert image is not None, path
+    _assert_agree(image, AppConfig())
@@ -0,0 +1,30 @@
+"""
+Cache kết quả (result_cache.py): đếm dung lượng của tầng bộ nhớ và tầng đĩa.
+
+    python -m pytest -q test_result_cache.py
+"""
+import numpy as np
+
+from result_cache import DiskCache, MemoryLRU
+
+
+def test_disk_put_same_key_twice(tmp_path):
+    cache = DiskCache(str(tmp_path), max_bytes=1 << 20)
+    cache.put("ab12", np.zeros((64, 64), np.uint8))
+    first = cache._nbytes
+    cache.put("ab12", np.ones((64, 64), np.uint8))
+    assert cache._nbytes == first
+    assert np.array_equal(cache.get("ab12"), np.ones((64, 64), np.uint8))
+
+    # file lớn hơn thay file cũ: chỉ cộng phần chênh lệch
+    cache.put("ab12", np.zeros((128, 64), np.uint8))
+    assert cache._nbytes == sum(size for _, _, size in cache._entries())
+    # mở lại thư mục đếm đúng như vậy
+    assert DiskCache(str(tmp_path), max_bytes=1 << 20)._nbytes == cache._nbytes
+
+
+def test_memory_put_same_key_twice():
+    cache = MemoryLRU(max_bytes=1 << 20)
+    cache.put("k", np.zeros(100, np.uint8))
+    cache.put("k", np.zeros(300, np.uint8))
+    assert cache.nbytes == 300
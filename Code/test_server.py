@@ -0,0 +1,63 @@
+"""
+Dịch vụ HTTP (server.py): config không hợp lệ trả về 400, không phải 500.
+
+    python -m pytest -q test_server.py
+"""
+import json
+import os
+import threading
+import urllib.error
+import urllib.request
+import uuid
+
+import pytest
+
+from server import ServiceSettings, make_server
+
+IMAGE = os.path.join(os.path.dirname(__file__), "examples", "anh2.png")
+
+
+@pytest.fixture(scope="module")
+def base_url():
+    server = make_server(ServiceSettings(port=0, workers=1))
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{server.server_address[1]}"
+    server.shutdown()
+    server.server_close()
+    server.service.close()
+
+
+def _post_sketch(base_url: str, config: str):
+    """POST /sketch dạng multipart với field config; trả về (mã HTTP, body)."""
+    boundary = uuid.uuid4().hex
+    with open(IMAGE, "rb") as f:
+        fields = {"image": f.read(), "config": config.encode()}
+    body = b""
+    for name, value in fields.items():
+        body += (
+            f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"; filename="x"\r\n\r\n'
+        ).encode() + value + b"\r\n"
+    body += f"--{boundary}--\r\n".encode()
+    request = urllib.request.Request(
+        base_url + "/sketch",
+        data=body,
+        headers={"Content-Type": f"multipart/form-data; boundary={boundary}"},
+    )
+    try:
+        with urllib.request.urlopen(request) as response:
+            return response.status, response.read()
+    except urllib.error.HTTPError as exc:
+        return exc.code, exc.read()
+
+
+@pytest.mark.parametrize("config", [[1], {"bilateral": 3}, {"edge": 3}, "edge"])
+def test_invalid_config_is_bad_request(base_url, config):
+    status, body = _post_sketch(base_url, json.dumps(config))
+    assert status == 400, body
+    assert "error" in json.loads(body)
+
+
+def test_valid_config(base_url):
+    status, _ = _post_sketch(base_url, json.dumps({"edge": {"low_threshold": 40}}))
+    assert status == 200
@@ -0,0 +1,271 @@
+"""
+Chế độ video / webcam: sketch từng frame bằng process_image.
+
+Ba tầng giải mã -> xử lý -> ghi chạy trên ba thread, nối với nhau bằng hàng
+đợi có giới hạn nên chạy chồng lên nhau thay vì tuần tự. Buffer frame vào/ra
+và buffer trung gian (SketchWorkspace) được tái sử dụng nên ở trạng thái ổn
+định không cấp phát mảng mới cho mỗi frame. Có thể làm mượt theo thời gian để
+nét không bị nhấp nháy giữa các frame.
+
+Ví dụ:
+    python video.py input.mp4 output.mp4 --sharpness 60 --temporal 0.5
+    python video.py 0 --show            # webcam số 0, chỉ hiển thị
+"""
+import argparse
+import queue
+import sys
+import threading
+import time
+from dataclasses import dataclass
+from typing import Optional, Sequence, Union
+
+import cv2
+import numpy as np
+
+from config import AppConfig
+from image_processing import SketchWorkspace, process_image
+
+# đánh dấu hết luồng frame
+_END = object()
+
+
+@dataclass
+class VideoReport:
+    frames: int = 0
+    elapsed: float = 0.0
+
+    @property
+    def fps(self) -> float:
+        return self.frames / self.elapsed if self.elapsed > 0 else 0.0
+
+
+class TemporalSmoother:
+    """
+    Trung bình trượt mũ (EMA) của ảnh sketch: out = alpha * frame + (1 - alpha) * out_trước.
+    alpha = 1 tắt làm mượt; alpha nhỏ -> nét ổn định hơn nhưng trễ hơn.
+    """
+
+    def __init__(self, alpha: float) -> None:
+        self.alpha = float(alpha)
+        self._acc: Optional[np.ndarray] = None
+
+    def __call__(self, frame: np.ndarray, out: Optional[np.ndarray] = None) -> np.ndarray:
+        if self._acc is None or self._acc.shape != frame.shape:
+            self._acc = frame.astype(np.float32)
+        else:
+            cv2.accumulateWeighted(frame, self._acc, self.alpha)
+        return cv2.convertScaleAbs(self._acc, dst=out)
+
+
+def open_capture(source: Union[str, int]) -> cv2.VideoCapture:
+    """Mở file video, hoặc thiết bị nếu `source` là số (ví dụ "0")."""
+    if isinstance(source, str) and source.isdigit():
+        source = int(source)
+    cap = cv2.VideoCapture(source)
+    if not cap.isOpened():
+        raise IOError(f"Không mở được nguồn video: {source}")
+    return cap
+
+
+def sketch_video(
+    source: Union[str, int],
+    output: Optional[str] = None,
+    config: Optional[AppConfig] = None,
+    sharpness: int = 50,
+    temporal_alpha: float = 1.0,
+    queue_size: int = 4,
+    fourcc: str = "mp4v",
+    show: bool = False,
+    max_frames: Optional[int] = None,
+    gray: bool = False,
+) -> VideoReport:
+    """
+    Sketch một video (file hoặc thiết bị) và ghi ra `output` (nếu có).
+    queue_size: số frame tối đa chờ giữa hai tầng liên tiếp.
+    gray: giữ frame kết quả 1 kênh và ghi video xám (isColor=False).
+    """
+    if config is None:
+        config = AppConfig()
+
+    cap = open_capture(source)
+    fps = cap.get(cv2.CAP_PROP_FPS) or 30.0
+
+    # vòng buffer: mỗi frame giải mã vào một buffer có sẵn, buffer được trả lại
+    # sau khi tầng xử lý dùng xong; đủ cho mọi frame đang nằm trong hàng đợi
+    n_buffers = queue_size + 2
+    free_in: "queue.Queue[Optional[np.ndarray]]" = queue.Queue()
+    for _ in range(n_buffers):
+        free_in.put(None)
+    free_out: "queue.Queue[Optional[np.ndarray]]" = queue.Queue()
+    for _ in range(n_buffers):
+        free_out.put(None)
+
+    decoded: "queue.Queue" = queue.Queue(maxsize=queue_size)
+    processed: "queue.Queue" = queue.Queue(maxsize=queue_size)
+    stop = threading.Event()
+    errors: list = []
+
+    def put(q: "queue.Queue", item) -> bool:
+        """put có thể bị huỷ khi một tầng khác gặp lỗi."""
+        while not stop.is_set():
+            try:
+                q.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def get(q: "queue.Queue"):
+        while True:
+            try:
+                return q.get(timeout=0.1)
+            except queue.Empty:
+                if stop.is_set():
+                    return _END
+
+    def decode() -> None:
+        try:
+            count = 0
+            while not stop.is_set() and (max_frames is None or count < max_frames):
+                buf = get(free_in)
+                if buf is _END:
+                    break
+                ok, frame = cap.read(buf) if buf is not None else cap.read()
+                if not ok:
+                    break
+                count += 1
+                if not put(decoded, frame):
+                    break
+        except Exception as exc:
+            errors.append(exc)
+            stop.set()
+        finally:
+            put(decoded, _END)
+
+    def process() -> None:
+        workspace = SketchWorkspace()
+        smoother = TemporalSmoother(temporal_alpha) if temporal_alpha < 1.0 else None
+        try:
+            while True:
+                frame = get(decoded)
+                if frame is _END:
+                    break
+                result, _ = process_image(
+                    frame, mode="pencil", config=config, sharpness=sharpness,
+                    workspace=workspace, output="gray" if gray else "bgr",
+                )
+                # frame đã dùng xong -> trả buffer cho tầng giải mã
+                free_in.put(frame)
+
+                # kết quả nằm trong workspace -> chép sang một buffer của vòng ra
+                out = get(free_out)
+                if out is _END:
+                    break
+                if out is None or out.shape != result.shape:
+                    out = np.empty_like(result)
+                if smoother is not None:
+                    result = smoother(result, out)
+                else:
+                    np.copyto(out, result)
+                    result = out
+                if not put(processed, result):
+                    break
+        except Exception as exc:
+            errors.append(exc)
+            stop.set()
+        finally:
+            put(processed, _END)
+
+    writer: Optional[cv2.VideoWriter] = None
+    report = VideoReport()
+    threads = [
+        threading.Thread(target=decode, name="video-decode", daemon=True),
+        threading.Thread(target=process, name="video-process", daemon=True),
+    ]
+    start = time.perf_counter()
+    for t in threads:
+        t.start()
+
+    # tầng ghi chạy trên thread hiện tại (cv2.imshow cần chạy ở đây)
+    try:
+        while True:
+            result = get(processed)
+            if result is _END:
+                break
+            if output:
+                if writer is None:
+                    h, w = result.shape[:2]
+                    writer = cv2.VideoWriter(
+                        output, cv2.VideoWriter_fourcc(*fourcc), fps, (w, h),
+                        isColor=not gray,
+                    )
+                    if not writer.isOpened():
+                        raise IOError(f"Không ghi được video: {output}")
+                writer.write(result)
+            if show:
+                cv2.imshow("Sketch", result)
+                if cv2.waitKey(1) & 0xFF in (27, ord("q")):
+                    stop.set()
+            free_out.put(result)
+            report.frames += 1
+    finally:
+        stop.set()
+        for t in threads:
+            t.join()
+        cap.release()
+        if writer is not None:
+            writer.release()
+        if show:
+            cv2.destroyAllWindows()
+
+    report.elapsed = time.perf_counter() - start
+    if errors:
+        raise errors[0]
+    return report
+
+
+# ---------- CLI ----------
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description="Chuyển video / webcam thành tranh vẽ chì.")
+    parser.add_argument("source", help="File video hoặc chỉ số thiết bị (ví dụ 0)")
+    parser.add_argument("output", nargs="?", default=None, help="File video kết quả")
+    parser.add_argument("--sharpness", type=int, default=50)
+    parser.add_argument("--temporal", type=float, default=1.0,
+                        help="Hệ số làm mượt theo thời gian (0 < alpha <= 1, 1 = tắt)")
+    parser.add_argument("--queue-size", type=int, default=4)
+    parser.add_argument("--fourcc", default="mp4v")
+    parser.add_argument("--show", action="store_true", help="Hiển thị kết quả trong cửa sổ")
+    parser.add_argument("--max-frames", type=int, default=None)
+    parser.add_argument("--gray", action="store_true",
+                        help="Ghi video xám 1 kênh (nếu codec hỗ trợ)")
+    return parser
+
+
+def main(argv: Optional[Sequence[str]] = None) -> int:
+    args = build_parser().parse_args(argv)
+    if not args.output and not args.show:
+        print("Cần chỉ định file kết quả hoặc --show", file=sys.stderr)
+        return 2
+
+    try:
+        report = sketch_video(
+            args.source,
+            args.output,
+            sharpness=args.sharpness,
+            temporal_alpha=args.temporal,
+            queue_size=args.queue_size,
+            fourcc=args.fourcc,
+            show=args.show,
+            max_frames=args.max_frames,
+            gray=args.gray,
+        )
+    except IOError as exc:
+        print(exc, file=sys.stderr)
+        return 2
+    print(f"Xong {report.frames} frame trong {report.elapsed:.1f}s ({report.fps:.1f} fps)")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())